@@ -0,0 +1,101 @@
+"""This module stores methods for analytics of the fleet (API)."""
+from bisect import bisect_left
+from datetime import timedelta
+from itertools import accumulate
+from flask import jsonify, request, url_for, current_app
+from ..models import Car, Permission, Rental
+from . import api
+from app.api.decorators import token_required, permission_required
+from .errors import bad_request
+from .query_features import get_date_arg
+from .. import db
+
+# Length of the bucket in minutes
+GRANULARITIES = {'day': 24 * 60, 'hour': 60}
+
+MINUTE = timedelta(minutes=1)
+
+
+def occupied_minutes(cars, starts, ends, edges, number_of_cars):
+    """Count rented minutes of each car in each bucket.
+
+    ``F(e)``, the number of rented minutes of the car before the edge ``e``, is the sum of ``e - start`` for
+    rentals starting before ``e`` minus the sum of ``e - end`` for rentals ending before ``e``. Both sums are
+    read from prefix sums of sorted minutes of each car, so the cost is O((rentals + cars * edges) log rentals)
+    and doesn't depend on the length of rentals.
+
+    :param cars: Index of the car of each rental
+    :type cars: list
+    :param starts: Beginnings of rentals in minutes from the beginning of the period, clipped to the period
+    :type starts: list
+    :param ends: Ends of rentals in minutes from the beginning of the period, clipped to the period
+    :type ends: list
+    :param edges: Edges of buckets in minutes, the first is 0 and the last is the length of the period
+    :type edges: list
+    :param number_of_cars: Number of cars
+    :type number_of_cars: int
+    :return: Rented minutes, number_of_cars lists of minutes in buckets
+    :rtype: list
+    """
+    car_starts = [[] for _ in range(number_of_cars)]
+    car_ends = [[] for _ in range(number_of_cars)]
+    for car, start, end in zip(cars, starts, ends):
+        car_starts[car].append(start)
+        car_ends[car].append(end)
+
+    def minutes_before_edges(points):
+        points.sort()
+        prefix = list(accumulate(points, initial=0))
+        counts = [bisect_left(points, edge) for edge in edges]
+        return [count * edge - prefix[count] for count, edge in zip(counts, edges)]
+
+    occupied = []
+    for car in range(number_of_cars):
+        before = [started - ended for started, ended in zip(minutes_before_edges(car_starts[car]),
+                                                            minutes_before_edges(car_ends[car]))]
+        occupied.append([following - previous for previous, following in zip(before, before[1:])])
+    return occupied
+
+
+@api.route('/analytics/utilization/', methods=['GET'])
+@token_required
+@permission_required(Permission.ADMIN)
+def get_utilization(user_id: int):
+    from_date = get_date_arg('from')
+    to_date = get_date_arg('to')
+    if to_date <= from_date:
+        return bad_request(message="Wrong dates, 'to' must be later than 'from'")
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in GRANULARITIES:
+        return bad_request(message=f"Wrong granularity, acceptable values: {', '.join(GRANULARITIES)}")
+    period_start = from_date.replace(second=0, microsecond=0)
+    length = (to_date - period_start) // MINUTE
+    bucket_length = GRANULARITIES[granularity]
+    max_buckets = current_app.config['ANALYTICS_MAX_BUCKETS']
+    if -(-length // bucket_length) > max_buckets:
+        return bad_request(message=f"Too many buckets, maximum number is {max_buckets}")
+    edges = list(range(0, length, bucket_length)) + [length]
+
+    car_ids = [car_id for car_id, in db.session.query(Car.id).order_by(Car.id)]
+    car_numbers = {car_id: number for number, car_id in enumerate(car_ids)}
+    rows = db.session.query(Rental.cars_id, Rental.from_date, Rental.to_date).filter(
+        Rental.to_date > from_date, Rental.from_date < to_date).all()
+    cars = [car_numbers[car_id] for car_id, _, _ in rows]
+    starts = [min(max((start - period_start) // MINUTE, 0), length) for _, start, _ in rows]
+    ends = [min(max((end - period_start) // MINUTE, 0), length) for _, _, end in rows]
+
+    occupied = occupied_minutes(cars, starts, ends, edges, len(car_ids))
+    bucket_minutes = [following - previous for previous, following in zip(edges, edges[1:])]
+    buckets = [int((period_start + edge * MINUTE).strftime('%Y%m%d%H%M')) for edge in edges[:-1]]
+    data = []
+    for car_id, car_occupied in zip(car_ids, occupied):
+        total = sum(car_occupied)
+        data.append({'car_id': car_id,
+                     'car_url': url_for('api.get_car', car_id=car_id),
+                     'utilization': [round(min(minutes / length_of_bucket * 100, 100), 2)
+                                     for minutes, length_of_bucket in zip(car_occupied, bucket_minutes)],
+                     'rental_hours': [round(minutes / 60, 2) for minutes in car_occupied],
+                     'total_utilization': round(min(total / length * 100, 100), 2),
+                     'total_rental_hours': round(total / 60, 2)})
+    return jsonify({'success': True, 'granularity': granularity, 'buckets': buckets, 'data': data,
+                    'number_of_records': len(data)})
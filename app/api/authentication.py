@@ -1,9 +1,9 @@
 """This module stores methods for authentication while using api."""
 from flask import jsonify, request
-from ..models import User, Permission, Role
+from ..models import User, Permission, Role, RefreshToken
 from . import api
 from app.api.errors import conflict, bad_request, unauthorized
-from app.api.decorators import validate_json_content_type, token_required, permission_required
+from app.api.decorators import validate_json_content_type, token_required, permission_required, get_current_api_user
 from .. import db
 
 
@@ -22,8 +22,10 @@ def register():
     db.session.commit()
 
     token = user.generate_jwt_token()
+    refresh_token = RefreshToken.issue(user.id)
+    db.session.commit()
 
-    return jsonify({'success': True, 'token': token}), 201
+    return jsonify({'success': True, 'token': token, 'refresh_token': refresh_token}), 201
 
 
 @api.route('/auth/login/', methods=['POST'])
@@ -43,14 +45,33 @@ def login():
         return unauthorized(message='Invalid credentials')
 
     token = user.generate_jwt_token()
+    refresh_token = RefreshToken.issue(user.id)
+    db.session.commit()
+
+    return jsonify({'success': True, 'token': token, 'refresh_token': refresh_token})
+
+
+@api.route('/auth/refresh/', methods=['POST'])
+@validate_json_content_type
+def refresh():
+    args = request.get_json()
+    if not isinstance(args, dict) or 'refresh_token' not in args:
+        return bad_request(message='No refresh_token')
+    if not isinstance(args['refresh_token'], str):
+        return bad_request(message='Wrong refresh_token, it must be a string')
+    rotated = RefreshToken.rotate(args['refresh_token'])
+    db.session.commit()
+    if rotated is None:
+        return unauthorized(message='Invalid refresh token. Login to get new one')
+    user, refresh_token = rotated
 
-    return jsonify({'success': True, 'token': token})
+    return jsonify({'success': True, 'token': user.generate_jwt_token(), 'refresh_token': refresh_token})
 
 
 @api.route('/auth/about_me/', methods=['GET'])
 @token_required
 def get_current_user(user_id: int):
-    user = User.query.get_or_404(user_id, description=f'User with id {user_id} not found')
+    user = get_current_api_user()
     return jsonify({'success': True, 'data': user.to_json_user_data()})
 
 
@@ -59,7 +80,7 @@ def get_current_user(user_id: int):
 @validate_json_content_type
 def update_password_and_email(user_id: int):
     args = request.get_json()
-    user = User.query.get_or_404(user_id, description=f'User with id {user_id} not found')
+    user = get_current_api_user()
     if 'password' not in args:
         return bad_request(message='No password')
     if 'new_password' not in args and 'new_email' not in args:
@@ -69,6 +90,7 @@ def update_password_and_email(user_id: int):
     else:
         if 'new_password' in args:
             user.password = args['new_password']
+            RefreshToken.revoke_all(user.id)
         if 'new_email' in args:
             query = User.query.filter_by(email=args['new_email']).first()
             if query:
@@ -86,7 +108,7 @@ def update_password_and_email(user_id: int):
 @validate_json_content_type
 def update_user(user_id: int):
     args = request.get_json()
-    user = User.query.get_or_404(user_id, description=f'User with id {user_id} not found')
+    user = get_current_api_user()
 
     if 'email' in args:
         if User.query.filter(User.email == args['email']).first() is not None:
@@ -100,6 +122,7 @@ def update_user(user_id: int):
     if 'new_password' in args:
         if not user.verify_password(args['password']):
             return unauthorized(message='Invalid credentials, wrong password')
+        RefreshToken.revoke_all(user_id)
 
     User.update_from_json(user_id, args)
     db.session.commit()
@@ -112,7 +135,7 @@ def update_user(user_id: int):
 @permission_required(Permission.ADMIN)
 @validate_json_content_type
 def update_user_by_admin(user_id: int):
-    logged_user = User.query.get_or_404(user_id, description=f'User with id {user_id} not found')
+    get_current_api_user()
     args = request.get_json()
     if 'user_to_edit_id' not in args:
         return bad_request(message='No user_to_edit_id')
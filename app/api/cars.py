@@ -1,36 +1,93 @@
 """This module stores methods for cars (API)."""
+from base64 import b64encode
+from datetime import datetime, timedelta
 from flask import jsonify, request
+from sqlalchemy import exists
 from app.api.decorators import validate_json_content_type, token_required, permission_required
 from app.api.errors import bad_request
-from .query_features import apply_filter, apply_args_filter, get_args, get_pagination, sort_by
+from .query_features import apply_filter, get_date_arg, get_fields, get_pagination, is_unpaginated, \
+    select_fields, sort_by
+from .streaming import stream_json
+from ..booking import RENTAL_BREAK, get_rental_calendar, next_free_windows
+from ..booking.sql import overlap_condition
 from ..models import Car, Permission
 from . import api
 from .. import db
 
+NEXT_SLOTS_MAX_NUMBER = 10
+
 
 @api.route('/cars/', methods=['GET'])
 def get_all_cars():
     query = Car.query
     query = sort_by(query, Car)
     query = apply_filter(query, Car)
-    cars_with_pagination, pagination = get_pagination(query, 'api.get_all_cars')
-    params = request.args.get('params', "")
-    cars = [get_args(car.to_json(), params) for car in cars_with_pagination]
-    cars = apply_args_filter(cars)
-    if request.args.get('page') or request.args.get('per_page'):
-        return jsonify({'data': cars, 'number_of_records': len(cars), 'pagination': pagination, 'success': True})
-    else:
-        return jsonify({'data': cars, 'number_of_records': len(cars), 'success': True})
+    fields = get_fields(Car.JSON_FIELDS)
+    if is_unpaginated():
+        return stream_json(query, lambda cars: Car.to_json_list(cars, fields))
+    cars_with_pagination, pagination = get_pagination(query, 'api.get_all_cars', Car)
+    cars = Car.to_json_list(cars_with_pagination, fields)
+    return jsonify({'data': cars, 'number_of_records': len(cars), 'pagination': pagination, 'success': True})
+
+
+@api.route('/cars/available/', methods=['GET'])
+def get_available_cars():
+    from_date = get_date_arg('from')
+    to_date = get_date_arg('to')
+    if to_date <= from_date:
+        return bad_request(message="Wrong dates, 'to' must be later than 'from'")
+    query = Car.query.filter(~exists().where(overlap_condition(Car.id, from_date, to_date + RENTAL_BREAK)))
+    query = sort_by(query, Car)
+    query = apply_filter(query, Car, ignore={'from', 'to'})
+    fields = get_fields(Car.JSON_SHORT_FIELDS)
+    if is_unpaginated():
+        return stream_json(query, lambda cars: [select_fields(car.to_json_short(), fields) for car in cars])
+    cars_with_pagination, pagination = get_pagination(query, 'api.get_available_cars', Car)
+    cars = [select_fields(car.to_json_short(), fields) for car in cars_with_pagination]
+    return jsonify({'data': cars, 'number_of_records': len(cars), 'pagination': pagination, 'success': True})
 
 
 @api.route('/cars/<int:car_id>/', methods=['GET'])
 def get_car(car_id: int):
     query = Car.query.get_or_404(car_id, description=f'Car with id {car_id} not found')
-    params = request.args.get('params', "")
-    car = get_args(query.to_json(), params)
+    car = query.to_json(get_fields(Car.JSON_FIELDS))
     return jsonify({'data': car, 'success': True})
 
 
+@api.route('/cars/<int:car_id>/next-slot/', methods=['GET'])
+def get_car_next_slots(car_id: int):
+    Car.query.get_or_404(car_id, description=f'Car with id {car_id} not found')
+    duration = request.args.get('duration', type=int)
+    if duration is None or duration <= 0:
+        return bad_request(message='Wrong duration, acceptable value: number of minutes greater than 0')
+    number = request.args.get('number', 3, type=int)
+    if number is None or not 0 < number <= NEXT_SLOTS_MAX_NUMBER:
+        return bad_request(message=f'Wrong number, acceptable value: from 1 to {NEXT_SLOTS_MAX_NUMBER}')
+    earliest = datetime.now().replace(second=0, microsecond=0) + timedelta(minutes=1)
+    after = max(get_date_arg('after', earliest), earliest)
+    windows = next_free_windows(car_id, after, timedelta(minutes=duration), number)
+    slots = [{'from_date': int(from_date.strftime('%Y%m%d%H%M')),
+              'latest_to_date': int(to_date.strftime('%Y%m%d%H%M')) if to_date is not None else None}
+             for from_date, to_date in windows]
+    return jsonify({'data': slots, 'number_of_records': len(slots), 'success': True})
+
+
+@api.route('/cars/<int:car_id>/calendar/', methods=['GET'])
+def get_car_calendar(car_id: int):
+    Car.query.get_or_404(car_id, description=f'Car with id {car_id} not found')
+    calendar = get_rental_calendar().load(car_id)
+    occupied = [{'from_date': int(from_date.strftime('%Y%m%d%H%M')), 'to_date': int(to_date.strftime('%Y%m%d%H%M'))}
+                for from_date, to_date in calendar.periods()]
+    data = {
+        'from_date': int(calendar.start.strftime('%Y%m%d%H%M')),
+        'slot_minutes': int(calendar.slot.total_seconds() // 60),
+        'number_of_slots': calendar.number_of_slots,
+        'bitmap': b64encode(bytes(calendar.bitmap)).decode('ascii'),
+        'occupied': occupied
+    }
+    return jsonify({'data': data, 'success': True})
+
+
 @api.route('/cars/', methods=['POST'])
 @token_required
 @permission_required(Permission.MODERATE)
@@ -1,7 +1,8 @@
 """This module stores methods for comments (API)."""
 from flask import jsonify, request
 from app.api.decorators import token_required, validate_json_content_type
-from .query_features import apply_filter, get_args, get_pagination, sort_by
+from .query_features import apply_filter, get_fields, get_pagination, is_unpaginated, select_fields, sort_by
+from .streaming import stream_json
 from . import api
 from ..models import Comment
 from .. import db
@@ -12,21 +13,18 @@ def show_comments():
     query = Comment.query
     query = sort_by(query, Comment)
     query = apply_filter(query, Comment)
-    comments_with_pagination, pagination = get_pagination(query, 'api.show_comments')
-    params = request.args.get('params', "")
-    comments = [get_args(comment.to_json(), params) for comment in comments_with_pagination]
-    if request.args.get('per_page'):
-        return jsonify(
-            {'data': comments, 'number_of_records': len(comments), 'pagination': pagination, 'success': True})
-    else:
-        return jsonify({'data': comments, 'number_of_records': len(comments), 'success': True})
+    fields = get_fields(Comment.JSON_FIELDS)
+    if is_unpaginated():
+        return stream_json(query, lambda comments: [select_fields(comment.to_json(), fields) for comment in comments])
+    comments_with_pagination, pagination = get_pagination(query, 'api.show_comments', Comment)
+    comments = [select_fields(comment.to_json(), fields) for comment in comments_with_pagination]
+    return jsonify({'data': comments, 'number_of_records': len(comments), 'pagination': pagination, 'success': True})
 
 
 @api.route('/comments/<int:comment_id>/', methods=['GET'])
 def show_comment(comment_id: int):
     query = Comment.query.get_or_404(comment_id, description=f'Comment with id {comment_id} not found')
-    params = request.args.get('params', "")
-    comment = get_args(query.to_json(), params)
+    comment = select_fields(query.to_json(), get_fields(Comment.JSON_FIELDS))
     return jsonify({'success': True, 'data': comment})
 
 
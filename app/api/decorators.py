@@ -1,9 +1,126 @@
 """This module stores decorators for api."""
 from functools import wraps
-from flask import request, current_app
+from flask import abort, current_app, g, request
 import jwt
+from sqlalchemy.orm import joinedload
 from app.api.errors import unauthorized, bad_request, unsupported_media_type, forbidden
-from ..models import User
+from . import api
+from ..models import User, get_token_version
+
+
+class AuthContext:
+    """Class contains authentication of the API request: claims of the token, the user and permissions of the role.
+
+    The context is created once per request (stored on flask.g) and shared by decorators and handlers,
+    permissions are checked with the claims, the user is loaded with the role on first use.
+    """
+
+    def __init__(self, claims):
+        """Create context from the decoded token.
+
+        :param claims: Claims of the JWT
+        :type claims: dict
+        """
+        self.claims = claims
+        self.user_id = claims['user_id']
+        self._user = None
+        self._user_loaded = False
+
+    @property
+    def user(self):
+        """User of the token (None if the user doesn't exist).
+
+        :return: User
+        :rtype: User
+        """
+        if not self._user_loaded:
+            self._user = User.query.options(joinedload(User.role)).get(self.user_id)
+            self._user_loaded = True
+        return self._user
+
+    @property
+    def permissions(self):
+        """Permissions of the user's role, read from the signed claims (from the database for older tokens).
+
+        :return: Permissions (see Permission)
+        :rtype: int
+        """
+        if 'permissions' in self.claims:
+            return self.claims['permissions']
+        if self.user is None or self.user.role is None:
+            return 0
+        return self.user.role.permissions or 0
+
+    def can(self, permission):
+        """Check if the user has the permission.
+
+        :param permission: The name of the permission
+        :type permission: int
+        :return: Information if user has permission
+        :rtype: bool
+        """
+        return self.permissions & permission == permission
+
+
+@api.before_request
+def _reset_auth_context():
+    """Forget the context of the previous request (the application context may be shared by requests)."""
+    g.pop('auth_context', None)
+
+
+def get_auth_context():
+    """Return authentication of the current request, set by token_required.
+
+    :return: Authentication context or None
+    :rtype: AuthContext
+    """
+    return g.get('auth_context')
+
+
+def get_current_api_user():
+    """Return the user of the token, 404 if the user doesn't exist.
+
+    :return: User
+    :rtype: User
+    """
+    context = get_auth_context()
+    user = context.user if context is not None else None
+    if user is None:
+        user_id = context.user_id if context is not None else None
+        abort(404, description=f'User with id {user_id} not found')
+    return user
+
+
+def _authenticate():
+    """Decode the token of the request once and store the context on flask.g.
+
+    :return: Authentication context and None, or None and the error response
+    :rtype: tuple
+    """
+    context = get_auth_context()
+    if context is not None:
+        return context, None
+
+    if 'Authorization' not in request.headers:
+        return None, bad_request(message='No Authorization token')
+
+    auth = request.headers.get('Authorization')
+
+    if auth and 'Bearer ' in auth:
+        token = auth.split(' ')[1]
+    else:
+        return None, bad_request(message='No token, log in or register')
+
+    try:
+        payload = jwt.decode(token, current_app.config.get('SECRET_KEY'), algorithms='HS256')
+    except jwt.ExpiredSignatureError:
+        return None, unauthorized(message='Expired token. Login to get new one')
+    except jwt.InvalidTokenError:
+        return None, unauthorized(message='Invalid token. Please login or register')
+    if payload.get('ver', 0) < get_token_version(payload.get('user_id')):
+        return None, unauthorized(message='Revoked token. Login to get new one')
+    g.auth_context = context = AuthContext(payload)
+    return context, None
 
 
 def validate_json_content_type(func):
@@ -27,26 +144,10 @@ def token_required(func):
 
     @wraps(func)
     def wrapper(*args, **kwargs):
-        token = None
-
-        if 'Authorization' not in request.headers:
-            return bad_request(message='No Authorization token')
-
-        auth = request.headers.get('Authorization')
-
-        if auth and 'Bearer ' in auth:
-            token = auth.split(' ')[1]
-        else:
-            return bad_request(message='No token, log in or register')
-
-        try:
-            payload = jwt.decode(token, current_app.config.get('SECRET_KEY'), algorithms='HS256')
-        except jwt.ExpiredSignatureError:
-            return unauthorized(message='Expired token. Login to get new one')
-        except jwt.InvalidTokenError:
-            return unauthorized(message='Invalid token. Please login or register')
-        else:
-            return func(payload['user_id'], *args, **kwargs)
+        context, error = _authenticate()
+        if error is not None:
+            return error
+        return func(context.user_id, *args, **kwargs)
 
     return wrapper
 
@@ -57,12 +158,10 @@ def permission_required(permission):
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            user_id = None
-            auth = request.headers.get('Authorization')
-            if 'Bearer ' in auth:
-                token = auth.split(' ')[1]
-            user_id = jwt.decode(token, current_app.config.get('SECRET_KEY'), algorithms='HS256')['user_id']
-            if not User.query.get(user_id).can(permission):
+            context, error = _authenticate()
+            if error is not None:
+                return error
+            if not context.can(permission):
                 return forbidden('Insufficient permissions')
             return func(*args, **kwargs)
 
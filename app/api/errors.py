@@ -38,7 +38,19 @@ def unsupported_media_type(message):
     return response
 
 
+def service_unavailable(message):
+    response = jsonify({'error': 'service unavailable', 'message': message, 'success': False})
+    response.status_code = 503
+    return response
+
+
 @api.errorhandler(ValidationError)
 def validation_error(e):
     """Method used for validation new data."""
     return bad_request(e.args[0], e.args[1])
+
+
+@api.errorhandler(503)
+def service_unavailable_error(e):
+    """Method used when the server is overloaded (e.g. hashing of passwords)."""
+    return service_unavailable(e.description)
@@ -4,14 +4,14 @@ from . import api
 from ..models import NewsPost, Permission
 from app.api.decorators import validate_json_content_type, token_required, permission_required
 from app import db
-from .query_features import apply_filter, apply_args_filter, get_args, get_pagination, sort_by
+from .query_features import apply_filter, get_fields, get_pagination, is_unpaginated, sort_by
+from .streaming import stream_json
 
 
 @api.route('/posts/<int:post_id>/', methods=['GET'])
 def show_post(post_id: int):
     query = NewsPost.query.get_or_404(post_id, description=f'Post with id {post_id} not found')
-    params = request.args.get('params', "")
-    post = get_args(query.to_json(), params)
+    post = query.to_json(get_fields(NewsPost.JSON_FIELDS))
     return jsonify({'success': True, 'data': post})
 
 
@@ -20,14 +20,12 @@ def show_posts():
     query = NewsPost.query
     query = sort_by(query, NewsPost)
     query = apply_filter(query, NewsPost)
-    posts_with_pagination, pagination = get_pagination(query, 'api.show_posts')
-    params = request.args.get('params', "")
-    posts = [get_args(post.to_json(), params) for post in posts_with_pagination]
-    posts = apply_args_filter(posts)
-    if request.args.get('per_page'):
-        return jsonify({'success': True, 'data': posts, 'number_of_records': len(posts), 'pagination': pagination})
-    else:
-        return jsonify({'success': True, 'data': posts, 'number_of_records': len(posts)})
+    fields = get_fields(NewsPost.JSON_FIELDS)
+    if is_unpaginated():
+        return stream_json(query, lambda posts: NewsPost.to_json_list(posts, fields))
+    posts_with_pagination, pagination = get_pagination(query, 'api.show_posts', NewsPost)
+    posts = NewsPost.to_json_list(posts_with_pagination, fields)
+    return jsonify({'success': True, 'data': posts, 'number_of_records': len(posts), 'pagination': pagination})
 
 
 @api.route('/posts/', methods=['POST'])
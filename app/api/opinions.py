@@ -4,7 +4,8 @@ from . import api
 from ..models import Opinion
 from .decorators import token_required, validate_json_content_type
 from .. import db
-from .query_features import apply_filter, get_args, get_pagination, sort_by
+from .query_features import apply_filter, get_fields, get_pagination, is_unpaginated, select_fields, sort_by
+from .streaming import stream_json
 
 
 @api.route('/opinions/', methods=['GET'])
@@ -12,21 +13,18 @@ def show_opinions():
     query = Opinion.query
     query = sort_by(query, Opinion)
     query = apply_filter(query, Opinion)
-    opinions_with_pagination, pagination = get_pagination(query, 'api.show_opinions')
-    params = request.args.get('params', "")
-    opinions = [get_args(opinion.to_json(), params) for opinion in opinions_with_pagination]
-    if request.args.get('per_page'):
-        return jsonify(
-            {'success': True, 'data': opinions, 'number_of_records': len(opinions), 'pagination': pagination})
-    else:
-        return jsonify({'data': opinions, 'number_of_records': len(opinions), 'success': True})
+    fields = get_fields(Opinion.JSON_FIELDS)
+    if is_unpaginated():
+        return stream_json(query, lambda opinions: [select_fields(opinion.to_json(), fields) for opinion in opinions])
+    opinions_with_pagination, pagination = get_pagination(query, 'api.show_opinions', Opinion)
+    opinions = [select_fields(opinion.to_json(), fields) for opinion in opinions_with_pagination]
+    return jsonify({'success': True, 'data': opinions, 'number_of_records': len(opinions), 'pagination': pagination})
 
 
 @api.route('/opinions/<int:opinion_id>/', methods=['GET'])
 def show_opinion(opinion_id: int):
     query = Opinion.query.get_or_404(opinion_id, description=f'Opinion with id {opinion_id} not found')
-    params = request.args.get('params', "")
-    opinion = get_args(query.to_json(), params)
+    opinion = select_fields(query.to_json(), get_fields(Opinion.JSON_FIELDS))
     return jsonify({'success': True, 'data': opinion})
 
 
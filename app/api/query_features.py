@@ -1,61 +1,375 @@
 """This module stores query features: pagination, filtering, sorting (API)."""
+import binascii
+import json
+import operator
 import re
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from functools import lru_cache
 from flask_sqlalchemy import BaseQuery, DefaultMeta
-from flask import request, url_for
+from flask import current_app, request, url_for
+from sqlalchemy import and_, false, inspect, or_
 from sqlalchemy.orm.attributes import InstrumentedAttribute
 from sqlalchemy.sql.expression import BinaryExpression
-from sqlalchemy.types import DateTime
+from sqlalchemy.types import DateTime, Float, Integer
 from datetime import datetime
+from app.exceptions import ValidationError
 
 SIGNS_REGEX = re.compile(r'(.*)\[(gte|gt|lte|lt|like)\]')
+# Maximum number of compiled sortings and filters kept for reuse
+QUERY_PLAN_CACHE_SIZE = 256
+OPERATORS = {
+    "lte": operator.le,
+    "lt": operator.lt,
+    "gte": operator.ge,
+    "gt": operator.gt,
+    "=": operator.eq,
+    "like": lambda column, value: column.like(value)
+}
 
+# Query params which are not filters
+QUERY_PARAMS = {'sort', 'page', 'per_page', 'cursor', 'count', 'fields', 'params', 'format'}
 
-def get_pagination(sql_query, api_func_name):
+
+def get_positive_int_arg(name):
+    """Return a positive integer query param.
+
+    :param name: Name of the param
+    :type name: str
+    :raises ValidationError: the value is not a positive integer
+    :return: Value of the param or None if it is missing
+    :rtype: int
+    """
+    value = request.args.get(name)
+    if value is None:
+        return None
+    if not value.isdigit() or int(value) <= 0:
+        raise ValidationError(f'Wrong parameter, {name} must be a positive integer.', name)
+    return int(value)
+
+
+def get_page_size():
+    """Return ``per_page`` limited to ``API_MAX_PER_PAGE`` from the configuration.
+
+    :raises ValidationError: per_page or page is not a positive integer
+    :return: Number of records on one page or None if per_page is missing
+    :rtype: int
+    """
+    get_positive_int_arg('page')
+    per_page = get_positive_int_arg('per_page')
+    if per_page is None:
+        return None
+    return min(per_page, current_app.config.get('API_MAX_PER_PAGE', 500))
+
+
+def is_unpaginated():
+    """Check if the list is requested without ``per_page`` and ``cursor``, list endpoints stream all records then
+    (see ``streaming.stream_json``).
+
+    :raises ValidationError: per_page or page is not a positive integer
+    :return: The information if the list is not paginated
+    :rtype: bool
+    """
+    return get_page_size() is None and 'cursor' not in request.args
+
+
+def get_pagination(sql_query, api_func_name, model):
     """Paginate SQL query results.
 
+    With the ``cursor`` param the keyset pagination is used instead of pages (see ``get_keyset_pagination``).
+    ``per_page`` is limited to ``API_MAX_PER_PAGE`` from the configuration, cursor pages without it have this size.
+
+    :param sql_query: The SQL Query
+    :type sql_query: BaseQuery
+    :param api_func_name: Name of api function
+    :type api_func_name: str
+    :param model: Name of model
+    :type model: DefaultMeta
+    :raises ValidationError: per_page or page is not a positive integer
+    :return: Results of SQL query with pagination and information about pagination
+    :rtype: tuple[list, dict]
+    """
+    per_page = get_page_size() or current_app.config.get('API_MAX_PER_PAGE', 500)
+    if 'cursor' in request.args:
+        return get_keyset_pagination(sql_query, api_func_name, model, per_page)
+    page = get_positive_int_arg('page') or 1
+    request_params = {key: value for key, value in request.args.items() if key != 'page'}
+    paginate_object = sql_query.paginate(page=page, per_page=per_page, error_out=False)
+    pagination = {
+        'number_of_all_pages': paginate_object.pages,
+        'number_of_all_records': paginate_object.total,
+        'current_page_url': url_for(api_func_name, page=page, **request_params)
+    }
+
+    if paginate_object.has_next:
+        pagination['next_page'] = url_for(api_func_name, page=paginate_object.next_num, **request_params)
+
+    if paginate_object.has_prev:
+        pagination['previous_page'] = url_for(api_func_name, page=paginate_object.prev_num, **request_params)
+    return paginate_object.items, pagination
+
+
+def get_keyset_pagination(sql_query, api_func_name, model, per_page):
+    """Paginate SQL query results with cursors (keyset pagination).
+
+    Records are ordered by the ``sort`` columns and the primary key. The cursor contains values of these columns
+    of the last (or the first) record of the page, the next page starts after them, so there is no OFFSET and no
+    COUNT(*) - the number of all records is added only with ``count=true``. ``cursor=`` (empty) is the first page,
+    next and previous cursors are opaque strings in the urls of the pagination.
+
     :param sql_query: The SQL Query
     :type sql_query: BaseQuery
     :param api_func_name: Name of api function
     :type api_func_name: str
+    :param model: Name of model
+    :type model: DefaultMeta
+    :param per_page: Number of records on one page
+    :type per_page: int
+    :raises ValidationError: cursor has wrong format or is from the query with other sorting
     :return: Results of SQL query with pagination and information about pagination
     :rtype: tuple[list, dict]
     """
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', type=int)
-    if per_page and per_page > 0 and page > 0:
-        request_params = {key: value for key, value in request.args.items() if key != 'page'}
-        paginate_object = sql_query.paginate(page=page, per_page=per_page, error_out=False)
-        pagination = {
-            'number_of_all_pages': paginate_object.pages,
-            'number_of_all_records': paginate_object.total,
-            'current_page_url': url_for(api_func_name, page=page, **request_params)
-        }
-
-        if paginate_object.has_next:
-            pagination['next_page'] = url_for(api_func_name, page=paginate_object.next_num, **request_params)
-
-        if paginate_object.has_prev:
-            pagination['previous_page'] = url_for(api_func_name, page=paginate_object.prev_num, **request_params)
-        return paginate_object.items, pagination
+    sorting = request.args.get('sort', '')
+    columns = get_sort_columns(model)
+    mapper = inspect(model)
+    sorted_keys = {column.key for column, _ in columns}
+    columns += [(getattr(model, mapper.get_property_by_column(column).key), False) for column in mapper.primary_key
+                if mapper.get_property_by_column(column).key not in sorted_keys]
+
+    cursor = request.args.get('cursor')
+    backwards = False
+    query = sql_query.order_by(None)
+    if cursor:
+        values, backwards = _decode_cursor(cursor, sorting, columns)
+        if backwards:
+            columns = [(column, not desc) for column, desc in columns]
+        query = query.filter(_after_condition(columns, values))
+    query = query.order_by(*[column.desc().nullslast() if desc else column.asc().nullsfirst()
+                             for column, desc in columns])
+    items = query.limit(per_page + 1).all()
+    has_more = len(items) > per_page
+    items = items[:per_page]
+    if backwards:
+        items.reverse()
+
+    request_params = {key: value for key, value in request.args.items() if key != 'cursor'}
+    pagination = {'current_page_url': url_for(api_func_name, cursor=cursor, **request_params)}
+    if request.args.get('count', '').lower() in {'1', 'true'}:
+        pagination['number_of_all_records'] = sql_query.order_by(None).count()
+    if items and (has_more or backwards):
+        pagination['next_page'] = url_for(api_func_name, cursor=_encode_cursor(items[-1], sorting, columns, False),
+                                          **request_params)
+    if items and (has_more if backwards else bool(cursor)):
+        pagination['previous_page'] = url_for(api_func_name, cursor=_encode_cursor(items[0], sorting, columns, True),
+                                              **request_params)
+    return items, pagination
+
+
+def _after_condition(columns, values):
+    """Condition of records after the cursor in the order of columns (NULL is lower than any value).
+
+    :param columns: Pairs (column, descending)
+    :type columns: list
+    :param values: Values of the columns in the cursor
+    :type values: list
+    :return: SQL condition
+    :rtype: BooleanClauseList
+    """
+    conditions = []
+    for number, ((column, desc), value) in enumerate(zip(columns, values)):
+        equal = [other.is_(None) if other_value is None else other == other_value
+                 for (other, _), other_value in zip(columns[:number], values[:number])]
+        if value is None:
+            after = false() if desc else column.isnot(None)
+        else:
+            after = or_(column < value, column.is_(None)) if desc else column > value
+        conditions.append(and_(*equal, after))
+    return or_(*conditions)
+
+
+def _encode_cursor(item, sorting, columns, backwards):
+    """Create opaque cursor pointing at the record.
+
+    :param item: Record
+    :type item: db.Model
+    :param sorting: Value of the sort param
+    :type sorting: str
+    :param columns: Pairs (column, descending)
+    :type columns: list
+    :param backwards: Cursor of the previous page
+    :type backwards: bool
+    :return: Cursor
+    :rtype: str
+    """
+    values = []
+    for column, _ in columns:
+        value = getattr(item, column.key)
+        values.append(value.isoformat() if isinstance(value, datetime) else value)
+    data = json.dumps({'sort': sorting, 'values': values, 'backwards': backwards}, separators=(',', ':'))
+    return urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def _decode_cursor(cursor, sorting, columns):
+    """Read values of columns from the cursor.
+
+    :param cursor: Cursor
+    :type cursor: str
+    :param sorting: Value of the sort param
+    :type sorting: str
+    :param columns: Pairs (column, descending)
+    :type columns: list
+    :raises ValidationError: wrong cursor
+    :return: Values of columns, information if it is the cursor of the previous page
+    :rtype: tuple[list, bool]
+    """
+    try:
+        data = json.loads(urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        values = data['values']
+        backwards = bool(data['backwards'])
+        if data['sort'] == sorting and len(values) == len(columns):
+            values = [datetime.fromisoformat(value) if value is not None and isinstance(column.type, DateTime)
+                      else value for (column, _), value in zip(columns, values)]
+    except (binascii.Error, UnicodeDecodeError, ValueError, KeyError, TypeError):
+        raise ValidationError('Wrong value, invalid cursor.', 'cursor')
+    if data['sort'] != sorting or len(values) != len(columns):
+        raise ValidationError('Wrong value, cursor is from the query with other sorting.', 'cursor')
+    return values, backwards
+
+
+def get_date_arg(name, default=None):
+    """Get date from query string in YmdHM format.
+
+    :param name: Name of the query param
+    :type name: str
+    :param default: Value returned if the param is missing
+    :type default: datetime
+    :raises ValidationError: param is missing or has wrong format
+    :return: Date
+    :rtype: datetime
+    """
+    value = request.args.get(name)
+    if value is None and default is not None:
+        return default
+    check_value = value or ''
+    if len(check_value) != 12 or not check_value.isdigit():
+        raise ValidationError('Wrong value, acceptable format: YmdHM.', name)
+    try:
+        return datetime.strptime(check_value, '%Y%m%d%H%M')
+    except ValueError:
+        raise ValidationError('Wrong value, acceptable format: YmdHM.', name)
+
+
+def get_fields(available_fields):
+    """Read fields of the response from the query string.
+
+    ``fields`` - fields to include separated by a comma (all fields by default),
+    ``params`` - fields to exclude separated by a comma.
+
+    :param available_fields: All fields of the json
+    :type available_fields: tuple
+    :raises ValidationError: unknown field in fields
+    :return: Requested fields
+    :rtype: frozenset
+    """
+    fields = request.args.get('fields')
+    if fields:
+        selected = set(fields.split(','))
+        unknown = selected.difference(available_fields)
+        if unknown:
+            raise ValidationError(f"Wrong value, unknown fields: {', '.join(sorted(unknown))}.", 'fields')
     else:
-        return sql_query.all(), None
+        selected = set(available_fields)
+    return frozenset(selected.difference(request.args.get('params', '').split(',')))
 
 
-def get_args(json, params):
-    """Filter json dict by params.
+def select_fields(json, fields):
+    """Filter json dict by fields.
 
     :param json: json
     :type json: dict
-    :param params: Parameters separated by a comma which will be excluded in a dict
-    :type params: str
-    :return: json without keys (parameters)
+    :param fields: Fields to keep, see get_fields
+    :type fields: collections.abc.Set
+    :return: json only with the fields
     :rtype: dict
     """
-    params_list = params.split(',')
-    json_dict = json
-    for param in params_list:
-        json_dict = {key: json_dict[key] for key in json_dict.keys() - {param}}
-    return json_dict
+    return {key: value for key, value in json.items() if key in fields}
+
+
+def _get_column(model, name, key):
+    """Find the column of the model (including computed columns, e.g. rentals_number).
+
+    :param model: Name of model
+    :type model: DefaultMeta
+    :param name: Name of the column
+    :type name: str
+    :param key: Name of the query param, used in the error
+    :type key: str
+    :raises ValidationError: the model has no such column
+    :return: Column
+    :rtype: InstrumentedAttribute
+    """
+    if name not in inspect(model).column_attrs:
+        raise ValidationError('Wrong parameter, unknown column.', key)
+    return getattr(model, name)
+
+
+@lru_cache(maxsize=QUERY_PLAN_CACHE_SIZE)
+def compile_sorting(model, sorting):
+    """Parse the sort param, "-" makes the column and all following columns descending.
+
+    Results are cached, the same sorting of the model is parsed once.
+
+    :param model: Name of model
+    :type model: DefaultMeta
+    :param sorting: Value of the sort param
+    :type sorting: str
+    :raises ValidationError: unknown column
+    :return: Pairs (column, descending)
+    :rtype: tuple
+    """
+    columns = []
+    desc = False
+    for value in sorting.split(','):
+        if value.startswith('-'):
+            value = value[1:]
+            desc = True
+        if value:
+            columns.append((_get_column(model, value, 'sort'), desc))
+    return tuple(columns)
+
+
+@lru_cache(maxsize=QUERY_PLAN_CACHE_SIZE)
+def compile_filters(model, filters):
+    """Parse filter params into SQL conditions.
+
+    Results are cached, the same filters of the model are parsed once.
+
+    :param model: Name of model
+    :type model: DefaultMeta
+    :param filters: Sorted pairs (query param, value)
+    :type filters: tuple
+    :raises ValidationError: unknown column or wrong value
+    :return: SQL conditions
+    :rtype: tuple
+    """
+    conditions = []
+    for key, value in filters:
+        filter_by, sign = key, "="
+        match = SIGNS_REGEX.match(key)
+        if match:
+            filter_by, sign = match.groups()
+        conditions.append(_get_filter(_get_column(model, filter_by, key), sign, value))
+    return tuple(conditions)
+
+
+def get_sort_columns(model):
+    """Read columns from the sort param (see compile_sorting).
+
+    :param model: Name of model
+    :type model: DefaultMeta
+    :return: Pairs (column, descending)
+    :rtype: list
+    """
+    return list(compile_sorting(model, request.args.get('sort', '')))
 
 
 def sort_by(sql_query, model):
@@ -68,17 +382,8 @@ def sort_by(sql_query, model):
     :return: Sorted SQL query
     :rtype: BaseQuery
     """
-    sorting_by = request.args.get('sort', None)
-    if sorting_by:
-        sorting_values = sorting_by.split(',')
-        desc = False
-        for value in sorting_values:
-            if value.startswith('-'):
-                value = value[1:]
-                desc = True
-            attribute = getattr(model, value, None)
-            if attribute is not None:
-                sql_query = sql_query.order_by(attribute.desc()) if desc else sql_query.order_by(attribute.asc())
+    for attribute, desc in get_sort_columns(model):
+        sql_query = sql_query.order_by(attribute.desc()) if desc else sql_query.order_by(attribute.asc())
 
     return sql_query
 
@@ -86,105 +391,56 @@ def sort_by(sql_query, model):
 def _get_filter(column, sign, value):
     """Map filter.
 
-    :param column: SQL query
+    :param column: Column
     :type column: InstrumentedAttribute
-    :param sign: Name of model
+    :param sign: Operator
     :type sign: str
-    :param value: Name of model
+    :param value: Value from the query string
     :type value: str
+    :raises ValidationError: value can't be compared with the column
     :return: Mapped expression
     :rtype: BinaryExpression
     """
+    if sign != 'like':
+        if isinstance(column.type, DateTime):
+            try:
+                value = datetime.strptime(value, '%Y-%m-%d_%H:%M:%S')
+            except ValueError:
+                raise ValidationError('Wrong value, acceptable format: Y-m-d_H:M:S.', column.key)
+        elif isinstance(column.type, Integer):
+            # Computed columns (e.g. rentals_number) have no type affinity, the value must be compared as a number
+            try:
+                value = int(value)
+            except ValueError:
+                raise ValidationError('Wrong value, must be an integer.', column.key)
+        elif isinstance(column.type, Float):
+            try:
+                value = float(value)
+            except ValueError:
+                raise ValidationError('Wrong value, must be a number.', column.key)
 
-    if isinstance(column.type, DateTime):
-        value = datetime.strptime(value, '%Y-%m-%d_%H:%M:%S')
-    operator_mapping = {
-        "lte": column <= value,
-        "lt": column < value,
-        "gte": column >= value,
-        "gt": column > value,
-        "=": column == value,
-        "like": column.like(value)
-    }
-
-    return operator_mapping[sign]
+    return OPERATORS[sign](column, value)
 
 
-def apply_filter(sql_query, model):
+def apply_filter(sql_query, model, ignore=()):
     """Filter SQL query.
 
+    Params named as columns and params with an operator (``name[gt]``) are filters, other params (e.g. ``_=123``
+    added by clients against caching) are ignored.
+
     :param sql_query: SQL query
     :type sql_query: BaseQuery
     :param model: Name of model
     :type model: DefaultMeta
+    :param ignore: Query params of the endpoint which are not filters
+    :type ignore: collections.abc.Container
+    :raises ValidationError: unknown column of the filter with an operator or wrong value
     :return: Filtered SQL query
     :rtype: BaseQuery
     """
-    for filter_by, value in request.args.items():
-        if filter_by not in {'sort', 'page', 'per_page'}:
-            sign = "="
-            match = SIGNS_REGEX.match(filter_by)
-            if match:
-                filter_by, sign = match.groups()
-            attribute_name = getattr(model, filter_by, None)
-            if attribute_name:
-                filtered = _get_filter(attribute_name, sign, value)
-                sql_query = sql_query.filter(filtered)
-
-    return sql_query
-
-
-def apply_args_filter(list_to_filter):
-    """Filter list by operators.
-
-    :param list_to_filter: list with json dicts to be filtered
-    :type list_to_filter: list
-    :return: filtered list
-    :rtype: list
-    """
-    if request.args.get('per_page') is None:
-        for filter_by, value in request.args.items():
-            filtered_list = []
-            if '_number' in filter_by:
-                sign = "="
-                match = SIGNS_REGEX.match(filter_by)
-                if match:
-                    filter_by, sign = match.groups()
-                if sign != 'like' and filter_by in list_to_filter[0].keys():
-                    for list_item in list_to_filter:
-                        if _get_filter_list(list_item[filter_by], sign, int(value)):
-                            filtered_list.append(list_item)
-                    list_to_filter = filtered_list
-
-    return list_to_filter
-
-
-def _get_filter_list(json_value, sign, value):
-    """Filter list by operators.
-
-    :param json_value: json value to be filtered
-    :type json_value: int
-    :param sign: the operator
-    :type sign: str
-    :param value: value to filter
-    :type value: int
-    :return: information whether the json is within the criteria
-    :rtype: bool
-    """
-    ok_with_filter = False
-    if sign == "lte":
-        if json_value <= value:
-            ok_with_filter = True
-    elif sign == "lt":
-        if json_value < value:
-            ok_with_filter = True
-    elif sign == "gte":
-        if json_value >= value:
-            ok_with_filter = True
-    elif sign == "gt":
-        if json_value > value:
-            ok_with_filter = True
-    elif sign == "=":
-        if json_value == value:
-            ok_with_filter = True
-    return ok_with_filter
+    columns = inspect(model).column_attrs
+    filters = tuple(sorted((key, value) for key, value in request.args.items()
+                           if key not in QUERY_PARAMS and key not in ignore
+                           and (key in columns or SIGNS_REGEX.match(key))))
+    conditions = compile_filters(model, filters)
+    return sql_query.filter(*conditions) if conditions else sql_query
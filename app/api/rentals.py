@@ -1,10 +1,14 @@
 """This module stores methods for rentals (API)."""
-from flask import jsonify, request
+from flask import jsonify, request, current_app
 from datetime import datetime
-from ..models import Rental, Permission, User
+from app.exceptions import ValidationError
+from ..booking import reserve_rentals
+from ..booking.batch import find_batch_conflicts
+from ..models import Rental, Permission, check_conflict, check_if_null
 from . import api
-from app.api.decorators import token_required, permission_required, validate_json_content_type
-from .query_features import apply_filter, get_args, sort_by
+from app.api.decorators import get_auth_context, token_required, permission_required, validate_json_content_type
+from .query_features import apply_filter, get_fields, get_pagination, is_unpaginated, sort_by
+from .streaming import stream_json, stream_ndjson
 from .errors import bad_request
 from .. import db
 
@@ -16,8 +20,14 @@ def show_rentals(users_id: int):
     query = Rental.query
     query = sort_by(query, Rental)
     query = apply_filter(query, Rental)
-    rentals = [rental.to_json() for rental in query]
-    return jsonify({'success': True, 'data': rentals})
+    fields = get_fields(Rental.JSON_FIELDS)
+    if request.args.get('format') == 'ndjson':
+        return stream_ndjson(query, lambda rentals: Rental.to_json_list(rentals, fields))
+    if is_unpaginated():
+        return stream_json(query, lambda rentals: Rental.to_json_list(rentals, fields))
+    rentals_with_pagination, pagination = get_pagination(query, 'api.show_rentals', Rental)
+    rentals = Rental.to_json_list(rentals_with_pagination, fields)
+    return jsonify({'success': True, 'data': rentals, 'number_of_records': len(rentals), 'pagination': pagination})
 
 
 @api.route('/rentals/car<int:car_id>/user<int:user_id>/from<int:date_time>/', methods=['GET'])
@@ -33,8 +43,7 @@ def show_rental(users_id: int, car_id: int, user_id: int, date_time: int):
         return bad_request(message="Wrong from: acceptable format: YmdHM")
     query = Rental.query.get_or_404({"cars_id": car_id, "users_id": user_id, "from_date": from_date},
                                     description='Rental not found')
-    params = request.args.get('params', "")
-    rental = get_args(query.to_json(), params)
+    rental = query.to_json(get_fields(Rental.JSON_FIELDS))
     return jsonify({'success': True, 'data': rental})
 
 
@@ -43,19 +52,82 @@ def show_rental(users_id: int, car_id: int, user_id: int, date_time: int):
 @validate_json_content_type
 def add_rental(user_id: int):
     args = request.get_json()
-    if User.query.get(user_id).is_admin():
+    if get_auth_context().can(Permission.ADMIN):
         if args.get('user_id_rental') is None:
             return bad_request(message="No user_id_rental, can't add rental")
         else:
             args['user_id'] = args.get('user_id_rental')
     else:
         args['user_id'] = user_id
-    rental = Rental.from_json(args)
-    db.session.add(rental)
-    db.session.commit()
+    rental = Rental.from_json(args, check_conflicts=False)
+    check_conflict(reserve_rentals([rental]))
     return jsonify({'success': True, 'data': rental.to_json()}), 201
 
 
+@api.route('/rentals/batch/', methods=['POST'])
+@token_required
+@validate_json_content_type
+def add_rentals_batch(user_id: int):
+    items = request.get_json()
+    if not isinstance(items, list) or len(items) == 0:
+        return bad_request(message="Wrong value, list of rentals required")
+    max_size = current_app.config['RENTALS_BATCH_MAX_SIZE']
+    if len(items) > max_size:
+        return bad_request(message=f"Too many rentals, maximum number is {max_size}")
+    is_admin = get_auth_context().can(Permission.ADMIN)
+
+    results = [None] * len(items)
+    rentals = []
+    positions = []
+    for position, args in enumerate(items):
+        try:
+            if not isinstance(args, dict):
+                raise ValidationError('Wrong value, rental must be an object.', 'rental')
+            args = dict(args)
+            if is_admin:
+                check_if_null(args.get('user_id_rental'), 'user_id_rental')
+                args['user_id'] = args.get('user_id_rental')
+            else:
+                args['user_id'] = user_id
+            rentals.append(Rental.from_json(args, check_conflicts=False))
+            positions.append(position)
+        except ValidationError as e:
+            results[position] = batch_error(position, e)
+
+    conflicts = find_batch_conflicts(rentals)
+    created = []
+    for number, (position, rental) in enumerate(zip(positions, rentals)):
+        try:
+            check_conflict(conflicts.get(number))
+        except ValidationError as e:
+            results[position] = batch_error(position, e)
+        else:
+            created.append((position, rental))
+
+    for position, rental in created:
+        results[position] = {'index': position, 'success': True, 'data': rental.to_json()}
+    if created:
+        check_conflict(reserve_rentals([rental for _, rental in created]))
+
+    response = jsonify({'success': len(created) > 0, 'data': results, 'number_of_records': len(created)})
+    response.status_code = 201 if created else 400
+    return response
+
+
+def batch_error(position, error):
+    """Describe the rejected rental of the batch.
+
+    :param position: Position of the rental in the request
+    :type position: int
+    :param error: Validation error of the rental
+    :type error: ValidationError
+    :return: Result of the rental
+    :rtype: dict
+    """
+    return {'index': position, 'success': False, 'error_value_key': error.args[1],
+            'error': {'error': 'bad request', 'message': error.args[0]}}
+
+
 @api.route('/rentals/car<int:car_id>/user<int:user_id>/from<int:date_time>/', methods=['DELETE'])
 @token_required
 @permission_required(Permission.ADMIN)
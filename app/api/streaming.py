@@ -0,0 +1,69 @@
+"""This module stores streamed responses of list endpoints (API)."""
+from flask import Response, current_app, json, stream_with_context
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def iterate_batches(sql_query):
+    """Iterate query results in batches, rows are fetched from the database cursor with yield_per.
+
+    :param sql_query: SQL query
+    :type sql_query: BaseQuery
+    :return: Lists of at most API_YIELD_PER objects
+    :rtype: generator
+    """
+    batch_size = current_app.config.get('API_YIELD_PER', 1000)
+    batch = []
+    for item in sql_query.yield_per(batch_size):
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def stream_ndjson(sql_query, serialize):
+    """Stream query results as newline delimited JSON, one object per line.
+
+    Objects are serialized batch by batch while the response is written, so memory doesn't grow with
+    the number of rows.
+
+    :param sql_query: SQL query
+    :type sql_query: BaseQuery
+    :param serialize: Function converting the list of objects to the list of json dicts (e.g. to_json_list)
+    :type serialize: function
+    :return: Streamed response
+    :rtype: flask.Response
+    """
+    def generate():
+        for batch in iterate_batches(sql_query):
+            yield ''.join(json.dumps(item) + '\n' for item in serialize(batch))
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+
+def stream_json(sql_query, serialize):
+    """Stream query results in the json envelope of list endpoints.
+
+    The response is the same as ``{'data': [...], 'number_of_records': ..., 'success': True}``, but records are
+    serialized batch by batch while it is written (the number of records is written after them).
+
+    :param sql_query: SQL query
+    :type sql_query: BaseQuery
+    :param serialize: Function converting the list of objects to the list of json dicts (e.g. to_json_list)
+    :type serialize: function
+    :return: Streamed response
+    :rtype: flask.Response
+    """
+    def generate():
+        number_of_records = 0
+        yield '{"data": ['
+        for batch in iterate_batches(sql_query):
+            items = serialize(batch)
+            if items:
+                yield (', ' if number_of_records else '') + ', '.join(json.dumps(item) for item in items)
+                number_of_records += len(items)
+        yield f'], "number_of_records": {number_of_records}, "success": true}}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
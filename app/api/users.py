@@ -1,9 +1,10 @@
 """This module stores methods for users (API)."""
-from flask import jsonify, request
+from flask import jsonify
 from ..models import User, Permission
 from app.api.decorators import token_required, permission_required
 from . import api
-from .query_features import apply_filter, apply_args_filter, get_args, get_pagination, sort_by
+from .query_features import apply_filter, get_fields, get_pagination, is_unpaginated, sort_by
+from .streaming import stream_json
 
 
 @api.route('/users/', methods=['GET'])
@@ -13,14 +14,12 @@ def get_all_users(user_id: int):
     query = User.query
     query = sort_by(query, User)
     query = apply_filter(query, User)
-    users_with_pagination, pagination = get_pagination(query, 'api.get_all_users')
-    params = request.args.get('params', "")
-    users = [get_args(user.to_json(), params) for user in users_with_pagination]
-    users = apply_args_filter(users)
-    if request.args.get('per_page'):
-        return jsonify({'data': users, 'number_of_records': len(users), 'pagination': pagination, 'success': True})
-    else:
-        return jsonify({'data': users, 'number_of_records': len(users), 'success': True})
+    fields = get_fields(User.JSON_FIELDS)
+    if is_unpaginated():
+        return stream_json(query, lambda users: User.to_json_list(users, fields))
+    users_with_pagination, pagination = get_pagination(query, 'api.get_all_users', User)
+    users = User.to_json_list(users_with_pagination, fields)
+    return jsonify({'data': users, 'number_of_records': len(users), 'pagination': pagination, 'success': True})
 
 
 @api.route('/users/<int:user_to_show_id>/', methods=['GET'])
@@ -28,6 +27,5 @@ def get_all_users(user_id: int):
 @permission_required(Permission.ADMIN)
 def get_user(user_id: int, user_to_show_id: int):
     query = User.query.get_or_404(user_to_show_id, description=f'User with id {user_to_show_id} not found')
-    params = request.args.get('params', "")
-    user = get_args(query.to_json(), params)
+    user = query.to_json(get_fields(User.JSON_FIELDS))
     return jsonify({'data': user, 'success': True})
@@ -1,11 +1,12 @@
 """This module stores application views for authorization."""
-from datetime import datetime, timedelta
+from datetime import datetime
 from flask import render_template, redirect, url_for, flash, request, session
 from flask_login import current_user, logout_user, login_user, login_required
 from . import auth
 from .forms import RegisterForm, LoginForm, EditDataForm, EditMailForm, EditPasswordForm, EditUserAdminForm, \
     AddReservationAdminForm
 from .. import db
+from ..booking import RENTAL_BREAK, conflict_messages, reserve_rentals
 from ..decorators import admin_required
 from ..models import User, Rental, Role, Car, load_user
 
@@ -18,6 +19,9 @@ def login():
 
         if user is not None:
             if user.verify_password(form.password.data):
+                # verify_password replaced an outdated hash with one of the configured method, save it
+                if db.session.is_modified(user):
+                    db.session.commit()
                 login_user(user, form.remember_user.data)
                 session.permanent = True
                 next = request.args.get('next')
@@ -148,55 +152,18 @@ def add_reservation(user_id):
     user = load_user(user_id)
     if form.validate_on_submit():
         car = Car.query.get(form.name.data)
-        reservations = Rental.query.filter_by(cars_id=car.id, users_id=user.id).all()
         if form.from_date_time.data >= form.to_date_time.data:
             flash("Dates Error!")
         else:
-            if len(reservations) == 0:
-                new_reservation = Rental(cars_id=car.id, users_id=user.id, from_date=form.from_date_time.data,
-                                         to_date=form.to_date_time.data,
-                                         available_from=form.to_date_time.data + timedelta(hours=1))
-                db.session.add(new_reservation)
-                db.session.commit()
+            new_reservation = Rental(cars_id=car.id, users_id=user.id, from_date=form.from_date_time.data,
+                                     to_date=form.to_date_time.data,
+                                     available_from=form.to_date_time.data + RENTAL_BREAK)
+            conflict = reserve_rentals([new_reservation])
+            if conflict is None:
                 flash('Reservation added.')
                 return redirect(url_for('auth.show_user_reservations_admin', user_id=user_id))
-            else:
-                for reservation in reservations:
-                    available_date = False
-                    rental_from = form.from_date_time.data
-                    rental_to = form.to_date_time.data + timedelta(hours=1)
-                    if reservation.from_date <= rental_from <= reservation.available_from or \
-                            reservation.from_date <= rental_to <= reservation.available_from:
-                        flash("Change dates!")
-                        flash(" ".join(("Available before:", (reservation.from_date + timedelta(minutes=-61)).strftime(
-                            "%Y-%m-%d %H:%M:%S"))))
-                        flash(" ".join(("Available after:",
-                                        (reservation.available_from + timedelta(minutes=1)).strftime(
-                                            "%Y-%m-%d %H:%M:%S"))))
-                        break
-                    else:
-                        available_date = True
-
-                    if rental_from < reservation.from_date < reservation.available_from and \
-                            reservation.from_date < reservation.available_from < rental_to:
-                        available_date = False
-                        flash("Change dates!")
-                        flash(" ".join(("Available before:", (reservation.from_date + timedelta(minutes=-61)).strftime(
-                            "%Y-%m-%d %H:%M:%S"))))
-                        flash(" ".join(("Available after:",
-                                        (reservation.available_from + timedelta(minutes=1)).strftime(
-                                            "%Y-%m-%d %H:%M:%S"))))
-                        break
-
-                    if available_date:
-                        new_reservation = Rental(cars_id=car.id, users_id=user.id, from_date=form.from_date_time.data,
-                                                 to_date=form.to_date_time.data,
-                                                 available_from=form.to_date_time.data + timedelta(hours=1))
-
-                        db.session.add(new_reservation)
-                        db.session.commit()
-                        flash("Reservation saved!")
-                        return redirect(url_for('auth.show_user_reservations_admin', user_id=user_id))
+            for message in conflict_messages(conflict, "%Y-%m-%d %H:%M:%S"):
+                flash(message)
 
     return render_template("auth/new_reservation.html", current_user=current_user, form=form)
 
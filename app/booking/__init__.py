@@ -0,0 +1,270 @@
+"""The module contains the constructor of the booking package - availability checks for rentals."""
+import random
+import time
+from datetime import timedelta
+from flask import current_app
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import IntegrityError, OperationalError
+from .. import db
+from . import locks, slots, sql
+from .calendar import RentalCalendar
+from .index import RentalIndex
+from .windows import MINUTE, find_free_windows, floor_date
+
+# Break after each rental, the car is available again after this time
+RENTAL_BREAK = timedelta(hours=1)
+
+_PENDING_KEY = 'booking_pending_rentals'
+
+
+def get_rental_index():
+    """Return the rental index of the current application, create it if needed.
+
+    :return: Rental index
+    :rtype: RentalIndex
+    """
+    index = current_app.extensions.get('rental_index')
+    if index is None:
+        index = current_app.extensions.setdefault('rental_index', RentalIndex())
+    return index
+
+
+def get_rental_calendar():
+    """Return occupancy calendars of the current application, create them if needed.
+
+    :return: Occupancy calendars
+    :rtype: RentalCalendar
+    """
+    calendar = current_app.extensions.get('rental_calendar')
+    if calendar is None:
+        calendar = current_app.extensions.setdefault('rental_calendar', RentalCalendar(
+            current_app.config.get('RENTAL_CALENDAR_DAYS', 90),
+            current_app.config.get('RENTAL_CALENDAR_SLOT_MINUTES', 15),
+            current_app.config.get('RENTAL_CALENDAR_TTL', 5)))
+    return calendar
+
+
+def _index_find_conflict(car_id, start, end):
+    """Find conflicting rental with the in-memory index of the current application."""
+    return get_rental_index().find_conflict(car_id, start, end)
+
+
+# Backends of overlap checks, chosen by RENTAL_OVERLAP_BACKEND in the configuration.
+# A backend is a function (car_id, start, end) returning the earliest rental (from_date, available_from)
+# overlapping the closed interval [start, end] or None.
+OVERLAP_BACKENDS = {
+    'sql': sql.find_conflict,
+    'index': _index_find_conflict,
+    'slots': slots.find_conflict
+}
+
+
+def find_conflict(car_id, from_date, to_date):
+    """Find rental of the car overlapping the new rental (including the break after it).
+
+    With ``RENTAL_CALENDAR_PREFILTER`` the occupancy calendar answers first: the backend is asked only if
+    a slot of the rental is occupied. The calendar follows commits of this process only, reservations
+    are checked again by ``reserve_rentals``.
+
+    :param car_id: Car id
+    :type car_id: int
+    :param from_date: Beginning of the new rental
+    :type from_date: datetime
+    :param to_date: End of the new rental
+    :type to_date: datetime
+    :return: Pair (from_date, available_from) of the conflicting rental or None
+    :rtype: tuple or None
+    """
+    end = to_date + RENTAL_BREAK
+    if current_app.config.get('RENTAL_CALENDAR_PREFILTER') and get_rental_calendar().is_free(car_id, from_date, end):
+        return None
+    backend = OVERLAP_BACKENDS[current_app.config.get('RENTAL_OVERLAP_BACKEND', 'sql')]
+    return backend(car_id, from_date, end)
+
+
+def reserve_rentals(rentals):
+    """Check rentals and save them in one write transaction.
+
+    The transaction is started with the lock of the cars (see ``locks.lock_cars``), so two reservations of the
+    same car can't both pass the check. When the lock can't be taken the reservation is repeated
+    ``RENTAL_LOCK_RETRIES`` times with growing, randomized pauses. The in-memory index is not a part of
+    the transaction, so the ``index`` backend is checked against the database here.
+
+    :param rentals: New rentals
+    :type rentals: list
+    :raises OperationalError: the lock can't be taken after all retries
+    :return: Pair (from_date, available_from) of the conflicting rental or None if rentals are saved
+    :rtype: tuple or None
+    """
+    retries = current_app.config.get('RENTAL_LOCK_RETRIES', 5)
+    backoff = current_app.config.get('RENTAL_LOCK_BACKOFF', 0.01)
+    for attempt in range(retries + 1):
+        try:
+            return _reserve(rentals)
+        except OperationalError as e:
+            db.session.rollback()
+            if attempt == retries or not locks.is_lock_error(e):
+                raise
+            time.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+def _reserve(rentals):
+    """Run one attempt of the reservation, see ``reserve_rentals``."""
+    backend = current_app.config.get('RENTAL_OVERLAP_BACKEND', 'sql')
+    check = sql.find_conflict if backend == 'index' else OVERLAP_BACKENDS[backend]
+    locks.lock_cars(rental.cars_id for rental in rentals)
+    for rental in rentals:
+        conflict = check(rental.cars_id, rental.from_date, rental.to_date + RENTAL_BREAK)
+        if conflict is not None:
+            db.session.rollback()
+            return conflict
+    db.session.add_all(rentals)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # A rental committed after the check (or a rental of this batch) took a slot, find it with the same backend
+        db.session.rollback()
+        for rental in rentals:
+            conflict = check(rental.cars_id, rental.from_date, rental.to_date + RENTAL_BREAK)
+            if conflict is not None:
+                return conflict
+        conflict = _find_conflict_in_batch(rentals)
+        if conflict is not None:
+            return conflict
+        raise
+    return None
+
+
+def _find_conflict_in_batch(rentals):
+    """Find the rental of the batch sharing a step of conflicts (see ``get_date_step``) with another one.
+
+    :param rentals: New rentals
+    :type rentals: list
+    :return: Pair (from_date, available_from) of the conflicting rental or None
+    :rtype: tuple or None
+    """
+    step = get_date_step()
+    ordered = sorted(rentals, key=lambda rental: (rental.cars_id, rental.from_date))
+    for previous, rental in zip(ordered, ordered[1:]):
+        if previous.cars_id == rental.cars_id and floor_date(rental.from_date, step) <= floor_date(
+                previous.to_date + RENTAL_BREAK, step):
+            return previous.from_date, previous.available_from
+    return None
+
+
+def get_date_step():
+    """Return granularity of conflicts - the bucket of the slot backend, None (exact dates) in other backends.
+
+    :return: Granularity of conflicts
+    :rtype: timedelta or None
+    """
+    if current_app.config.get('RENTAL_OVERLAP_BACKEND', 'sql') == 'slots':
+        return timedelta(minutes=slots.get_slot_minutes())
+    return None
+
+
+def available_dates(conflict):
+    """Return dates around the conflicting rental which can be offered instead.
+
+    :param conflict: Pair (from_date, available_from) of the conflicting rental
+    :type conflict: tuple
+    :return: The latest end of the rental before the conflict, the earliest beginning after it
+    :rtype: tuple
+    """
+    conflict_from, conflict_available = conflict
+    step = get_date_step()
+    return floor_date(conflict_from, step) - RENTAL_BREAK - MINUTE, floor_date(conflict_available, step) + (step or MINUTE)
+
+
+def conflict_messages(conflict, date_format):
+    """Describe the conflicting rental for the user of the website.
+
+    :param conflict: Pair (from_date, available_from) of the conflicting rental
+    :type conflict: tuple
+    :param date_format: Format of dates
+    :type date_format: str
+    :return: Messages
+    :rtype: list
+    """
+    available_before, available_after = available_dates(conflict)
+    return ["Change dates!",
+            " ".join(("Available before:", available_before.strftime(date_format))),
+            " ".join(("Available after:", available_after.strftime(date_format)))]
+
+
+def next_free_windows(car_id, after, duration, number):
+    """Find the first free windows of the car for the rental of the given length.
+
+    :param car_id: Car id
+    :type car_id: int
+    :param after: The earliest beginning of the rental
+    :type after: datetime
+    :param duration: Length of the rental
+    :type duration: timedelta
+    :param number: Maximum number of windows
+    :type number: int
+    :return: Free windows (from_date, latest_to_date), latest_to_date is None for the last open window
+    :rtype: list
+    """
+    return find_free_windows(car_id, after, duration, number, RENTAL_BREAK, get_date_step())
+
+
+@event.listens_for(db.session, 'before_flush')
+def _write_rental_slots(session, flush_context, instances):
+    """Write slots of new and changed rentals when the slot backend is used."""
+    if current_app.config.get('RENTAL_OVERLAP_BACKEND') != 'slots':
+        return
+    from ..models import Rental
+    minutes = slots.get_slot_minutes()
+    for obj in session.new:
+        if isinstance(obj, Rental):
+            slots.update_slots(obj, minutes)
+    for obj in session.dirty:
+        if isinstance(obj, Rental) and session.is_modified(obj):
+            slots.update_slots(obj, minutes)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_rental_changes(session, flush_context):
+    """Remember rentals written in the flush, they are applied to the index after commit."""
+    from ..models import Rental
+    pending = session.info.setdefault(_PENDING_KEY, [])
+    for obj in session.new:
+        if isinstance(obj, Rental):
+            pending.append(('add', obj.cars_id, obj.from_date, obj.available_from))
+    for obj in session.deleted:
+        if isinstance(obj, Rental):
+            pending.append(('remove', obj.cars_id, obj.from_date, obj.available_from))
+    for obj in session.dirty:
+        if isinstance(obj, Rental) and session.is_modified(obj):
+            history = inspect(obj).attrs.cars_id.history
+            for car_id in set(history.deleted or ()) | {obj.cars_id}:
+                pending.append(('invalidate', car_id, None, None))
+
+
+@event.listens_for(db.session, 'after_commit')
+def _apply_rental_changes(session):
+    """Update the index with rentals committed in the transaction."""
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+    index = get_rental_index()
+    calendar = current_app.extensions.get('rental_calendar')
+    for action, car_id, start, end in pending:
+        if action == 'add':
+            index.add(car_id, start, end)
+        elif action == 'remove':
+            index.remove(car_id, start, end)
+        else:
+            index.invalidate(car_id)
+        if calendar is not None:
+            if action == 'add':
+                calendar.add(car_id, start, end)
+            else:
+                calendar.invalidate(car_id)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_rental_changes(session):
+    """Forget rentals written in the rolled back transaction."""
+    session.info.pop(_PENDING_KEY, None)
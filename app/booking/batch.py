@@ -0,0 +1,45 @@
+"""This module stores the overlap check of many new rentals at once."""
+from collections import defaultdict
+from sqlalchemy import and_, or_
+from .. import db
+from .index import CarIntervals
+
+
+def find_batch_conflicts(rentals):
+    """Check new rentals against each other and against the db in one sorted pass per car.
+
+    Rentals are checked in from_date order, an accepted rental blocks the later ones.
+
+    :param rentals: New Rental objects (not added to session)
+    :type rentals: list
+    :return: Conflicts: {position in rentals: (from_date, available_from) of the conflicting rental}
+    :rtype: dict
+    """
+    from ..models import Rental
+    by_car = defaultdict(list)
+    for position, rental in enumerate(rentals):
+        by_car[rental.cars_id].append(position)
+    if not by_car:
+        return {}
+
+    ranges = []
+    for car_id, positions in by_car.items():
+        start = min(rentals[position].from_date for position in positions)
+        end = max(rentals[position].available_from for position in positions)
+        ranges.append(and_(Rental.cars_id == car_id, Rental.available_from >= start, Rental.from_date <= end))
+    existing = defaultdict(list)
+    for car_id, from_date, available_from in db.session.query(Rental.cars_id, Rental.from_date,
+                                                              Rental.available_from).filter(or_(*ranges)):
+        existing[car_id].append((from_date, available_from))
+
+    conflicts = {}
+    for car_id, positions in by_car.items():
+        intervals = CarIntervals(existing[car_id])
+        for position in sorted(positions, key=lambda item: rentals[item].from_date):
+            rental = rentals[position]
+            conflict = intervals.find_conflict(rental.from_date, rental.available_from)
+            if conflict is None:
+                intervals.add(rental.from_date, rental.available_from)
+            else:
+                conflicts[position] = conflict
+    return conflicts
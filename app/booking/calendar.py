@@ -0,0 +1,209 @@
+"""This module stores occupancy calendars of cars - bitmaps of slots in the rolling window."""
+import time
+from datetime import datetime, timedelta
+from threading import RLock
+from .. import db
+
+
+class CarCalendar:
+    """Class contains occupancy bitmap of one car.
+
+    Bit ``i`` (byte ``i // 8``, mask ``1 << i % 8``) is set if any rental ``[from_date, available_from]`` touches
+    the slot ``[start + i * slot, start + (i + 1) * slot)``.
+    """
+
+    def __init__(self, start, slot, number_of_slots):
+        """Create empty calendar.
+
+        :param start: Beginning of the first slot
+        :type start: datetime
+        :param slot: Length of the slot
+        :type slot: timedelta
+        :param number_of_slots: Number of slots
+        :type number_of_slots: int
+        """
+        self.start = start
+        self.slot = slot
+        self.number_of_slots = number_of_slots
+        self.bitmap = bytearray((number_of_slots + 7) // 8)
+        self.intervals = []
+
+    def _slots(self, from_date, to_date):
+        """Return slots touched by [from_date, to_date] and inside the calendar.
+
+        :param from_date: Beginning of the interval
+        :type from_date: datetime
+        :param to_date: End of the interval
+        :type to_date: datetime
+        :return: Numbers of slots
+        :rtype: range
+        """
+        first = max((from_date - self.start) // self.slot, 0)
+        last = min((to_date - self.start) // self.slot, self.number_of_slots - 1)
+        return range(first, last + 1)
+
+    def is_occupied(self, number):
+        """Check if the slot is occupied.
+
+        :param number: Number of the slot
+        :type number: int
+        :return: Information if the slot is occupied
+        :rtype: bool
+        """
+        return bool(self.bitmap[number >> 3] & (1 << (number & 7)))
+
+    def mark(self, from_date, to_date):
+        """Mark slots of the rental as occupied.
+
+        :param from_date: Beginning of the rental
+        :type from_date: datetime
+        :param to_date: End of the rental (including the break)
+        :type to_date: datetime
+        """
+        slots = self._slots(from_date, to_date)
+        if slots:
+            self.intervals.append((slots.start, slots.stop))
+        for number in slots:
+            self.bitmap[number >> 3] |= 1 << (number & 7)
+
+    def is_free(self, from_date, to_date):
+        """Check if no rental touches slots of [from_date, to_date].
+
+        :param from_date: Beginning of the interval
+        :type from_date: datetime
+        :param to_date: End of the interval
+        :type to_date: datetime
+        :return: True if the car is free, False if it may be not (or the interval is outside the calendar)
+        :rtype: bool
+        """
+        if from_date < self.start or to_date >= self.start + self.slot * self.number_of_slots:
+            return False
+        return not any(self.is_occupied(number) for number in self._slots(from_date, to_date))
+
+    def periods(self):
+        """Merge marked rentals into periods of occupied slots.
+
+        :return: Pairs (beginning of the first slot, end of the last slot)
+        :rtype: list
+        """
+        periods = []
+        for first, stop in sorted(self.intervals):
+            if periods and first <= periods[-1][1]:
+                periods[-1][1] = max(periods[-1][1], stop)
+            else:
+                periods.append([first, stop])
+        return [(self.start + first * self.slot, self.start + stop * self.slot) for first, stop in periods]
+
+
+class RentalCalendar:
+    """Class contains calendars of cars, built lazily from the database.
+
+    The window starts at midnight of the current day, calendars of the previous day are rebuilt on first use.
+    Commits of this process are marked at once, rentals saved by other processes are seen when the calendar
+    is rebuilt after ``ttl`` seconds.
+    """
+
+    def __init__(self, days, slot_minutes, ttl):
+        """Create empty calendars.
+
+        :param days: Length of the window in days
+        :type days: int
+        :param slot_minutes: Length of the slot in minutes
+        :type slot_minutes: int
+        :param ttl: Seconds after which the calendar of the car is loaded again
+        :type ttl: float
+        """
+        self.slot = timedelta(minutes=slot_minutes)
+        self.number_of_slots = days * 24 * 60 // slot_minutes
+        self.ttl = ttl
+        self._cars = {}
+        self._lock = RLock()
+
+    def _window_start(self):
+        return datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def _build(self, car_id, start):
+        """Load rentals of the car touching the window.
+
+        :param car_id: Car id
+        :type car_id: int
+        :param start: Beginning of the window
+        :type start: datetime
+        :return: Calendar of the car
+        :rtype: CarCalendar
+        """
+        from ..models import Rental
+        calendar = CarCalendar(start, self.slot, self.number_of_slots)
+        end = start + self.slot * self.number_of_slots
+        for from_date, available_from in db.session.query(Rental.from_date, Rental.available_from).filter(
+                Rental.cars_id == car_id, Rental.available_from >= start, Rental.from_date < end):
+            calendar.mark(from_date, available_from)
+        return calendar
+
+    def load(self, car_id):
+        """Build the calendar of the car from the database with one query, without the cache.
+
+        :param car_id: Car id
+        :type car_id: int
+        :return: Calendar of the car
+        :rtype: CarCalendar
+        """
+        return self._build(car_id, self._window_start())
+
+    def get(self, car_id):
+        """Return the cached calendar of the car, at most ``ttl`` seconds old.
+
+        :param car_id: Car id
+        :type car_id: int
+        :return: Calendar of the car
+        :rtype: CarCalendar
+        """
+        start = self._window_start()
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cars.get(car_id)
+            if cached is None or cached[0] < now or cached[1].start != start:
+                cached = self._cars[car_id] = (now + self.ttl, self._build(car_id, start))
+            return cached[1]
+
+    def is_free(self, car_id, start, end):
+        """Check with the calendar if the car is free in [start, end].
+
+        :param car_id: Car id
+        :type car_id: int
+        :param start: Beginning of the checked interval
+        :type start: datetime
+        :param end: End of the checked interval (including the break after rental)
+        :type end: datetime
+        :return: True if the car is free, False if it may be not
+        :rtype: bool
+        """
+        with self._lock:
+            return self.get(car_id).is_free(start, end)
+
+    def add(self, car_id, start, end):
+        """Mark committed rental in the calendar of the car, if it is loaded.
+
+        :param car_id: Car id
+        :type car_id: int
+        :param start: Beginning of the rental
+        :type start: datetime
+        :param end: End of the rental (available_from)
+        :type end: datetime
+        """
+        with self._lock:
+            cached = self._cars.get(car_id)
+            if cached is not None:
+                cached[1].mark(start, end)
+
+    def invalidate(self, car_id=None):
+        """Forget the calendar of the car (or all calendars), e.g. after the rental is deleted.
+
+        :param car_id: Car id, None for all cars
+        :type car_id: int
+        """
+        with self._lock:
+            if car_id is None:
+                self._cars.clear()
+            else:
+                self._cars.pop(car_id, None)
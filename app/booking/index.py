@@ -0,0 +1,168 @@
+"""This module stores the in-memory interval index of rentals used for overlap checks."""
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from threading import RLock
+from .. import db
+
+
+class CarIntervals:
+    """Class contains sorted rental intervals ``[from_date, available_from]`` of one car.
+
+    ``reach[i]`` is the latest ``available_from`` among the first ``i + 1`` intervals, so it is sorted as well
+    and the earliest overlapping interval can be found with bisect even if stored intervals overlap each other.
+    """
+
+    def __init__(self, intervals):
+        """Build sorted arrays from intervals.
+
+        :param intervals: Pairs (from_date, available_from)
+        :type intervals: iterable
+        """
+        intervals = sorted(intervals)
+        self.starts = [start for start, _ in intervals]
+        self.ends = [end for _, end in intervals]
+        self.reach = list(accumulate(self.ends, max))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def _update_reach(self, position):
+        """Recompute reach values from position to the end of arrays.
+
+        :param position: The first changed position
+        :type position: int
+        """
+        previous = self.reach[position - 1] if position > 0 else None
+        del self.reach[position:]
+        for end in self.ends[position:]:
+            previous = end if previous is None else max(previous, end)
+            self.reach.append(previous)
+
+    def add(self, start, end):
+        """Add interval.
+
+        :param start: Rental from_date
+        :type start: datetime
+        :param end: Rental available_from
+        :type end: datetime
+        """
+        position = bisect_right(self.starts, start)
+        self.starts.insert(position, start)
+        self.ends.insert(position, end)
+        self._update_reach(position)
+
+    def remove(self, start, end):
+        """Remove interval if it exists.
+
+        :param start: Rental from_date
+        :type start: datetime
+        :param end: Rental available_from
+        :type end: datetime
+        """
+        position = bisect_left(self.starts, start)
+        while position < len(self.starts) and self.starts[position] == start:
+            if self.ends[position] == end:
+                del self.starts[position]
+                del self.ends[position]
+                self._update_reach(position)
+                return
+            position += 1
+
+    def find_conflict(self, start, end):
+        """Find the earliest interval overlapping the closed interval [start, end].
+
+        :param start: Beginning of the checked interval
+        :type start: datetime
+        :param end: End of the checked interval
+        :type end: datetime
+        :return: Pair (from_date, available_from) of the conflicting rental or None
+        :rtype: tuple or None
+        """
+        candidates = bisect_right(self.starts, end)
+        position = bisect_left(self.reach, start, 0, candidates)
+        if position < candidates:
+            return self.starts[position], self.ends[position]
+        return None
+
+
+class RentalIndex:
+    """Class contains per-car interval indexes, built lazily from the rentals table.
+
+    The index is kept per application and updated after each commit, so it only sees rentals written by
+    this process - call ``invalidate`` when the table is changed from outside.
+    """
+
+    def __init__(self):
+        self._cars = {}
+        self._lock = RLock()
+
+    def _get(self, car_id):
+        """Return intervals of the car, load them from db if needed.
+
+        :param car_id: Car id
+        :type car_id: int
+        :return: Intervals of the car
+        :rtype: CarIntervals
+        """
+        intervals = self._cars.get(car_id)
+        if intervals is None:
+            from ..models import Rental
+            rows = db.session.query(Rental.from_date, Rental.available_from).filter(Rental.cars_id == car_id).all()
+            intervals = CarIntervals(tuple(row) for row in rows)
+            self._cars[car_id] = intervals
+        return intervals
+
+    def find_conflict(self, car_id, start, end):
+        """Find rental of the car overlapping [start, end].
+
+        :param car_id: Car id
+        :type car_id: int
+        :param start: Beginning of the checked interval
+        :type start: datetime
+        :param end: End of the checked interval (including the break after rental)
+        :type end: datetime
+        :return: Pair (from_date, available_from) of the conflicting rental or None
+        :rtype: tuple or None
+        """
+        with self._lock:
+            return self._get(car_id).find_conflict(start, end)
+
+    def add(self, car_id, start, end):
+        """Add rental interval to the loaded car index.
+
+        :param car_id: Car id
+        :type car_id: int
+        :param start: Rental from_date
+        :type start: datetime
+        :param end: Rental available_from
+        :type end: datetime
+        """
+        with self._lock:
+            if car_id in self._cars:
+                self._cars[car_id].add(start, end)
+
+    def remove(self, car_id, start, end):
+        """Remove rental interval from the loaded car index.
+
+        :param car_id: Car id
+        :type car_id: int
+        :param start: Rental from_date
+        :type start: datetime
+        :param end: Rental available_from
+        :type end: datetime
+        """
+        with self._lock:
+            if car_id in self._cars:
+                self._cars[car_id].remove(start, end)
+
+    def invalidate(self, car_id=None):
+        """Drop index of the car (or all cars), it will be loaded again on next check.
+
+        :param car_id: Car id, None means all cars
+        :type car_id: int
+        """
+        with self._lock:
+            if car_id is None:
+                self._cars.clear()
+            else:
+                self._cars.pop(car_id, None)
@@ -0,0 +1,37 @@
+"""This module stores locks taken by reservations, so the check and the insert of rentals are not interleaved."""
+from .. import db
+
+# Error codes of PostgreSQL: serialization failure, deadlock, lock not available
+_RETRY_PGCODES = {'40001', '40P01', '55P03'}
+
+
+def lock_cars(car_ids):
+    """Start the write transaction of the reservation.
+
+    SQLite locks the whole database with ``BEGIN IMMEDIATE`` (unless the transaction already wrote something
+    and holds the lock), other databases lock rows of the cars with ``SELECT ... FOR UPDATE``.
+
+    :param car_ids: Ids of reserved cars
+    :type car_ids: iterable
+    """
+    from ..models import Car
+    connection = db.session.connection()
+    if connection.dialect.name == 'sqlite':
+        if not connection.connection.in_transaction:
+            connection.exec_driver_sql('BEGIN IMMEDIATE')
+    else:
+        db.session.query(Car.id).filter(Car.id.in_(sorted(set(car_ids)))).order_by(Car.id).with_for_update().all()
+
+
+def is_lock_error(error):
+    """Check if the database error is caused by contention, so the transaction can be repeated.
+
+    :param error: Error raised by the database
+    :type error: OperationalError
+    :return: Information if the reservation can be retried
+    :rtype: bool
+    """
+    if getattr(error.orig, 'pgcode', None) in _RETRY_PGCODES:
+        return True
+    message = str(error.orig).lower()
+    return 'locked' in message or 'busy' in message or 'deadlock' in message
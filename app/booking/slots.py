@@ -0,0 +1,105 @@
+"""This module stores the slot table of rentals - the database itself rejects overlapping rentals.
+
+Each rental occupies buckets of ``RENTAL_SLOT_MINUTES`` minutes from ``from_date`` to ``available_from``
+(both included). ``(cars_id, bucket)`` is the primary key of ``rental_slots``, so the second of two
+overlapping rentals fails on insert, even if both passed the check before.
+Buckets are coarser than dates: rentals closer than one bucket to each other conflict, so free windows and
+dates offered instead of a conflict are rounded to buckets. With one-minute buckets the result is the same
+as in other backends.
+"""
+from datetime import datetime
+from flask import current_app
+from .. import db
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def get_slot_minutes():
+    """Return width of the bucket in minutes.
+
+    :return: Width of the bucket
+    :rtype: int
+    """
+    return current_app.config.get('RENTAL_SLOT_MINUTES', 15)
+
+
+def to_bucket(date, minutes):
+    """Find number of the bucket containing the date.
+
+    :param date: Date
+    :type date: datetime
+    :param minutes: Width of the bucket in minutes
+    :type minutes: int
+    :return: Number of the bucket
+    :rtype: int
+    """
+    return int((date - EPOCH).total_seconds()) // 60 // minutes
+
+
+def slot_range(start, end, minutes):
+    """Return buckets occupied by the closed interval [start, end].
+
+    :param start: Beginning of the interval
+    :type start: datetime
+    :param end: End of the interval
+    :type end: datetime
+    :param minutes: Width of the bucket in minutes
+    :type minutes: int
+    :return: Numbers of buckets
+    :rtype: range
+    """
+    return range(to_bucket(start, minutes), to_bucket(end, minutes) + 1)
+
+
+def update_slots(rental, minutes):
+    """Set slots of the rental to the buckets of its dates.
+
+    Slots which stay occupied are kept, so the flush doesn't insert a bucket before deleting it.
+
+    :param rental: Rental
+    :type rental: Rental
+    :param minutes: Width of the bucket in minutes
+    :type minutes: int
+    """
+    from ..models import RentalSlot
+    buckets = set(slot_range(rental.from_date, rental.available_from, minutes))
+    kept = [slot for slot in rental.slots if slot.bucket in buckets]
+    missing = buckets.difference(slot.bucket for slot in kept)
+    rental.slots = kept + [RentalSlot(cars_id=rental.cars_id, bucket=bucket) for bucket in sorted(missing)]
+
+
+def rebuild_slots():
+    """Fill the slot table from rentals, e.g. after switching to the slot backend or changing bucket width.
+
+    :return: Number of rentals
+    :rtype: int
+    """
+    from ..models import Rental, RentalSlot
+    minutes = get_slot_minutes()
+    RentalSlot.query.delete()
+    rentals = Rental.query.all()
+    for rental in rentals:
+        rental.slots = [RentalSlot(cars_id=rental.cars_id, bucket=bucket)
+                        for bucket in slot_range(rental.from_date, rental.available_from, minutes)]
+    db.session.commit()
+    return len(rentals)
+
+
+def find_conflict(car_id, start, end):
+    """Find the earliest rental of the car occupying a bucket of [start, end].
+
+    :param car_id: Car id
+    :type car_id: int
+    :param start: Beginning of the checked interval
+    :type start: datetime
+    :param end: End of the checked interval (including the break after rental)
+    :type end: datetime
+    :return: Pair (from_date, available_from) of the conflicting rental or None
+    :rtype: tuple or None
+    """
+    from ..models import Rental, RentalSlot
+    buckets = slot_range(start, end, get_slot_minutes())
+    row = db.session.query(Rental.from_date, Rental.available_from).join(Rental.slots).filter(
+        RentalSlot.cars_id == car_id, RentalSlot.bucket >= buckets.start,
+        RentalSlot.bucket < buckets.stop).order_by(Rental.available_from).limit(1).first()
+    return tuple(row) if row is not None else None
@@ -0,0 +1,55 @@
+"""This module stores overlap checks of rentals answered by the database."""
+from sqlalchemy import and_, exists
+from .. import db
+
+
+def overlap_condition(car_id, start, end):
+    """Build SQL condition - rental of the car overlaps the closed interval [start, end].
+
+    The condition is answered by the index on (cars_id, available_from, from_date): only rentals which
+    end after ``start`` are scanned, so the cost doesn't grow with the history of the car.
+
+    :param car_id: Car id or SQL expression (e.g. correlated Car.id)
+    :type car_id: int
+    :param start: Beginning of the checked interval
+    :type start: datetime
+    :param end: End of the checked interval (including the break after rental)
+    :type end: datetime
+    :return: SQL condition
+    :rtype: BooleanClauseList
+    """
+    from ..models import Rental
+    return and_(Rental.cars_id == car_id, Rental.available_from >= start, Rental.from_date <= end)
+
+
+def is_free(car_id, start, end):
+    """Check with one EXISTS query if there is no rental of the car in [start, end].
+
+    :param car_id: Car id
+    :type car_id: int
+    :param start: Beginning of the checked interval
+    :type start: datetime
+    :param end: End of the checked interval (including the break after rental)
+    :type end: datetime
+    :return: Information if the car is free
+    :rtype: bool
+    """
+    return not db.session.query(exists().where(overlap_condition(car_id, start, end))).scalar()
+
+
+def find_conflict(car_id, start, end):
+    """Find the earliest rental of the car overlapping [start, end].
+
+    :param car_id: Car id
+    :type car_id: int
+    :param start: Beginning of the checked interval
+    :type start: datetime
+    :param end: End of the checked interval (including the break after rental)
+    :type end: datetime
+    :return: Pair (from_date, available_from) of the conflicting rental or None
+    :rtype: tuple or None
+    """
+    from ..models import Rental
+    row = db.session.query(Rental.from_date, Rental.available_from).filter(
+        overlap_condition(car_id, start, end)).order_by(Rental.available_from).limit(1).first()
+    return tuple(row) if row is not None else None
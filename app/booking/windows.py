@@ -0,0 +1,81 @@
+"""This module stores the search of free rental windows of a car."""
+from datetime import timedelta
+from .. import db
+from .slots import EPOCH
+
+MINUTE = timedelta(minutes=1)
+
+
+def floor_date(date, step):
+    """Round the date down to the multiple of the step (counted from the epoch).
+
+    :param date: Date
+    :type date: datetime
+    :param step: Step, e.g. width of the bucket of the slot backend, None keeps the date
+    :type step: timedelta
+    :return: Rounded date
+    :rtype: datetime
+    """
+    if step is None:
+        return date
+    return EPOCH + (date - EPOCH) // step * step
+
+
+def sweep_free_windows(intervals, after, duration, number, rental_break, step=None):
+    """Find free windows between rental intervals sorted by from_date.
+
+    A window is returned as (from_date, latest_to_date): a rental starting at from_date may end at latest_to_date
+    at the latest (None means no limit), so the break after it doesn't touch the next rental.
+    With the step (buckets of the slot backend) windows don't share a step with rentals.
+
+    :param intervals: Pairs (from_date, available_from) sorted by from_date
+    :type intervals: iterable
+    :param after: The earliest beginning of the rental
+    :type after: datetime
+    :param duration: Length of the rental
+    :type duration: timedelta
+    :param number: Maximum number of windows
+    :type number: int
+    :param rental_break: Break after each rental
+    :type rental_break: timedelta
+    :param step: Granularity of conflicts, None for exact dates
+    :type step: timedelta
+    :return: Free windows
+    :rtype: list
+    """
+    windows = []
+    cursor = after
+    for start, end in intervals:
+        if len(windows) >= number:
+            break
+        latest_to_date = floor_date(start, step) - rental_break - MINUTE
+        if cursor + duration <= latest_to_date:
+            windows.append((cursor, latest_to_date))
+        cursor = max(cursor, floor_date(end, step) + (step or MINUTE))
+    if len(windows) < number:
+        windows.append((cursor, None))
+    return windows
+
+
+def find_free_windows(car_id, after, duration, number, rental_break, step=None):
+    """Find the first free windows of the car, long enough for the rental.
+
+    :param car_id: Car id
+    :type car_id: int
+    :param after: The earliest beginning of the rental
+    :type after: datetime
+    :param duration: Length of the rental
+    :type duration: timedelta
+    :param number: Maximum number of windows
+    :type number: int
+    :param rental_break: Break after each rental
+    :type rental_break: timedelta
+    :param step: Granularity of conflicts, None for exact dates
+    :type step: timedelta
+    :return: Free windows (from_date, latest_to_date)
+    :rtype: list
+    """
+    from ..models import Rental
+    intervals = db.session.query(Rental.from_date, Rental.available_from).filter(
+        Rental.cars_id == car_id, Rental.available_from >= floor_date(after, step)).order_by(Rental.from_date)
+    return sweep_free_windows(intervals, after, duration, number, rental_break, step)
@@ -0,0 +1,171 @@
+"""The module contains validation of emails - syntax is checked in the request, deliverability in the background.
+
+Deliverability (MX, A or AAAA record of the domain) needs DNS queries, so requests only schedule the check.
+The verifier checks each domain in a background thread and keeps the result for EMAIL_DELIVERABILITY_TTL
+seconds, undeliverable domains are logged.
+"""
+import threading
+import time
+import weakref
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import dns.resolver
+from email_validator import EmailNotValidError, EmailUndeliverableError, validate_email, \
+    validate_email_deliverability
+from flask import current_app
+from app.exceptions import ValidationError
+
+MXRecord = namedtuple('MXRecord', ['preference', 'exchange'])
+
+
+def check_email(email):
+    """Check the syntax of the email (without DNS queries) and schedule the check of deliverability.
+
+    :param email: Email
+    :type email: str
+    :raises ValidationError: email is incorrect
+    """
+    try:
+        valid = validate_email(email, check_deliverability=False)
+    except EmailNotValidError:
+        raise ValidationError("Email is incorrect.", "email")
+    if current_app.config.get('EMAIL_CHECK_DELIVERABILITY', False):
+        get_email_verifier().schedule(valid.ascii_domain)
+
+
+class StubResolver:
+    """Class contains a local DNS resolver answering MX queries from a dict (e.g. for tests)."""
+
+    def __init__(self, domains=None):
+        """Create resolver.
+
+        :param domains: Mail servers of domains, other domains don't exist
+        :type domains: dict
+        """
+        self.domains = dict(domains or {})
+        self.queries = []
+
+    def resolve(self, domain, record):
+        """Answer the query like dns.resolver.Resolver.resolve.
+
+        :param domain: Domain
+        :type domain: str
+        :param record: Type of the record
+        :type record: str
+        :return: MX records
+        :rtype: list
+        :raises dns.resolver.NXDOMAIN: domain doesn't exist
+        """
+        self.queries.append((domain, record))
+        if domain not in self.domains:
+            raise dns.resolver.NXDOMAIN()
+        if record != 'MX':
+            raise dns.resolver.NoAnswer()
+        return [MXRecord(preference, exchange) for preference, exchange in enumerate(self.domains[domain])]
+
+
+class EmailVerifier:
+    """Class contains the background check of deliverability of email domains with the cache of results."""
+
+    def __init__(self, ttl, timeout, resolver=None, logger=None):
+        """Create verifier.
+
+        :param ttl: Seconds for which the result of the domain is kept
+        :type ttl: float
+        :param timeout: Timeout of DNS queries in seconds
+        :type timeout: float
+        :param resolver: DNS resolver (dnspython's resolver with the cache by default)
+        :param logger: Logger of undeliverable domains
+        :type logger: logging.Logger
+        """
+        self.ttl = ttl
+        self.timeout = timeout
+        self.resolver = resolver
+        self.logger = logger
+        self._results = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='email-verifier')
+
+    def deliverable(self, domain):
+        """Return the cached result of the domain.
+
+        :param domain: Domain of the email
+        :type domain: str
+        :return: The information if the domain accepts emails, None if unknown
+        :rtype: bool
+        """
+        with self._lock:
+            result = self._results.get(domain)
+        if result is None or result[0] < time.monotonic():
+            return None
+        return result[1]
+
+    def schedule(self, domain):
+        """Check the domain in the background, unless the result is cached or the check is pending.
+
+        :param domain: Domain of the email
+        :type domain: str
+        :return: Future of the check (None if not scheduled)
+        :rtype: concurrent.futures.Future
+        """
+        with self._lock:
+            result = self._results.get(domain)
+            if domain in self._pending or (result is not None and result[0] >= time.monotonic()):
+                return self._pending.get(domain)
+            future = self._pending[domain] = self._executor.submit(self._check, domain)
+        return future
+
+    def _check(self, domain):
+        """Query DNS and store the result of the domain.
+
+        :param domain: Domain of the email
+        :type domain: str
+        :return: The information if the domain accepts emails, None if DNS timed out
+        :rtype: bool
+        """
+        try:
+            if self.resolver is None:
+                self.resolver = dns.resolver.Resolver()
+                self.resolver.cache = dns.resolver.LRUCache()
+                self.resolver.lifetime = self.timeout
+            try:
+                answer = validate_email_deliverability(domain, domain, self.timeout, self.resolver)
+                deliverable = None if 'unknown-deliverability' in answer else True
+            except EmailUndeliverableError:
+                deliverable = False
+                if self.logger is not None:
+                    self.logger.warning('Email domain %s is not deliverable', domain)
+            with self._lock:
+                if deliverable is not None:
+                    self._results[domain] = (time.monotonic() + self.ttl, deliverable)
+            return deliverable
+        finally:
+            with self._lock:
+                self._pending.pop(domain, None)
+
+    def shutdown(self, wait=True):
+        """Stop the background thread.
+
+        :param wait: Wait for running checks
+        :type wait: bool
+        """
+        self._executor.shutdown(wait=wait)
+
+
+def get_email_verifier():
+    """Return the email verifier of the current application, create it if needed.
+
+    :return: Email verifier
+    :rtype: EmailVerifier
+    """
+    verifier = current_app.extensions.get('email_verifier')
+    if verifier is None:
+        config = current_app.config
+        created = EmailVerifier(config.get('EMAIL_DELIVERABILITY_TTL', 3600), config.get('EMAIL_DNS_TIMEOUT', 5),
+                                config.get('EMAIL_DNS_RESOLVER'), current_app.logger)
+        verifier = current_app.extensions.setdefault('email_verifier', created)
+        if verifier is created:
+            # The background thread is stopped with the application
+            weakref.finalize(current_app._get_current_object(), created.shutdown, False)
+    return verifier
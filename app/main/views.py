@@ -1,14 +1,17 @@
 """This module stores application views."""
 import random
 import os
-from datetime import date, datetime, timedelta
+from collections import defaultdict
+from datetime import date, datetime
 from flask import render_template, flash, url_for, redirect, request, current_app
 from flask_login import current_user, login_required
+from sqlalchemy.orm import joinedload
 from werkzeug.utils import secure_filename
 from . import main
 from .forms import ContactForm, OpinionForm, CalendarForm, NewsPostForm, CarForm, CommentForm, CommentCommentForm, \
     CarEditForm, CarChangeImageForm
 from .. import db
+from ..booking import RENTAL_BREAK, conflict_messages, get_rental_calendar, reserve_rentals
 from ..decorators import moderator_required
 from ..models import User, Opinion, Car, NewsPost, Permission, Comment, Rental
 
@@ -27,6 +30,53 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def make_comment_tree(comments, comment_ids, roots, max_depth=None, max_children=None):
+    """All comments in "comment tree", built without queries and recursion.
+
+    :param comments: Comments of the post by id (with loaded authors)
+    :type comments: dict
+    :param comment_ids: Ids of child comments by id of parent comment
+    :type comment_ids: dict
+    :param roots: Ids of comments on the first level
+    :type roots: list
+    :param max_depth: Maximum number of levels, None - no limit
+    :type max_depth: int
+    :param max_children: Maximum number of replies shown for one comment, None - no limit
+    :type max_children: int
+    :return: List of comments, "hidden_replies" is the number of replies not shown
+    :rtype: list
+    """
+    order = []
+    shown_children = {}
+    stack = [(comment_id, 1) for comment_id in roots]
+    while stack:
+        comment_id, depth = stack.pop()
+        order.append(comment_id)
+        children = comment_ids.get(comment_id, [])
+        if max_depth is not None and depth >= max_depth:
+            children = []
+        elif max_children is not None:
+            children = children[:max_children]
+        shown_children[comment_id] = children
+        stack.extend((child, depth + 1) for child in children)
+
+    records = {}
+    for comment_id in reversed(order):
+        comment = comments[comment_id]
+        record = {"id": comment_id,
+                  "author_name": comment.comment_author.name,
+                  "author_surname": comment.comment_author.surname,
+                  "text": comment.text,
+                  "date": comment.date}
+        if shown_children[comment_id]:
+            record["child"] = [records[child] for child in shown_children[comment_id]]
+        hidden_replies = len(comment_ids.get(comment_id, [])) - len(shown_children[comment_id])
+        if hidden_replies:
+            record["hidden_replies"] = hidden_replies
+        records[comment_id] = record
+    return [records[comment_id] for comment_id in roots]
+
+
 @main.route('/', methods=['GET'])
 def index():
     return render_template("index.html", current_user=current_user)
@@ -81,7 +131,6 @@ def add_model():
 @main.route("/cars/<string:car_name>", methods=["GET", "POST"])
 def show_car(car_name):
     car_to_show = Car.query.filter_by(name=car_name).first_or_404()
-    rental_list = car_to_show.car_rental
     form = CalendarForm()
     if form.validate_on_submit():
         from_date = form.start_date.data
@@ -90,58 +139,28 @@ def show_car(car_name):
         to_time = form.end_time.data
         from_datetime = datetime.strptime(" ".join((str(from_date), str(from_time))), '%Y-%m-%d %H:%M:%S')
         to_datetime = datetime.strptime(" ".join((str(to_date), str(to_time))), '%Y-%m-%d %H:%M:%S')
-        if len(rental_list) != 0:
-            for element in rental_list:
-                available_date = False
-                if from_datetime <= datetime.now():
-                    flash("Change dates to future dates!")
-                    break
-                if element.from_date <= from_datetime <= element.available_from or \
-                        element.from_date <= to_datetime + timedelta(hours=1) <= element.available_from:
-                    flash("Change dates!")
-                    flash(" ".join(("Available before:",
-                                    (element.from_date + timedelta(minutes=-61)).strftime("%Y-%m-%d %H:%M"))))
-                    flash(" ".join(("Available after:",
-                                    (element.available_from + timedelta(minutes=1)).strftime("%Y-%m-%d %H:%M"))))
-                    break
-                else:
-                    available_date = True
-
-                if from_datetime < element.from_date < element.available_from and \
-                        element.from_date < element.available_from < to_datetime + timedelta(hours=1):
-                    available_date = False
-                    flash("Change dates!")
-                    flash(" ".join(
-                        ("Available before:", (element.from_date + timedelta(minutes=-61)).strftime("%Y-%m-%d %H:%M"))))
-                    flash(" ".join(("Available after:",
-                                    (element.available_from + timedelta(minutes=1)).strftime("%Y-%m-%d %H:%M"))))
-                    break
-
-                if available_date:
-                    rent = Rental(cars_id=car_to_show.id,
-                                  users_id=current_user.id,
-                                  from_date=from_datetime,
-                                  to_date=to_datetime,
-                                  available_from=to_datetime + timedelta(hours=1))
-
-                    db.session.add(rent)
-                    db.session.commit()
-                    flash("Reservation saved!")
-                    return redirect(url_for('auth.show_user_reservations'))
+        if from_datetime <= datetime.now():
+            flash("Change dates to future dates!")
         else:
+            conflict = None
             if from_datetime < to_datetime:
                 rent = Rental(cars_id=car_to_show.id,
                               users_id=current_user.id,
                               from_date=from_datetime,
                               to_date=to_datetime,
-                              available_from=to_datetime + timedelta(hours=1))
+                              available_from=to_datetime + RENTAL_BREAK)
 
-                db.session.add(rent)
-                db.session.commit()
-                flash("Reservation saved!")
-                return redirect(url_for('auth.show_user_reservations'))
+                conflict = reserve_rentals([rent])
+                if conflict is None:
+                    flash("Reservation saved!")
+                    return redirect(url_for('auth.show_user_reservations'))
+            if conflict is not None:
+                for message in conflict_messages(conflict, "%Y-%m-%d %H:%M"):
+                    flash(message)
 
-    return render_template("car.html", form=form, car=car_to_show, current_user=current_user, car_name=car_name)
+    occupied = get_rental_calendar().load(car_to_show.id).periods() if current_user.is_authenticated else []
+    return render_template("car.html", form=form, car=car_to_show, current_user=current_user, car_name=car_name,
+                           occupied=occupied)
 
 
 @main.route("/cars/<string:car_name>/edit", methods=["GET", "POST"])
@@ -235,7 +254,8 @@ def show_post(post_id):
     is_file = os.path.isfile(os.path.join(basedir, 'static\\img\\', post_to_show.img_url))
     if not is_file:
         post_to_show.img_url = "no_img.jpg"
-    comments_for_post = Comment.query.filter_by(post_id=post_id).order_by(Comment.date).all()
+    comments_for_post = Comment.query.filter_by(post_id=post_id).options(joinedload(Comment.comment_author)).order_by(
+        Comment.date).all()
 
     # Add comment to post
     form = CommentForm()
@@ -279,44 +299,16 @@ def show_post(post_id):
             return redirect(url_for("main.show_post", post_id=post_id))
 
         # Dictionary: {parent_comment: [comment_id]}
-        comment_ids = {}
+        comment_ids = defaultdict(list)
         for comment in comments_for_post:
-            if comment.parent_comment in comment_ids.keys():
-                comment_ids[comment.parent_comment].append(comment.id)
-            else:
-                comment_ids[comment.parent_comment] = []
-                comment_ids[comment.parent_comment].append(comment.id)
-
-        def make_comment_tree(number):
-            """All comments in "comment tree".
-
-            :param number: The number of parent_comment.
-            :type number: int
-            :return: List of comments.
-            :rtype: list
-            """
-            items = comment_ids[number]
-            final = []
-            for item in items:
-                record = Comment.query.filter_by(id=item).first()
-                if item in comment_ids.keys():
-                    my_dict = {"id": item,
-                               "author_name": record.comment_author.name,
-                               "author_surname": record.comment_author.surname,
-                               "text": record.text,
-                               "date": record.date,
-                               "child": make_comment_tree(item)}
-                else:
-                    my_dict = {"id": item,
-                               "author_name": record.comment_author.name,
-                               "author_surname": record.comment_author.surname,
-                               "text": record.text,
-                               "date": record.date}
-                final.append(my_dict)
-            return final
-
-        comments_tree = []
-        comments_tree.extend(make_comment_tree(0))
+            comment_ids[comment.parent_comment].append(comment.id)
+        comments = {comment.id: comment for comment in comments_for_post}
+        # Replies hidden by the limits are shown on demand - the thread of one comment
+        thread = request.args.get('thread', type=int)
+        roots = [thread] if thread in comments else comment_ids[0]
+        comments_tree = make_comment_tree(comments, comment_ids, roots,
+                                          current_app.config.get('COMMENTS_TREE_MAX_DEPTH'),
+                                          current_app.config.get('COMMENTS_TREE_MAX_CHILDREN'))
 
     else:
 
@@ -1,20 +1,25 @@
 """This module stores models used in application."""
+from collections import defaultdict
 from datetime import datetime, timedelta
+import hashlib
 import os
+import secrets
 import shutil
 import random
 from flask_login import UserMixin, AnonymousUserMixin
 from flask import current_app, url_for
-from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy.orm import relationship
-from sqlalchemy import Column, ForeignKey
+from sqlalchemy.orm import column_property, relationship
+from sqlalchemy import Column, ForeignKey, event, func, inspect, select
 from werkzeug.utils import secure_filename
 import jwt
-from email_validator import validate_email, EmailNotValidError
 from app.exceptions import ValidationError
-from . import db, login_manager
+from .emails import check_email
+from . import db, login_manager, passwords
+from .booking import RENTAL_BREAK, available_dates, find_conflict
 
 BASEDIR = os.path.abspath(os.path.dirname(__file__))
+# Maximum number of ids in one IN clause
+IN_CHUNK_SIZE = 500
 
 
 class Permission:
@@ -148,6 +153,9 @@ class User(UserMixin, db.Model):
     posts = relationship("NewsPost", back_populates="author")
     comments = relationship("Comment", back_populates="comment_author")
     role_id = db.Column(db.Integer, db.ForeignKey('roles.id', name="fk_role_id"))
+    # Fields of to_json
+    JSON_FIELDS = ('id', 'name', 'surname', 'email', 'telephone', 'address', 'role_id', 'post_number', 'posts',
+                   'rentals_number', 'rentals', 'comments_number', 'comments', 'opinions_number', 'opinions')
 
     def __init__(self, **kwargs):
         super(User, self).__init__(**kwargs)
@@ -190,22 +198,24 @@ class User(UserMixin, db.Model):
         :param password: User's password
         :type password: str
         """
-        hash_and_salted_password = generate_password_hash(
-            password,
-            method='pbkdf2:sha256',
-            salt_length=8
-        )
-        self.password_hash = hash_and_salted_password
+        self.password_hash = passwords.hash_password(password)
 
     def verify_password(self, password):
-        """Check if password is correct.
+        """Check if password is correct, an outdated hash is computed again.
+
+        The new hash is saved with the next commit of the session, ``db.session.is_modified(user)`` tells if it
+        was computed.
 
         :param password: User's password
         :type password: str
         :return: The information if the password matched
         :rtype: bool
         """
-        return check_password_hash(self.password_hash, password)
+        if not passwords.verify_password(self.password_hash, password):
+            return False
+        if passwords.needs_rehash(self.password_hash):
+            self.password = password
+        return True
 
     def __repr__(self):
         """Returns printable representation of User's class object.
@@ -216,42 +226,77 @@ class User(UserMixin, db.Model):
         user_mail = '<User %r>' % self.email
         return user_mail
 
-    def to_json(self):
+    def to_json(self, fields=None):
         """Convert user object to json.
 
+        :param fields: Fields to include, all fields by default (see to_json_list)
+        :type fields: collections.abc.Set
         :return: user's data in dict
         :rtype: dict
         """
-        opinions = [url_for('api.show_opinion', opinion_id=opinion.id) for opinion in
-                    Opinion.query.filter_by(author_id=self.id).all()]
-        comments = [url_for('api.show_comment', comment_id=comment.id) for comment in
-                    Comment.query.filter_by(author_id=self.id).all()]
-        user_rentals = [rental for rental in Rental.query.filter_by(users_id=self.id).all()]
-        rentals = [
-            url_for('api.show_rental', car_id=rental.cars_id, user_id=rental.users_id,
-                    date_time=int(rental.from_date.strftime('%Y%m%d%H%M'))) for
-            rental in user_rentals]
-        posts = [url_for('api.show_post', post_id=post.id) for post in
-                 NewsPost.query.filter_by(author_id=self.id).all()]
+        return User.to_json_list([self], fields)[0]
 
-        json_user = {
-            'id': self.id,
-            'name': self.name,
-            'surname': self.surname,
-            'email': self.email,
-            'telephone': self.telephone,
-            'address': self.address,
-            'role_id': self.role_id,
-            'post_number': len(self.posts),
-            'posts': posts,
-            'rentals_number': len(self.car_rented),
-            'rentals': rentals,
-            'comments_number': len(self.comments),
-            'comments': comments,
-            'opinions_number': len(self.opinions),
-            'opinions': opinions
-        }
-        return json_user
+    @staticmethod
+    def to_json_list(users, fields=None):
+        """Convert many users to json, urls of related objects are loaded with one query per model.
+
+        Related objects are loaded only for requested fields, numbers without urls are counted by the database.
+
+        :param users: Users
+        :type users: list
+        :param fields: Fields to include, all fields (JSON_FIELDS) by default
+        :type fields: collections.abc.Set
+        :return: users' data in dicts, the same as from to_json
+        :rtype: list
+        """
+        fields = User.JSON_FIELDS if fields is None else fields
+        ids = [user.id for user in users]
+        opinions, opinions_number = related_rows(
+            fields, 'opinions', 'opinions_number', Opinion.author_id,
+            lambda chunk: db.session.query(Opinion.author_id, Opinion.id).filter(
+                Opinion.author_id.in_(chunk)).order_by(Opinion.id), ids)
+        comments, comments_number = related_rows(
+            fields, 'comments', 'comments_number', Comment.author_id,
+            lambda chunk: db.session.query(Comment.author_id, Comment.id).filter(
+                Comment.author_id.in_(chunk)).order_by(Comment.id), ids)
+        rentals, rentals_number = related_rows(
+            fields, 'rentals', 'rentals_number', Rental.users_id,
+            lambda chunk: db.session.query(Rental.users_id, Rental.cars_id, Rental.from_date).filter(
+                Rental.users_id.in_(chunk)), ids)
+        posts, posts_number = related_rows(
+            fields, 'posts', 'post_number', NewsPost.author_id,
+            lambda chunk: db.session.query(NewsPost.author_id, NewsPost.id).filter(
+                NewsPost.author_id.in_(chunk)).order_by(NewsPost.id), ids)
+
+        json_users = []
+        for user in users:
+            json_user = {
+                'id': user.id,
+                'name': user.name,
+                'surname': user.surname,
+                'email': user.email,
+                'telephone': user.telephone,
+                'address': user.address,
+                'role_id': user.role_id,
+                'post_number': posts_number.get(user.id),
+                'rentals_number': rentals_number.get(user.id),
+                'comments_number': comments_number.get(user.id),
+                'opinions_number': opinions_number.get(user.id)
+            }
+            if 'posts' in fields:
+                json_user['posts'] = [url_for('api.show_post', post_id=post_id) for post_id, in posts[user.id]]
+            if 'rentals' in fields:
+                json_user['rentals'] = [url_for('api.show_rental', car_id=car_id, user_id=user.id,
+                                                date_time=int(from_date.strftime('%Y%m%d%H%M')))
+                                        for car_id, from_date in rentals[user.id]]
+            if 'comments' in fields:
+                json_user['comments'] = [url_for('api.show_comment', comment_id=comment_id)
+                                         for comment_id, in comments[user.id]]
+            if 'opinions' in fields:
+                json_user['opinions'] = [url_for('api.show_opinion', opinion_id=opinion_id)
+                                         for opinion_id, in opinions[user.id]]
+            json_users.append({key: value for key, value in json_user.items() if key in fields})
+        return json_users
 
     def to_json_user_data(self):
         """Convert user object to json, used for user not admin.
@@ -293,12 +338,9 @@ class User(UserMixin, db.Model):
         check_if_null(email, "email")
         if len(email) > 80:
             raise ValidationError('Maximum number of characters is 80.', 'email')
-        try:
-            validate_email(email)
-        except EmailNotValidError:
-            raise ValidationError("Email is incorrect.", "email")
+        check_email(email)
         check_if_null(telephone, "telephone")
-        return User(name=name, surname=surname, password_hash=generate_password_hash(password), email=email,
+        return User(name=name, surname=surname, password_hash=passwords.hash_password(password), email=email,
                     telephone=telephone, address=address)
 
     @staticmethod
@@ -320,7 +362,7 @@ class User(UserMixin, db.Model):
         if 'new_password' in json_data:
             password = json_data.get('new_password')
             check_if_null(password, "password")
-            password_hash = generate_password_hash(password)
+            password_hash = passwords.hash_password(password)
         else:
             password_hash = user.password_hash
 
@@ -332,10 +374,7 @@ class User(UserMixin, db.Model):
 
         if len(email) > 80:
             raise ValidationError('Maximum number of characters is 80.', 'email')
-        try:
-            validate_email(email)
-        except EmailNotValidError:
-            raise ValidationError("Email is incorrect.", "email")
+        check_email(email)
         check_if_null(name, "name")
         check_if_null(surname, "surname")
         check_if_null(email, "email")
@@ -356,10 +395,152 @@ class User(UserMixin, db.Model):
         """
         payload = {
             'user_id': self.id,
+            'permissions': self.role.permissions if self.role is not None else 0,
+            'ver': get_token_version(self.id),
             'exp': datetime.utcnow() + timedelta(minutes=current_app.config.get('JWT_EXPIRED_MINUTES', 10))
         }
         return jwt.encode(payload, current_app.config.get('SECRET_KEY'), algorithm='HS256')
 
+    def revoke_tokens(self):
+        """Revoke JWT tokens issued so far (e.g. the role was changed and the permissions claim is outdated).
+
+        Tokens are revoked automatically when the role of the user is changed or the user is deleted
+        (see _collect_revoked_users).
+        """
+        revoke_user_tokens(self.id)
+
+
+def revoke_user_tokens(user_id):
+    """Increase the version of user's JWT tokens, tokens with older version are rejected.
+
+    :param user_id: Id of the user
+    :type user_id: int
+    """
+    versions = current_app.extensions.setdefault('token_versions', {})
+    versions[user_id] = versions.get(user_id, 0) + 1
+
+
+def get_token_version(user_id):
+    """Return the current version of user's JWT tokens, tokens with older version are revoked.
+
+    Versions are kept in the memory of the process: revocation (role change, deleted user) isn't shared by workers
+    and is lost after restart, then revoked tokens are valid until they expire (``JWT_EXPIRED_MINUTES``).
+
+    :param user_id: Id of the user
+    :type user_id: int
+    :return: Version of tokens
+    :rtype: int
+    """
+    return current_app.extensions.get('token_versions', {}).get(user_id, 0)
+
+
+_REVOKED_USERS_KEY = 'revoked_token_users'
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_revoked_users(session, flush_context):
+    """Remember users whose role was changed or who were deleted in the flush, their tokens are revoked after commit.
+
+    Bulk updates and deletes (Query.update, Query.delete) don't revoke tokens.
+    """
+    revoked = session.info.setdefault(_REVOKED_USERS_KEY, set())
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            revoked.add(obj.id)
+    for obj in session.dirty:
+        if isinstance(obj, User):
+            attrs = inspect(obj).attrs
+            if attrs.role_id.history.has_changes() or attrs.role.history.has_changes():
+                revoked.add(obj.id)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _revoke_tokens_of_users(session):
+    """Revoke tokens of users changed in the committed transaction."""
+    for user_id in session.info.pop(_REVOKED_USERS_KEY, ()):
+        revoke_user_tokens(user_id)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_revoked_users(session):
+    """Forget users changed in the rolled back transaction."""
+    session.info.pop(_REVOKED_USERS_KEY, None)
+
+
+class RefreshToken(db.Model):
+    """Class contains refresh tokens used to renew JWT tokens without the password.
+
+    Only the SHA-256 hash of the token is stored, each token can be used once - the refresh returns a new one.
+    """
+    __tablename__ = 'refresh_tokens'
+    id = db.Column(db.Integer, primary_key=True)
+    token_hash = db.Column(db.String(64), unique=True, nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    expires = db.Column(db.DateTime, nullable=False)
+    used = db.Column(db.Boolean, nullable=False, default=False)
+    user = relationship('User')
+
+    @staticmethod
+    def hash_token(token):
+        """Hash the refresh token (tokens are random, so a fast hash is enough).
+
+        :param token: Refresh token
+        :type token: str
+        :return: Hex digest of the token
+        :rtype: str
+        """
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    @staticmethod
+    def issue(user_id):
+        """Create a new refresh token of the user and remove expired ones, the session has to be committed.
+
+        :param user_id: Id of the user
+        :type user_id: int
+        :return: Refresh token
+        :rtype: str
+        """
+        now = datetime.utcnow()
+        RefreshToken.query.filter(RefreshToken.user_id == user_id, RefreshToken.expires < now) \
+            .delete(synchronize_session=False)
+        token = secrets.token_urlsafe(32)
+        expires = now + timedelta(days=current_app.config.get('REFRESH_TOKEN_EXPIRED_DAYS', 30))
+        db.session.add(RefreshToken(token_hash=RefreshToken.hash_token(token), user_id=user_id, expires=expires))
+        return token
+
+    @staticmethod
+    def rotate(token):
+        """Use the refresh token and issue the next one, the session has to be committed.
+
+        Using a token the second time revokes all refresh tokens of the user (the token could be stolen).
+
+        :param token: Refresh token
+        :type token: str
+        :return: User and new refresh token, or None if the token is invalid
+        :rtype: tuple
+        """
+        if not isinstance(token, str):
+            return None
+        refresh_token = RefreshToken.query.filter_by(token_hash=RefreshToken.hash_token(token)).first()
+        if refresh_token is None or refresh_token.expires < datetime.utcnow():
+            return None
+        # Mark the token as used in one statement, so concurrent requests can't both use it
+        claimed = RefreshToken.query.filter_by(id=refresh_token.id, used=False) \
+            .update({'used': True}, synchronize_session=False)
+        if not claimed:
+            RefreshToken.revoke_all(refresh_token.user_id)
+            return None
+        return refresh_token.user, RefreshToken.issue(refresh_token.user_id)
+
+    @staticmethod
+    def revoke_all(user_id):
+        """Remove all refresh tokens of the user, the session has to be committed.
+
+        :param user_id: Id of the user
+        :type user_id: int
+        """
+        RefreshToken.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+
 
 def check_if_null(variable, variable_name):
     """Check if value in json dict is null or None.
@@ -374,6 +555,70 @@ def check_if_null(variable, variable_name):
         raise ValidationError(f"{variable_name} can't be null", variable_name)
 
 
+def group_rows(make_query, ids):
+    """Run the query for ids in chunks (IN clause) and group rows by the first column.
+
+    :param make_query: Function returning query of rows (id, values...) for the list of ids
+    :type make_query: function
+    :param ids: Ids
+    :type ids: list
+    :return: Rows without the first column, grouped by it
+    :rtype: collections.defaultdict
+    """
+    grouped = defaultdict(list)
+    for position in range(0, len(ids), IN_CHUNK_SIZE):
+        for row in make_query(ids[position:position + IN_CHUNK_SIZE]):
+            grouped[row[0]].append(tuple(row[1:]))
+    return grouped
+
+
+def count_rows(foreign_key, ids):
+    """Count related rows for ids in chunks (IN clause), grouped by the database.
+
+    :param foreign_key: Column of the related model with ids
+    :type foreign_key: InstrumentedAttribute
+    :param ids: Ids
+    :type ids: list
+    :return: Numbers of rows by id
+    :rtype: collections.defaultdict
+    """
+    counted = defaultdict(int)
+    for position in range(0, len(ids), IN_CHUNK_SIZE):
+        counted.update(db.session.query(foreign_key, func.count()).filter(
+            foreign_key.in_(ids[position:position + IN_CHUNK_SIZE])).group_by(foreign_key))
+    return counted
+
+
+def related_rows(fields, urls_field, number_field, foreign_key, make_query, ids):
+    """Load related objects needed by the requested fields of json.
+
+    Rows are loaded only for urls, the number alone is counted by the database, nothing is queried
+    if both fields are excluded.
+
+    :param fields: Requested fields
+    :type fields: collections.abc.Set
+    :param urls_field: Field with urls of related objects
+    :type urls_field: str
+    :param number_field: Field with the number of related objects
+    :type number_field: str
+    :param foreign_key: Column of the related model with ids
+    :type foreign_key: InstrumentedAttribute
+    :param make_query: Function returning query of rows (id, values...) for the list of ids, see group_rows
+    :type make_query: function
+    :param ids: Ids
+    :type ids: list
+    :return: Rows grouped by id and numbers of rows by id
+    :rtype: tuple[dict, dict]
+    """
+    if urls_field in fields:
+        rows = group_rows(make_query, ids)
+        return rows, {key: len(rows[key]) for key in ids}
+    if number_field in fields:
+        counted = count_rows(foreign_key, ids)
+        return {}, {key: counted[key] for key in ids}
+    return {}, {}
+
+
 @login_manager.user_loader
 def load_user(user_id):
     """Provides user session management - loading user.
@@ -391,11 +636,13 @@ class Opinion(db.Model):
     """
     __tablename__ = "opinions"
     id = db.Column(db.Integer, primary_key=True)
-    author_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    author_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False, index=True)
     opinion_author = relationship("User", back_populates="opinions")
     text = db.Column(db.Text, nullable=False)
     image = db.Column(db.Text, nullable=False)
     date = db.Column(db.DateTime, nullable=False)
+    # Fields of to_json
+    JSON_FIELDS = ('id', 'author_url', 'text', 'image_url', 'date')
 
     def to_json(self):
         """Convert opinion object to json.
@@ -444,28 +691,72 @@ class Car(db.Model):
     model = db.Column(db.String(250), unique=False, nullable=False)
     image = db.Column(db.Text, nullable=True)
     car_rental = relationship("Rental", back_populates="car_rent")
+    # Fields of to_json and to_json_short
+    JSON_FIELDS = ('id', 'name', 'price', 'year', 'model', 'image', 'rentals_url', 'rentals_number')
+    JSON_SHORT_FIELDS = ('id', 'name', 'price', 'year', 'model', 'image', 'car_url')
 
-    def to_json(self):
+    def to_json(self, fields=None):
         """Convert car object to json.
 
+        :param fields: Fields to include, all fields by default (see to_json_list)
+        :type fields: collections.abc.Set
+        :return: data in dict
+        :rtype: dict
+        """
+        return Car.to_json_list([self], fields)[0]
+
+    @staticmethod
+    def to_json_list(cars, fields=None):
+        """Convert many cars to json, keys of rentals are loaded with one query.
+
+        Rentals are loaded only for requested fields (see related_rows).
+
+        :param cars: Cars
+        :type cars: list
+        :param fields: Fields to include, all fields (JSON_FIELDS) by default
+        :type fields: collections.abc.Set
+        :return: cars' data in dicts, the same as from to_json
+        :rtype: list
+        """
+        fields = Car.JSON_FIELDS if fields is None else fields
+        rentals, rentals_number = related_rows(
+            fields, 'rentals_url', 'rentals_number', Rental.cars_id,
+            lambda chunk: db.session.query(Rental.cars_id, Rental.users_id, Rental.from_date).filter(
+                Rental.cars_id.in_(chunk)).order_by(Rental.cars_id, Rental.available_from, Rental.from_date),
+            [car.id for car in cars])
+        json_cars = []
+        for car in cars:
+            json_car = {
+                'id': car.id,
+                'name': car.name,
+                'price': car.price,
+                'year': car.year,
+                'model': car.model,
+                'rentals_number': rentals_number.get(car.id)
+            }
+            if 'image' in fields:
+                json_car['image'] = url_for('static', filename='img/' + car.image)
+            if 'rentals_url' in fields:
+                json_car['rentals_url'] = [url_for('api.show_rental', car_id=car.id, user_id=user_id,
+                                                   date_time=int(from_date.strftime('%Y%m%d%H%M')))
+                                           for user_id, from_date in rentals[car.id]]
+            json_cars.append({key: value for key, value in json_car.items() if key in fields})
+        return json_cars
+
+    def to_json_short(self):
+        """Convert car object to json without rentals.
+
         :return: data in dict
         :rtype: dict
         """
-        img = url_for('static', filename='img/' + self.image)
-        car_rentals = [rental for rental in Rental.query.filter_by(cars_id=self.id).all()]
-        rentals = [
-            url_for('api.show_rental', car_id=self.id, user_id=rental.users_id,
-                    date_time=int(rental.from_date.strftime('%Y%m%d%H%M'))) for
-            rental in car_rentals]
         json_car = {
             'id': self.id,
             'name': self.name,
             'price': self.price,
             'year': self.year,
             'model': self.model,
-            'image': img,
-            'rentals_url': rentals,
-            'rentals_number': len(car_rentals)
+            'image': url_for('static', filename='img/' + self.image),
+            'car_url': url_for('api.get_car', car_id=self.id)
         }
         return json_car
 
@@ -564,36 +855,72 @@ class Rental(db.Model):
     """Class contains information about rentals.
     """
     __tablename__ = 'rentals'
+    __table_args__ = (
+        db.Index('ix_rentals_cars_id_available_from_from_date', 'cars_id', 'available_from', 'from_date'),
+    )
     cars_id = Column(ForeignKey('cars.id'), primary_key=True, nullable=False)
-    users_id = Column(ForeignKey('users.id'), primary_key=True, nullable=False)
+    users_id = Column(ForeignKey('users.id'), primary_key=True, nullable=False, index=True)
     from_date = db.Column(db.DateTime, primary_key=True, nullable=False)
     to_date = db.Column(db.DateTime, nullable=False)
     available_from = db.Column(db.DateTime, nullable=False)
     users_rent = relationship('User', back_populates="car_rented")
     car_rent = relationship("Car", back_populates="car_rental")
+    slots = relationship('RentalSlot', back_populates="rental", cascade="all, delete-orphan")
+    # Fields of to_json
+    JSON_FIELDS = ('id', 'user_url', 'car_url', 'from_date', 'to_date', 'available_from')
 
-    def to_json(self):
+    def to_json(self, fields=None):
         """Convert rental object to json.
 
+        :param fields: Fields to include, all fields by default (see to_json_list)
+        :type fields: collections.abc.Set
         :return: data in dict
         :rtype: dict
         """
-        json_rental = {
-            'id': {"car": self.cars_id, "user": self.users_id, "from": self.from_date.strftime("%d/%m/%Y, %H:%M")},
-            'user_url': url_for('api.get_user', user_to_show_id=self.users_id),
-            'car_url': url_for('api.get_car', car_id=self.cars_id),
-            'from_date': self.from_date.strftime("%d/%m/%Y, %H:%M:%S"),
-            'to_date': self.to_date.strftime("%d/%m/%Y, %H:%M:%S"),
-            'available_from': self.available_from.strftime("%d/%m/%Y, %H:%M:%S")
-        }
-        return json_rental
+        return Rental.to_json_list([self], fields)[0]
 
     @staticmethod
-    def from_json(json_data):
+    def to_json_list(rentals, fields=None):
+        """Convert many rentals to json, urls of users and cars are built once per object.
+
+        :param rentals: Rentals
+        :type rentals: list
+        :param fields: Fields to include, all fields (JSON_FIELDS) by default
+        :type fields: collections.abc.Set
+        :return: rentals' data in dicts, the same as from to_json
+        :rtype: list
+        """
+        fields = Rental.JSON_FIELDS if fields is None else fields
+        user_urls = {}
+        car_urls = {}
+        json_rentals = []
+        for rental in rentals:
+            json_rental = {}
+            if 'id' in fields:
+                json_rental['id'] = {"car": rental.cars_id, "user": rental.users_id,
+                                     "from": rental.from_date.strftime("%d/%m/%Y, %H:%M")}
+            if 'user_url' in fields:
+                if rental.users_id not in user_urls:
+                    user_urls[rental.users_id] = url_for('api.get_user', user_to_show_id=rental.users_id)
+                json_rental['user_url'] = user_urls[rental.users_id]
+            if 'car_url' in fields:
+                if rental.cars_id not in car_urls:
+                    car_urls[rental.cars_id] = url_for('api.get_car', car_id=rental.cars_id)
+                json_rental['car_url'] = car_urls[rental.cars_id]
+            for field in ('from_date', 'to_date', 'available_from'):
+                if field in fields:
+                    json_rental[field] = getattr(rental, field).strftime("%d/%m/%Y, %H:%M:%S")
+            json_rentals.append(json_rental)
+        return json_rentals
+
+    @staticmethod
+    def from_json(json_data, check_conflicts=True):
         """Create Rental object from json data.
 
         :param json_data: Data in json
         :type json_data: dict
+        :param check_conflicts: Check if the car is free, False when the caller checks many rentals at once
+        :type check_conflicts: bool
         :raises ValidationError: wrong attribute
         :return: Rental object
         :rtype: object
@@ -602,8 +929,7 @@ class Rental(db.Model):
 
         car = json_data.get('car_id')
         check_if_null(car, 'car_id')
-        possible_car_id = [car.id for car in Car.query.all()]
-        if car not in possible_car_id:
+        if not isinstance(car, (int, float)) or Car.query.get(car) is None:
             raise ValidationError('Wrong value.', 'car_id')
 
         from_date = json_data.get('from_date')
@@ -617,28 +943,45 @@ class Rental(db.Model):
         if to_date <= from_date:
             raise ValidationError(f"Wrong value, date can't be before {from_date.strftime('%Y-%m-%d %H:%M')}.",
                                   'from_date')
-        all_car_rentals = [rental for rental in Rental.query.filter_by(cars_id=car).all()]
-        for rental in all_car_rentals:
-            if rental.from_date <= from_date <= rental.available_from or rental.from_date <= to_date + timedelta(
-                    hours=1) <= rental.available_from:
-                raise ValidationError(
-                    f"Wrong dates, available before: "
-                    f"{(rental.from_date + timedelta(minutes=-61)).strftime('%Y-%m-%d %H:%M')},"
-                    f"available after:"
-                    f"{(rental.available_from + timedelta(minutes=1)).strftime('%Y-%m-%d %H:%M')}", "dates")
-            if from_date < rental.from_date < rental.available_from and \
-                    rental.from_date < rental.available_from < to_date + timedelta(hours=1):
-                raise ValidationError(
-                    f"Wrong dates, available before: "
-                    f"{(rental.from_date + timedelta(minutes=-61)).strftime('%Y-%m-%d %H:%M')},"
-                    f"available after:"
-                    f"{(rental.available_from + timedelta(minutes=1)).strftime('%Y-%m-%d %H:%M')}", "dates")
-        available_from = to_date + timedelta(hours=1)
+        if check_conflicts:
+            check_conflict(find_conflict(car, from_date, to_date))
+        available_from = to_date + RENTAL_BREAK
 
         return Rental(cars_id=car, users_id=user_id, from_date=from_date, to_date=to_date,
                       available_from=available_from)
 
 
+class RentalSlot(db.Model):
+    """Class contains buckets of time occupied by rentals, used by the slot backend of overlap checks.
+    """
+    __tablename__ = 'rental_slots'
+    __table_args__ = (
+        db.ForeignKeyConstraint(['cars_id', 'users_id', 'from_date'],
+                                ['rentals.cars_id', 'rentals.users_id', 'rentals.from_date'], ondelete='CASCADE'),
+    )
+    cars_id = db.Column(db.Integer, primary_key=True, nullable=False)
+    bucket = db.Column(db.Integer, primary_key=True, nullable=False)
+    users_id = db.Column(db.Integer, nullable=False)
+    from_date = db.Column(db.DateTime, nullable=False)
+    rental = relationship('Rental', back_populates="slots")
+
+
+def check_conflict(conflict):
+    """Check if there is a conflicting rental.
+
+    :param conflict: Pair (from_date, available_from) of the conflicting rental or None
+    :type conflict: tuple
+    :raises ValidationError: the car is not available
+    """
+    if conflict is not None:
+        available_before, available_after = available_dates(conflict)
+        raise ValidationError(
+            f"Wrong dates, available before: "
+            f"{available_before.strftime('%Y-%m-%d %H:%M')},"
+            f"available after:"
+            f"{available_after.strftime('%Y-%m-%d %H:%M')}", "dates")
+
+
 def check_date(date, name_date: str):
     """Check if check_date in json dict is correct.
 
@@ -668,36 +1011,61 @@ class NewsPost(db.Model):
     """
     __tablename__ = "news_posts"
     id = db.Column(db.Integer, primary_key=True)
-    author_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    author_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False, index=True)
     author = relationship("User", back_populates="posts")
     title = db.Column(db.String(250), unique=True, nullable=False)
     date = db.Column(db.String(250), nullable=False)
     body = db.Column(db.Text, nullable=False)
     img_url = db.Column(db.String(250), nullable=False)
     comments = relationship("Comment", back_populates="parent_post")
+    # Fields of to_json
+    JSON_FIELDS = ('id', 'user_url', 'title', 'text', 'date', 'img_url', 'comments_urls', 'comments_number')
 
-    def to_json(self):
+    def to_json(self, fields=None):
         """Convert NewsPost object to json.
 
+        :param fields: Fields to include, all fields by default (see to_json_list)
+        :type fields: collections.abc.Set
         :return: data in dict
         :rtype: dict
         """
-        comments_list = [comment for comment in Comment.query.filter_by(post_id=self.id).all()]
-        comment_parents = list(
-            set(([comment.parent_comment for comment in Comment.query.filter_by(post_id=self.id).all()])))
-        comments = get_all_comments_for_post(parent_comment=0, list_of_comments=comments_list,
-                                             list_of_parents_comments=comment_parents)
-        json_news_post = {
-            'id': self.id,
-            'user_url': url_for('api.get_user', user_to_show_id=self.author_id),
-            'title': self.title,
-            'text': self.body,
-            'date': self.date,
-            'img_url': url_for('static', filename='img/' + self.img_url),
-            'comments_urls': comments,
-            'comments_number': len(comments_list)
-        }
-        return json_news_post
+        return NewsPost.to_json_list([self], fields)[0]
+
+    @staticmethod
+    def to_json_list(posts, fields=None):
+        """Convert many NewsPost objects to json, comments of all posts are loaded with one query.
+
+        Comments are loaded only for requested fields (see related_rows).
+
+        :param posts: News posts
+        :type posts: list
+        :param fields: Fields to include, all fields (JSON_FIELDS) by default
+        :type fields: collections.abc.Set
+        :return: posts' data in dicts, the same as from to_json
+        :rtype: list
+        """
+        fields = NewsPost.JSON_FIELDS if fields is None else fields
+        comments, comments_number = related_rows(
+            fields, 'comments_urls', 'comments_number', Comment.post_id,
+            lambda chunk: db.session.query(Comment.post_id, Comment.id, Comment.parent_comment).filter(
+                Comment.post_id.in_(chunk)).order_by(Comment.id), [post.id for post in posts])
+        json_news_posts = []
+        for post in posts:
+            json_news_post = {
+                'id': post.id,
+                'title': post.title,
+                'text': post.body,
+                'date': post.date,
+                'comments_number': comments_number.get(post.id)
+            }
+            if 'user_url' in fields:
+                json_news_post['user_url'] = url_for('api.get_user', user_to_show_id=post.author_id)
+            if 'img_url' in fields:
+                json_news_post['img_url'] = url_for('static', filename='img/' + post.img_url)
+            if 'comments_urls' in fields:
+                json_news_post['comments_urls'] = get_comments_tree(comments[post.id])
+            json_news_posts.append({key: value for key, value in json_news_post.items() if key in fields})
+        return json_news_posts
 
     @staticmethod
     def from_json(json_data):
@@ -733,31 +1101,34 @@ class NewsPost(db.Model):
         return NewsPost(author_id=author, title=title, date=date, body=body, img_url=image)
 
 
-def get_all_comments_for_post(parent_comment, list_of_comments, list_of_parents_comments):
+def get_comments_tree(comments):
     """Create a list of comments including hierarchy of child comments.
 
-    :param parent_comment: Value of parent comment (ID)
-    :type parent_comment: int
-    :param list_of_comments: List of comments
-    :type list_of_comments: list
-    :param list_of_parents_comments: List of parent comments (IDs)
-    :type list_of_parents_comments: list
-    :return: All comments with child comments
+    A comment without children is its url, a comment with children is a dict {url: [children]}. The tree is built
+    from the map parent -> children in one pass, without recursion, so deep threads don't hit the recursion limit.
+
+    :param comments: Pairs (id, parent_comment) of comments of the post in order of ids
+    :type comments: list
+    :return: Comments with parent_comment 0 with their child comments
     :rtype: list
     """
-    all_comments = []
-    for item in list_of_comments:
-        if item.parent_comment == parent_comment:
-            if item.id not in list_of_parents_comments:
-                comment_url = url_for('api.show_comment', comment_id=item.id)
-            else:
-                comment_url = {
-                    url_for('api.show_comment', comment_id=item.id): get_all_comments_for_post(item.id,
-                                                                                               list_of_comments,
-                                                                                               list_of_parents_comments)
-                }
-            all_comments.append(comment_url)
-    return all_comments
+    children = defaultdict(list)
+    for comment_id, parent_comment in comments:
+        children[parent_comment].append(comment_id)
+    order = []
+    stack = list(children.get(0, ()))
+    while stack:
+        comment_id = stack.pop()
+        order.append(comment_id)
+        stack.extend(children.get(comment_id, ()))
+
+    urls = {}
+    for comment_id in reversed(order):
+        comment_url = url_for('api.show_comment', comment_id=comment_id)
+        if comment_id in children:
+            comment_url = {comment_url: [urls[child] for child in children[comment_id]]}
+        urls[comment_id] = comment_url
+    return [urls[comment_id] for comment_id in children.get(0, ())]
 
 
 def check_img_name(image, old_image=None):
@@ -795,13 +1166,15 @@ class Comment(db.Model):
     """
     __tablename__ = "comments"
     id = db.Column(db.Integer, primary_key=True)
-    post_id = db.Column(db.Integer, db.ForeignKey("news_posts.id"), nullable=False)
-    author_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    post_id = db.Column(db.Integer, db.ForeignKey("news_posts.id"), nullable=False, index=True)
+    author_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False, index=True)
     parent_post = relationship("NewsPost", back_populates="comments")
     comment_author = relationship("User", back_populates="comments")
     text = db.Column(db.Text, nullable=False)
     date = db.Column(db.DateTime, nullable=False)
     parent_comment = db.Column(db.Integer, nullable=True)
+    # Fields of to_json
+    JSON_FIELDS = ('id', 'text', 'post_url', 'author_url', 'date', 'upper_comment_url')
 
     def to_json(self):
         """Convert comment object to json.
@@ -857,3 +1230,29 @@ class Comment(db.Model):
             raise ValidationError('Wrong value.', 'upper_comment')
 
         return Comment(post_id=post, author_id=author, text=text, date=date, parent_comment=upper_comment)
+
+
+def count_property(foreign_key, primary_key):
+    """Create a deferred column with the number of related rows, counted by the database.
+
+    The column is a correlated subquery, so API filters and sorting (``rentals_number[gte]=2``,
+    ``sort=-comments_number``) run in SQL together with pagination. It isn't loaded with objects.
+
+    :param foreign_key: Column of the related model pointing at the counted object
+    :type foreign_key: InstrumentedAttribute
+    :param primary_key: Primary key of the counted object
+    :type primary_key: InstrumentedAttribute
+    :return: Column property
+    :rtype: ColumnProperty
+    """
+    return column_property(select(func.count()).where(foreign_key == primary_key).correlate_except(
+        foreign_key.class_).scalar_subquery(), deferred=True)
+
+
+# Numbers of related objects, the same names as in to_json
+User.post_number = count_property(NewsPost.author_id, User.id)
+User.rentals_number = count_property(Rental.users_id, User.id)
+User.comments_number = count_property(Comment.author_id, User.id)
+User.opinions_number = count_property(Opinion.author_id, User.id)
+Car.rentals_number = count_property(Rental.cars_id, Car.id)
+NewsPost.comments_number = count_property(Comment.post_id, NewsPost.id)
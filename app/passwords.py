@@ -0,0 +1,153 @@
+"""The module contains hashing of passwords - all hashes are computed with one configured method in a bounded pool.
+
+PBKDF2 is slow on purpose, so hashes are computed by PASSWORD_HASH_WORKERS threads (hashlib releases the GIL)
+and at most PASSWORD_HASH_QUEUE requests wait for them. A burst of logins can't occupy all request threads,
+when the queue is full for PASSWORD_HASH_TIMEOUT seconds the request fails with 503 Service Unavailable.
+"""
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class PasswordHasher:
+    """Class contains the pool of threads hashing passwords with the configured method."""
+
+    def __init__(self, method, salt_length, workers, queue, timeout):
+        """Create the pool.
+
+        :param method: Method of werkzeug.security.generate_password_hash (e.g. pbkdf2:sha256:150000)
+        :type method: str
+        :param salt_length: Length of the salt
+        :type salt_length: int
+        :param workers: Number of threads computing hashes
+        :type workers: int
+        :param queue: Number of hashes waiting for a thread
+        :type queue: int
+        :param timeout: Seconds to wait for a place in the queue
+        :type timeout: float
+        """
+        self.method = method
+        self.salt_length = salt_length
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hasher')
+        self._slots = threading.BoundedSemaphore(workers + queue)
+
+    def _run(self, function, *args):
+        """Run the function in the pool and wait for the result.
+
+        :param function: Hashing function
+        :type function: function
+        :return: Result of the function
+        :raises ServiceUnavailable: the queue is full
+        """
+        if not self._slots.acquire(timeout=self.timeout):
+            raise ServiceUnavailable('Too many password checks, try again later.')
+        try:
+            future = self._executor.submit(function, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+    def hash(self, password):
+        """Hash the password.
+
+        :param password: Password
+        :type password: str
+        :return: Hash of the password
+        :rtype: str
+        """
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, password_hash, password):
+        """Check the password.
+
+        :param password_hash: Stored hash
+        :type password_hash: str
+        :param password: Password
+        :type password: str
+        :return: The information if the password matched
+        :rtype: bool
+        """
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """Check if the hash was computed with other method or shorter salt than configured.
+
+        :param password_hash: Stored hash
+        :type password_hash: str
+        :return: The information if the hash is outdated
+        :rtype: bool
+        """
+        if password_hash.count('$') < 2:
+            return True
+        method, salt, _ = password_hash.split('$', 2)
+        return method != self.method or len(salt) < self.salt_length
+
+    def shutdown(self, wait=True):
+        """Stop threads of the pool.
+
+        :param wait: Wait for running hashes
+        :type wait: bool
+        """
+        self._executor.shutdown(wait=wait)
+
+
+def get_password_hasher():
+    """Return the password hasher of the current application, create it if needed.
+
+    :return: Password hasher
+    :rtype: PasswordHasher
+    """
+    hasher = current_app.extensions.get('password_hasher')
+    if hasher is None:
+        config = current_app.config
+        created = PasswordHasher(config.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:150000'),
+                                 config.get('PASSWORD_SALT_LENGTH', 16),
+                                 config.get('PASSWORD_HASH_WORKERS', 4),
+                                 config.get('PASSWORD_HASH_QUEUE', 32),
+                                 config.get('PASSWORD_HASH_TIMEOUT', 10))
+        hasher = current_app.extensions.setdefault('password_hasher', created)
+        if hasher is created:
+            # Threads of the pool are stopped with the application
+            weakref.finalize(current_app._get_current_object(), created.shutdown, False)
+    return hasher
+
+
+def hash_password(password):
+    """Hash the password with the configured method.
+
+    :param password: Password
+    :type password: str
+    :return: Hash of the password
+    :rtype: str
+    """
+    return get_password_hasher().hash(password)
+
+
+def verify_password(password_hash, password):
+    """Check the password with the stored hash.
+
+    :param password_hash: Stored hash
+    :type password_hash: str
+    :param password: Password
+    :type password: str
+    :return: The information if the password matched
+    :rtype: bool
+    """
+    return get_password_hasher().verify(password_hash, password)
+
+
+def needs_rehash(password_hash):
+    """Check if the stored hash should be computed again with the configured method.
+
+    :param password_hash: Stored hash
+    :type password_hash: str
+    :return: The information if the hash is outdated
+    :rtype: bool
+    """
+    return get_password_hasher().needs_rehash(password_hash)
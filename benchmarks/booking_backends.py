@@ -0,0 +1,229 @@
+"""Micro-benchmark of overlap check backends of the booking package.
+
+Usage (from the project directory)::
+
+    python -m benchmarks.booking_backends
+    python -m benchmarks.booking_backends --sizes 1000 100000 --checks 2000 --backends sql index slots
+
+For each size a temporary SQLite database is filled with rentals of cars (1000 rentals of history per car)
+and every backend answers the same random overlap checks. ``setup`` is the time of the first check of each car
+(e.g. loading the index), ``check`` is the mean time of the following checks.
+
+The second table is the throughput of parallel reservations (``--threads`` threads, each making ``--bookings``
+overlapping reservations of 3 cars) on an empty database shared by the threads.
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from app import create_app, db
+from app.booking import OVERLAP_BACKENDS, RENTAL_BREAK, find_conflict, reserve_rentals
+from app.booking.slots import slot_range
+from app.models import Car, Rental, RentalSlot, Role, User
+
+START = datetime(2020, 1, 1)
+RENTALS_PER_CAR = 1000
+CHUNK = 50000
+
+
+def rental_rows(size, generator):
+    """Generate rentals which don't overlap, RENTALS_PER_CAR for each car.
+
+    :param size: Number of rentals
+    :type size: int
+    :param generator: Random numbers generator
+    :type generator: random.Random
+    :return: Rows of the rentals table
+    :rtype: generator
+    """
+    for car_id in range(1, size // RENTALS_PER_CAR + 2):
+        from_date = START
+        for _ in range(min(RENTALS_PER_CAR, size - (car_id - 1) * RENTALS_PER_CAR)):
+            from_date += timedelta(hours=generator.randrange(4, 48))
+            to_date = from_date + timedelta(hours=generator.randrange(1, 24))
+            yield {'cars_id': car_id, 'users_id': 1, 'from_date': from_date, 'to_date': to_date,
+                   'available_from': to_date + RENTAL_BREAK}
+            from_date = to_date + RENTAL_BREAK
+
+
+def insert_chunks(table, rows):
+    """Insert rows with executemany in chunks.
+
+    :param table: Table
+    :type table: sqlalchemy.Table
+    :param rows: Rows
+    :type rows: iterable
+    """
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK:
+            db.session.execute(table.insert(), chunk)
+            chunk = []
+    if chunk:
+        db.session.execute(table.insert(), chunk)
+    db.session.commit()
+
+
+def fill_database(size, with_slots, generator):
+    """Fill the database with users, cars and rentals.
+
+    :param size: Number of rentals
+    :type size: int
+    :param with_slots: Fill the slot table as well
+    :type with_slots: bool
+    :param generator: Random numbers generator
+    :type generator: random.Random
+    :return: Number of cars
+    :rtype: int
+    """
+    Role.insert_roles()
+    db.session.add(User(name='name', surname='surname', telephone=12345, password='password',
+                        email='benchmark@test.com'))
+    cars = size // RENTALS_PER_CAR + 1
+    db.session.add_all([Car(name=f"Car {number}", price=100, year=2000, model="model", image="no_img.jpg")
+                        for number in range(cars)])
+    db.session.commit()
+    insert_chunks(Rental.__table__, rental_rows(size, generator))
+    if with_slots:
+        minutes = db.get_app().config['RENTAL_SLOT_MINUTES']
+        rows = db.session.query(Rental.cars_id, Rental.users_id, Rental.from_date, Rental.available_from)
+        insert_chunks(RentalSlot.__table__, ({'cars_id': cars_id, 'users_id': users_id, 'from_date': from_date,
+                                              'bucket': bucket}
+                                             for cars_id, users_id, from_date, available_from in rows.yield_per(CHUNK)
+                                             for bucket in slot_range(from_date, available_from, minutes)))
+    return cars
+
+
+def run_checks(app, backend, cars, checks, generator):
+    """Measure overlap checks of the backend.
+
+    :param app: Application
+    :type app: flask.Flask
+    :param backend: Name of the backend
+    :type backend: str
+    :param cars: Number of cars
+    :type cars: int
+    :param checks: Number of checks
+    :type checks: int
+    :param generator: Random numbers generator
+    :type generator: random.Random
+    :return: Setup time in seconds, mean time of the check in microseconds, number of conflicts
+    :rtype: tuple
+    """
+    app.config['RENTAL_OVERLAP_BACKEND'] = backend
+    app.extensions.pop('rental_index', None)
+    span = int((RENTALS_PER_CAR * 36) * 3600)
+    requests = [(generator.randrange(1, cars + 1), START + timedelta(seconds=generator.randrange(span) // 60 * 60))
+                for _ in range(checks)]
+    started = time.perf_counter()
+    for car_id in range(1, cars + 1):
+        find_conflict(car_id, START - timedelta(days=2), START - timedelta(days=1))
+    setup = time.perf_counter() - started
+
+    conflicts = 0
+    started = time.perf_counter()
+    for car_id, from_date in requests:
+        if find_conflict(car_id, from_date, from_date + timedelta(hours=3)) is not None:
+            conflicts += 1
+    elapsed = time.perf_counter() - started
+    return setup, elapsed / checks * 1e6, conflicts
+
+
+def run_reservations(app, backend, threads, bookings):
+    """Measure parallel reservations of the backend.
+
+    :param app: Application with empty database
+    :type app: flask.Flask
+    :param backend: Name of the backend
+    :type backend: str
+    :param threads: Number of threads
+    :type threads: int
+    :param bookings: Number of reservations of each thread
+    :type bookings: int
+    :return: Reservations per second and number of saved rentals
+    :rtype: tuple
+    """
+    app.config['RENTAL_OVERLAP_BACKEND'] = backend
+    app.extensions.pop('rental_index', None)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        Role.insert_roles()
+        db.session.add(User(name='name', surname='surname', telephone=12345, password='password',
+                            email='benchmark@test.com'))
+        cars = [Car(name=f"Car {number}", price=100, year=2000, model="model", image="no_img.jpg")
+                for number in range(3)]
+        db.session.add_all(cars)
+        db.session.commit()
+        car_ids = [car.id for car in cars]
+        db.session.remove()
+    saved = []
+
+    def book(seed):
+        generator = random.Random(seed)
+        with app.app_context():
+            for _ in range(bookings):
+                from_date = START + timedelta(hours=generator.randrange(200), minutes=seed)
+                rental = Rental(cars_id=generator.choice(car_ids), users_id=1, from_date=from_date,
+                                to_date=from_date + timedelta(hours=2), available_from=from_date + timedelta(hours=3))
+                if reserve_rentals([rental]) is None:
+                    saved.append(seed)
+            db.session.remove()
+
+    workers = [threading.Thread(target=book, args=(seed,)) for seed in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    return threads * bookings / elapsed, len(saved)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000],
+                        help='numbers of rentals')
+    parser.add_argument('--checks', type=int, default=1000, help='number of overlap checks')
+    parser.add_argument('--backends', nargs='+', default=['sql', 'index'], choices=sorted(OVERLAP_BACKENDS),
+                        help='backends to compare')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--threads', type=int, default=8, help='number of threads making reservations')
+    parser.add_argument('--bookings', type=int, default=250, help='number of reservations of each thread')
+    args = parser.parse_args()
+
+    print(f"{'rentals':>10} {'backend':>8} {'setup [s]':>10} {'check [us]':>11} {'conflicts':>10}")
+    for size in args.sizes:
+        db_dir = tempfile.mkdtemp()
+        app = create_app('testing')
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(db_dir, 'benchmark.sqlite')
+        try:
+            with app.app_context():
+                db.create_all()
+                cars = fill_database(size, 'slots' in args.backends, random.Random(args.seed))
+                for backend in args.backends:
+                    setup, check, conflicts = run_checks(app, backend, cars, args.checks, random.Random(args.seed))
+                    print(f"{size:>10} {backend:>8} {setup:>10.3f} {check:>11.1f} {conflicts:>10}")
+                db.session.remove()
+        finally:
+            shutil.rmtree(db_dir)
+
+    print(f"\n{'backend':>8} {'reservations/s':>15} {'saved':>6}")
+    for backend in args.backends:
+        db_dir = tempfile.mkdtemp()
+        app = create_app('testing')
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(db_dir, 'benchmark.sqlite')
+        try:
+            throughput, saved = run_reservations(app, backend, args.threads, args.bookings)
+            print(f"{backend:>8} {throughput:>15.1f} {saved:>6}")
+        finally:
+            shutil.rmtree(db_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Micro-benchmark of the comments tree of news posts.
+
+Usage (from the project directory)::
+
+    python -m benchmarks.comments_tree
+    python -m benchmarks.comments_tree --comments 10000 --repeat 5
+
+A post with the given number of comments is serialized with ``NewsPost.to_json`` for several shapes of threads.
+``rescan`` is the previous algorithm (every level of the tree scans all comments of the post), measured on
+the same rows for comparison; it is skipped for threads deeper than the recursion limit.
+"""
+import argparse
+import random
+import sys
+import time
+from datetime import datetime
+from flask import url_for
+from app import create_app, db
+from app.models import Comment, NewsPost, Role, User, get_comments_tree
+
+
+def rescan_tree(parent_comment, comments, parents):
+    """Build the tree like the previous implementation, for comparison.
+
+    :param parent_comment: Id of the parent comment
+    :type parent_comment: int
+    :param comments: Pairs (id, parent_comment)
+    :type comments: list
+    :param parents: Ids of comments with children
+    :type parents: set
+    :return: Comments with child comments
+    :rtype: list
+    """
+    tree = []
+    for comment_id, parent in comments:
+        if parent == parent_comment:
+            comment_url = url_for('api.show_comment', comment_id=comment_id)
+            if comment_id in parents:
+                comment_url = {comment_url: rescan_tree(comment_id, comments, parents)}
+            tree.append(comment_url)
+    return tree
+
+
+def thread_shapes(number, generator):
+    """Return parents of comments for shapes of threads.
+
+    :param number: Number of comments
+    :type number: int
+    :param generator: Random numbers generator
+    :type generator: random.Random
+    :return: Name of the shape and parent of each comment (comment ids start from 1)
+    :rtype: list
+    """
+    return [('flat', [0] * number),
+            ('random', [generator.randrange(comment_id) for comment_id in range(1, number + 1)]),
+            ('deep', list(range(number)))]
+
+
+def measure(function, repeat):
+    """Return the best time of the function in milliseconds.
+
+    :param function: Measured function
+    :type function: function
+    :param repeat: Number of runs
+    :type repeat: int
+    :return: Time in milliseconds
+    :rtype: float
+    """
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--comments', type=int, default=10000, help='number of comments of the post')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    app = create_app('testing')
+    with app.app_context(), app.test_request_context():
+        db.create_all()
+        Role.insert_roles()
+        db.session.add(User(name='name', surname='surname', telephone=12345, password='password',
+                            email='benchmark@test.com'))
+        db.session.commit()
+        print(f"{'shape':>8} {'comments':>9} {'to_json [ms]':>13} {'tree [ms]':>10} {'rescan [ms]':>12}")
+        for shape, parents in thread_shapes(args.comments, random.Random(args.seed)):
+            post = NewsPost(author_id=1, title=shape, date='2030-01-01', body='body', img_url='no_img.jpg')
+            db.session.add(post)
+            db.session.commit()
+            first_id = (db.session.query(db.func.max(Comment.id)).scalar() or 0) + 1
+            db.session.execute(Comment.__table__.insert(), [
+                {'post_id': post.id, 'author_id': 1, 'text': 'text', 'date': datetime(2030, 1, 1),
+                 'parent_comment': parent + first_id - 1 if parent else 0} for parent in parents])
+            db.session.commit()
+            rows = db.session.query(Comment.id, Comment.parent_comment).filter_by(post_id=post.id).order_by(
+                Comment.id).all()
+
+            to_json = measure(post.to_json, args.repeat)
+            tree = measure(lambda: get_comments_tree(rows), args.repeat)
+            if shape == 'deep' and args.comments >= sys.getrecursionlimit():
+                rescan = 'skipped'
+            else:
+                with_children = {parent for _, parent in rows}
+                rescan = f"{measure(lambda: rescan_tree(0, rows, with_children), args.repeat):.1f}"
+            print(f"{shape:>8} {args.comments:>9} {to_json:>13.1f} {tree:>10.1f} {rescan:>12}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""Benchmark of logins through the API with hashing of passwords in the request thread and in the pool.
+
+Usage (from the project directory)::
+
+    python -m benchmarks.login_throughput
+    python -m benchmarks.login_throughput --clients 16 --logins 400 --workers 1 2 4
+
+Clients log in concurrently while one more client requests a cheap route (a post). ``inline`` hashes in
+the request thread like the previous implementation, other rows use the pool with the given number of workers.
+The last row renews tokens with refresh tokens instead of logging in.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+from app import create_app, db
+from app.models import NewsPost, Role, User
+from app.passwords import PasswordHasher
+
+
+class InlineHasher(PasswordHasher):
+    """Hasher computing hashes in the calling thread, for comparison."""
+
+    def _run(self, function, *args):
+        return function(*args)
+
+
+def run_clients(app, clients, requests, make_request):
+    """Send requests from concurrent clients, request the post in the meantime.
+
+    :param app: Flask application
+    :type app: flask.Flask
+    :param clients: Number of concurrent clients
+    :type clients: int
+    :param requests: Number of requests of each client
+    :type requests: int
+    :param make_request: Function sending one request, takes the client and the number of the request
+    :type make_request: function
+    :return: Requests per second and latencies of the post in milliseconds
+    :rtype: tuple
+    """
+    latencies = []
+    done = threading.Event()
+
+    def send(number):
+        client = app.test_client()
+        for request_number in range(requests):
+            response = make_request(client, number * requests + request_number)
+            assert response.status_code == 200, response.get_json()
+
+    def read_post():
+        client = app.test_client()
+        while not done.is_set():
+            started = time.perf_counter()
+            client.get('/api/v1/posts/1/')
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    threads = [threading.Thread(target=send, args=(number,)) for number in range(clients)]
+    reader = threading.Thread(target=read_post)
+    started = time.perf_counter()
+    reader.start()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    done.set()
+    reader.join()
+    return clients * requests / elapsed, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--clients', type=int, default=8, help='number of concurrent clients')
+    parser.add_argument('--logins', type=int, default=200, help='number of logins of all clients')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--method', default='pbkdf2:sha256:150000', help='method of hashing')
+    args = parser.parse_args()
+    requests = max(args.logins // args.clients, 1)
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_app('testing')
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(directory, 'benchmark.sqlite')
+        app.config['PASSWORD_HASH_METHOD'] = args.method
+        with app.app_context():
+            db.create_all()
+            Role.insert_roles()
+            db.session.add_all([User(name='name', surname='surname', telephone=12345, password='password',
+                                     email=f'benchmark{number}@test.com') for number in range(args.users)])
+            db.session.add(NewsPost(author_id=1, title='title', date='2030-01-01', body='body',
+                                    img_url='no_img.jpg'))
+            db.session.commit()
+
+        def login(client, number):
+            return client.post('/api/v1/auth/login/', json={'email': f'benchmark{number % args.users}@test.com',
+                                                            'password': 'password'})
+
+        print(f"{'mode':>10} {'requests/s':>11} {'post p50 [ms]':>14} {'post p95 [ms]':>14}")
+        config = app.config
+        modes = [('inline', InlineHasher(args.method, config['PASSWORD_SALT_LENGTH'], 1, 0, None))]
+        modes += [(f'pool {workers}', PasswordHasher(args.method, config['PASSWORD_SALT_LENGTH'], workers,
+                                                      config['PASSWORD_HASH_QUEUE'], config['PASSWORD_HASH_TIMEOUT']))
+                  for workers in args.workers]
+        for mode, hasher in modes:
+            app.extensions['password_hasher'] = hasher
+            throughput, latencies = run_clients(app, args.clients, requests, login)
+            hasher.shutdown()
+            print(f"{mode:>10} {throughput:>11.1f} {statistics.median(latencies):>14.1f} "
+                  f"{statistics.quantiles(latencies, n=20)[-1]:>14.1f}")
+        app.extensions.pop('password_hasher')
+
+        refresh_tokens = [login(app.test_client(), number).get_json()['refresh_token']
+                          for number in range(args.clients)]
+
+        def refresh(client, number):
+            response = client.post('/api/v1/auth/refresh/',
+                                   json={'refresh_token': refresh_tokens[number // requests]})
+            refresh_tokens[number // requests] = response.get_json().get('refresh_token')
+            return response
+
+        throughput, latencies = run_clients(app, args.clients, requests, refresh)
+        print(f"{'refresh':>10} {throughput:>11.1f} {statistics.median(latencies):>14.1f} "
+              f"{statistics.quantiles(latencies, n=20)[-1]:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -28,5 +28,12 @@ def test():
     tests = unittest.TestLoader().discover('tests')
     unittest.TextTestRunner(verbosity=2).run(tests)
 
+
+@app.cli.command()
+def rebuild_slots():
+    """Fill the slot table of the slot booking backend from rentals."""
+    from app.booking.slots import rebuild_slots as rebuild
+    print(f'Slots of {rebuild()} rentals rebuilt.')
+
 # if __name__ == '__main__':
 #     app.run()
@@ -21,6 +21,29 @@ class Config:
     CAR_ADMIN = os.environ.get('CAR_ADMIN') or 'mail@mail.com'
     POSTS_PER_PAGE = 10
     JWT_EXPIRED_MINUTES = 10
+    REFRESH_TOKEN_EXPIRED_DAYS = 30
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'pbkdf2:sha256:150000'
+    PASSWORD_SALT_LENGTH = 16
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS') or os.cpu_count() or 1)
+    PASSWORD_HASH_QUEUE = 32
+    PASSWORD_HASH_TIMEOUT = 10
+    EMAIL_CHECK_DELIVERABILITY = True
+    EMAIL_DELIVERABILITY_TTL = 3600
+    EMAIL_DNS_TIMEOUT = 5
+    RENTAL_OVERLAP_BACKEND = os.environ.get('RENTAL_OVERLAP_BACKEND') or 'sql'
+    RENTALS_BATCH_MAX_SIZE = 500
+    RENTAL_SLOT_MINUTES = 15
+    RENTAL_LOCK_RETRIES = 5
+    RENTAL_LOCK_BACKOFF = 0.01
+    ANALYTICS_MAX_BUCKETS = 10000
+    RENTAL_CALENDAR_DAYS = 90
+    RENTAL_CALENDAR_SLOT_MINUTES = 15
+    RENTAL_CALENDAR_PREFILTER = False
+    RENTAL_CALENDAR_TTL = 5
+    COMMENTS_TREE_MAX_DEPTH = None
+    COMMENTS_TREE_MAX_CHILDREN = None
+    API_YIELD_PER = 1000
+    API_MAX_PER_PAGE = 500
 
     @staticmethod
     def init_app(app):
@@ -43,6 +66,8 @@ class TestingConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL') or 'sqlite://'
     WTF_CSRF_ENABLED = False
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+    EMAIL_CHECK_DELIVERABILITY = False
 
 
 class ProductionConfig(Config):
@@ -0,0 +1,118 @@
+"""This module stores tests for API - analytics module."""
+import random
+import unittest
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from app import create_app, db
+from app.api.analytics import occupied_minutes
+from app.models import Role, Car, Rental, User
+from tests.api_functions import token, create_user, create_admin, check_permissions
+
+START = datetime(2030, 1, 1, 0, 0)
+
+
+class AnalyticsTestCase(unittest.TestCase):
+    """Test analytics module."""
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client()
+        self.user = create_user()
+        self.token = token(self.client, self.user)
+        self.user_admin = create_admin()
+        self.token_admin = token(self.client, self.user_admin)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get_api_headers(self, admin=True):
+        """Method that returns response headers.
+
+        :param admin: Token of admin or user
+        :type admin: bool
+        :return: Headers
+        :rtype: dict
+        """
+        return {
+            'Authorization': f'Bearer {self.token_admin if admin else self.token}',
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'
+        }
+
+    def test_occupied_minutes(self):
+        """Check rented minutes against the loop over minutes."""
+        generator = random.Random(1)
+        starts = [generator.randrange(1000) for _ in range(50)]
+        ends = [min(start + generator.randrange(300), 1000) for start in starts]
+        cars = [generator.randrange(4) for _ in range(50)]
+        edges = list(range(0, 1000, 60)) + [1000]
+        expected = [[0] * (len(edges) - 1) for _ in range(4)]
+        for car, start, end in zip(cars, starts, ends):
+            for minute in range(start, end):
+                expected[car][bisect_right(edges, minute) - 1] += 1
+        self.assertEqual(occupied_minutes(cars, starts, ends, edges, 4), expected)
+
+    def test_get_utilization(self):
+        """Test api for get_utilization."""
+        cars = [Car(name=f"Car {number}", price=100, year=2000, model="model", image="no_img.jpg")
+                for number in range(2)]
+        db.session.add_all(cars)
+        db.session.commit()
+        user_id = User.query.filter_by(email=self.user['email']).first().id
+        # 6 hours on the first day, 12 hours on the second day (rental starts before the period)
+        rentals = [(START + timedelta(hours=6), START + timedelta(hours=12)),
+                   (START + timedelta(days=1, hours=12), START + timedelta(days=3)),
+                   (START - timedelta(days=1), START + timedelta(hours=1))]
+        for number, (from_date, to_date) in enumerate(rentals):
+            db.session.add(Rental(cars_id=cars[number // 2].id, users_id=user_id, from_date=from_date,
+                                  to_date=to_date, available_from=to_date + timedelta(hours=1)))
+        db.session.commit()
+
+        response = self.client.get('/api/v1/analytics/utilization/?from=203001010000&to=203001030000',
+                                   headers=self.get_api_headers())
+        response_data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response_data['success'])
+        self.assertEqual(response_data['buckets'], [203001010000, 203001020000])
+        self.assertEqual(response_data['number_of_records'], 2)
+        first, second = response_data['data']
+        self.assertEqual(first['car_id'], cars[0].id)
+        self.assertEqual(first['car_url'], f'/api/v1/cars/{cars[0].id}/')
+        self.assertEqual(first['utilization'], [25.0, 50.0])
+        self.assertEqual(first['rental_hours'], [6.0, 12.0])
+        self.assertEqual(first['total_utilization'], 37.5)
+        self.assertEqual(first['total_rental_hours'], 18.0)
+        self.assertEqual(second['rental_hours'], [1.0, 0.0])
+
+        # Hours, the last bucket is shorter
+        response = self.client.get('/api/v1/analytics/utilization/?from=203001010530&to=203001010800'
+                                   '&granularity=hour', headers=self.get_api_headers())
+        response_data = response.get_json()
+        self.assertEqual(response_data['buckets'], [203001010530, 203001010630, 203001010730])
+        self.assertEqual(response_data['data'][0]['utilization'], [50.0, 100.0, 100.0])
+        self.assertEqual(response_data['data'][0]['rental_hours'], [0.5, 1.0, 0.5])
+
+    def test_get_utilization_invalid_request(self):
+        """Test api for get_utilization, invalid requests."""
+        urls = [('/api/v1/analytics/utilization/?to=203001030000', 'from'),
+                ('/api/v1/analytics/utilization/?from=20300101&to=203001030000', 'from'),
+                ('/api/v1/analytics/utilization/?from=203001030000&to=203001010000', None),
+                ('/api/v1/analytics/utilization/?from=203001010000&to=203001030000&granularity=week', None),
+                ('/api/v1/analytics/utilization/?from=203001010000&to=206001010000&granularity=hour', None)]
+        for url, key in urls:
+            response = self.client.get(url, headers=self.get_api_headers())
+            response_data = response.get_json()
+            self.assertEqual(response.status_code, 400)
+            self.assertFalse(response_data['success'])
+            if key is not None:
+                self.assertEqual(response_data['error_value_key'], key)
+
+        response = self.client.get('/api/v1/analytics/utilization/?from=203001010000&to=203001030000',
+                                   headers=self.get_api_headers(admin=False))
+        check_permissions(response, self.assertEqual, self.assertFalse)
@@ -1,7 +1,9 @@
 """This module stores tests for API - authentication module."""
 import unittest
+from datetime import datetime, timedelta
+from unittest import mock
 from app import create_app, db
-from app.models import Role, User
+from app.models import Role, User, RefreshToken
 from tests.api_functions import token, create_user, create_admin, create_moderator, check_content_type, \
     check_missing_token, check_missing_token_value, check_missing_token_wrong_value, check_permissions
 
@@ -376,6 +378,78 @@ class AuthenticationTestCase(unittest.TestCase):
                 self.assertEqual(response_data['error'], 'unauthorized')
                 self.assertEqual(response_data['message'], 'Invalid credentials')
 
+    def test_refresh(self):
+        """Test api for refresh of the token, refresh tokens are rotated and stored hashed."""
+        api_headers = self.get_api_headers()
+        del api_headers['Authorization']
+        response = self.client.post('/api/v1/auth/login/', json={'password': 'password', 'email': 'test@test.com'},
+                                    headers=api_headers)
+        refresh_token = response.get_json()['refresh_token']
+        self.assertTrue(refresh_token)
+        self.assertIsNone(RefreshToken.query.filter_by(token_hash=refresh_token).first())
+        self.assertIsNotNone(RefreshToken.query.filter_by(token_hash=RefreshToken.hash_token(refresh_token)).first())
+
+        # The password isn't verified
+        with mock.patch('app.passwords.check_password_hash') as check_password:
+            response = self.client.post('/api/v1/auth/refresh/', json={'refresh_token': refresh_token},
+                                        headers=api_headers)
+        check_password.assert_not_called()
+        response_data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response_data['success'])
+        new_refresh_token = response_data['refresh_token']
+        self.assertNotEqual(new_refresh_token, refresh_token)
+        api_headers['Authorization'] = f'Bearer {response_data["token"]}'
+        response = self.client.get('/api/v1/auth/about_me/', headers=api_headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['data']['email'], 'test@test.com')
+        del api_headers['Authorization']
+
+        # The used token is rejected and revokes all tokens of the user
+        response = self.client.post('/api/v1/auth/refresh/', json={'refresh_token': refresh_token},
+                                    headers=api_headers)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.get_json()['message'], 'Invalid refresh token. Login to get new one')
+        response = self.client.post('/api/v1/auth/refresh/', json={'refresh_token': new_refresh_token},
+                                    headers=api_headers)
+        self.assertEqual(response.status_code, 401)
+
+        # Expired tokens
+        response = self.client.post('/api/v1/auth/login/', json={'password': 'password', 'email': 'test@test.com'},
+                                    headers=api_headers)
+        refresh_token = response.get_json()['refresh_token']
+        user_id = User.query.filter_by(email='test@test.com').first().id
+        RefreshToken.query.filter_by(user_id=user_id).update({'expires': datetime.utcnow() - timedelta(minutes=1)})
+        db.session.commit()
+        response = self.client.post('/api/v1/auth/refresh/', json={'refresh_token': refresh_token},
+                                    headers=api_headers)
+        self.assertEqual(response.status_code, 401)
+        self.client.post('/api/v1/auth/login/', json={'password': 'password', 'email': 'test@test.com'},
+                         headers=api_headers)
+        self.assertEqual(RefreshToken.query.filter_by(user_id=user_id).count(), 1)
+
+        for data, message in (({}, 'No refresh_token'), ([], 'No refresh_token'), ('token', 'No refresh_token'),
+                              ({'refresh_token': 'wrong'}, None),
+                              ({'refresh_token': None}, 'Wrong refresh_token, it must be a string'),
+                              ({'refresh_token': ['token']}, 'Wrong refresh_token, it must be a string')):
+            response = self.client.post('/api/v1/auth/refresh/', json=data, headers=api_headers)
+            if message:
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.get_json()['message'], message)
+            else:
+                self.assertEqual(response.status_code, 401)
+
+    def test_refresh_revoked_after_password_change(self):
+        """Test that the change of the password revokes refresh tokens."""
+        api_headers = self.get_api_headers()
+        response = self.client.post('/api/v1/auth/login/', json={'password': 'password', 'email': 'test@test.com'})
+        refresh_token = response.get_json()['refresh_token']
+        response = self.client.patch('/api/v1/auth/user/', json={'password': 'password', 'new_password': 'password2'},
+                                     headers=api_headers)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post('/api/v1/auth/refresh/', json={'refresh_token': refresh_token})
+        self.assertEqual(response.status_code, 401)
+
     # Testing methods connected with current user
     def test_get_current_user(self):
         """Test api for current user."""
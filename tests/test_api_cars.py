@@ -1,7 +1,9 @@
 """This module stores tests for API - cars module."""
+import base64
 import unittest
 import math
-from datetime import datetime
+from datetime import datetime, timedelta
+from sqlalchemy import event
 from app import create_app, db
 from app.models import Role, Car, Rental
 from tests.api_functions import token, create_user, create_admin, create_moderator, check_missing_token_value, \
@@ -312,6 +314,271 @@ class CarsTestCase(unittest.TestCase):
         self.assertEqual(response.headers['Content-Type'], 'application/json')
         self.assertDictEqual(expected_result, response_data)
 
+    # Test get_available_cars
+    def test_get_available_cars(self):
+        """Test api for get_available_cars with filtering and pagination."""
+        # Headers
+        api_headers = self.get_api_headers()
+        del api_headers["Authorization"]
+        # Add cars to db
+        make_cars()
+        from_date = datetime(2030, 5, 27, 10, 0)
+        rental = Rental(cars_id=1, users_id=1, from_date=from_date, to_date=from_date + timedelta(hours=2),
+                        available_from=from_date + timedelta(hours=3))
+        db.session.add(rental)
+        db.session.commit()
+        cars = [{key: value for key, value in change_dict_to_json(car).items() if key not in ('rentals_url',
+                                                                                           'rentals_number')}
+                for car in cars_data]
+        for car in cars:
+            car['car_url'] = f"/api/v1/cars/{car['id']}/"
+
+        # Car 1 is rented, the break after rental is included
+        for window in [('203005270900', '203005271100'), ('203005271230', '203005271300'),
+                       ('203005270800', '203005270900')]:
+            response = self.client.get(f'/api/v1/cars/available/?from={window[0]}&to={window[1]}',
+                                       headers=api_headers)
+            response_data = response.get_json()
+            self.assertEqual(response.status_code, 200)
+            self.assertDictEqual({'success': True, 'number_of_records': 1, 'data': [cars[1]]}, response_data)
+
+        # Both cars are free
+        response = self.client.get('/api/v1/cars/available/?from=203005271400&to=203005271500&sort=-id',
+                                   headers=api_headers)
+        response_data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertDictEqual({'success': True, 'number_of_records': 2, 'data': cars[::-1]}, response_data)
+
+        # Filtering, params and pagination
+        response = self.client.get('/api/v1/cars/available/?from=203005271400&to=203005271500&price[gte]=200'
+                                   '&params=image,model&page=1&per_page=1', headers=api_headers)
+        response_data = response.get_json()
+        expected_result = {'success': True,
+                           'number_of_records': 1,
+                           'data': [remove_params_from_dict(cars[0], ["image", "model"])],
+                           'pagination': {
+                               'current_page_url': '/api/v1/cars/available/?page=1&from=203005271400&to=203005271500'
+                                                   '&price%5Bgte%5D=200&params=image%2Cmodel&per_page=1',
+                               'number_of_all_pages': 1,
+                               'number_of_all_records': 1}
+                           }
+        self.assertEqual(response.status_code, 200)
+        self.assertDictEqual(expected_result, response_data)
+
+    def test_get_available_cars_invalid_data(self):
+        """Test api for get_available_cars, invalid dates."""
+        invalid_data = [('', '203005271500', 'from'), ('203005271400', None, 'to'),
+                        ('2030052714', '203005271500', 'from'), ('203005271400', '203013271500', 'to')]
+        for from_date, to_date, key in invalid_data:
+            url = f'/api/v1/cars/available/?from={from_date}'
+            if to_date is not None:
+                url = "".join((url, f'&to={to_date}'))
+            response = self.client.get(url)
+            response_data = response.get_json()
+            self.assertEqual(response.status_code, 400)
+            self.assertFalse(response_data['success'])
+            self.assertEqual(response_data['error_value_key'], key)
+            self.assertEqual(response_data['error']['message'], 'Wrong value, acceptable format: YmdHM.')
+
+        response = self.client.get('/api/v1/cars/available/?from=203005271400&to=203005271400')
+        response_data = response.get_json()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response_data['message'], "Wrong dates, 'to' must be later than 'from'")
+
+    def test_get_all_cars_rentals(self):
+        """Test api for get_all_cars, rentals of all cars are loaded with one query."""
+        make_cars()
+        from_date = datetime(2030, 5, 27, 10, 0)
+        for car in Car.query.all():
+            for days in (3, 1, 2):
+                db.session.add(Rental(cars_id=car.id, users_id=1 + days % 2, from_date=from_date + timedelta(days=days),
+                                      to_date=from_date + timedelta(days=days, hours=2),
+                                      available_from=from_date + timedelta(days=days, hours=3)))
+        db.session.commit()
+        expected_cars = [change_dict_to_json({key: value for key, value in item.items()}) for item in cars_data]
+        statements = []
+
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+        try:
+            response = self.client.get('/api/v1/cars/', headers={'Accept': 'application/json'})
+            # Streamed records are read from the database while the response is written
+            response_data = response.get_json()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_statement)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response_data['data'], expected_cars)
+        self.assertEqual(response_data['data'][0]['rentals_number'], 3)
+        # Cars and rentals
+        self.assertEqual(len(statements), 2)
+
+    def test_get_all_cars_fields(self):
+        """Test api for get_all_cars, rentals are queried only for requested fields."""
+        make_cars()
+        from_date = datetime(2030, 5, 27, 10, 0)
+        db.session.add(Rental(cars_id=1, users_id=1, from_date=from_date, to_date=from_date + timedelta(hours=2),
+                              available_from=from_date + timedelta(hours=3)))
+        db.session.commit()
+        statements = []
+
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+        try:
+            for url, expected_keys, rentals_statements in [
+                    ('/api/v1/cars/?fields=id,name,price', {'id', 'name', 'price'}, 0),
+                    ('/api/v1/cars/?params=rentals_url,rentals_number', {'id', 'name', 'price', 'year', 'model',
+                                                                         'image'}, 0),
+                    ('/api/v1/cars/?fields=id,rentals_number', {'id', 'rentals_number'}, 1),
+                    ('/api/v1/cars/?fields=id,rentals_url,rentals_number&params=rentals_url',
+                     {'id', 'rentals_number'}, 1)]:
+                statements.clear()
+                response = self.client.get(url, headers={'Accept': 'application/json'})
+                response_data = response.get_json()
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response_data['data']), len(cars_data))
+                self.assertTrue(all(set(car) == expected_keys for car in response_data['data']))
+                queries_of_rentals = [statement for statement in statements if 'FROM rentals' in statement]
+                self.assertEqual(len(queries_of_rentals), rentals_statements)
+                if 'rentals_number' in expected_keys:
+                    self.assertIn('GROUP BY', queries_of_rentals[0])
+                    self.assertEqual([car['rentals_number'] for car in response_data['data']], [1, 0])
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_statement)
+
+        response = self.client.get('/api/v1/cars/1/?fields=id,price', headers={'Accept': 'application/json'})
+        self.assertEqual(response.get_json()['data'], {'id': 1, 'price': float(cars_data[0]['price'])})
+        response = self.client.get('/api/v1/cars/?fields=id,owner', headers={'Accept': 'application/json'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['error_value_key'], 'fields')
+
+    def test_get_all_cars_rentals_number(self):
+        """Test api for get_all_cars, filtering and sorting by number of rentals with pagination."""
+        make_cars()
+        from_date = datetime(2030, 5, 27, 10, 0)
+        cars = Car.query.order_by(Car.id).all()
+        # Car with index i has i rentals
+        for number, car in enumerate(cars):
+            for days in range(number):
+                db.session.add(Rental(cars_id=car.id, users_id=1, from_date=from_date + timedelta(days=days),
+                                      to_date=from_date + timedelta(days=days, hours=2),
+                                      available_from=from_date + timedelta(days=days, hours=3)))
+        db.session.commit()
+        with_rentals = [car.id for number, car in enumerate(cars) if number >= 2][::-1]
+
+        response = self.client.get('/api/v1/cars/?rentals_number[gte]=2&sort=-rentals_number&per_page=2&page=1',
+                                   headers={'Accept': 'application/json'})
+        response_data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([car['id'] for car in response_data['data']], with_rentals[:2])
+        self.assertEqual(response_data['pagination']['number_of_all_records'], len(with_rentals))
+        self.assertTrue(all(car['rentals_number'] >= 2 for car in response_data['data']))
+
+        response = self.client.get('/api/v1/cars/?rentals_number=1', headers={'Accept': 'application/json'})
+        self.assertEqual([car['id'] for car in response.get_json()['data']], [cars[1].id])
+
+        response = self.client.get('/api/v1/cars/?rentals_number[lt]=abc', headers={'Accept': 'application/json'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['error_value_key'], 'rentals_number')
+
+        # Cursor pagination sorted by number of rentals
+        url = '/api/v1/cars/?sort=-rentals_number&per_page=2&cursor='
+        ids = []
+        while url:
+            response_data = self.client.get(url, headers={'Accept': 'application/json'}).get_json()
+            ids += [car['id'] for car in response_data['data']]
+            url = response_data['pagination'].get('next_page')
+        self.assertEqual(ids, [car.id for car in cars][::-1])
+
+    # Test get_car_next_slots
+    def test_get_car_next_slots(self):
+        """Test api for get_car_next_slots."""
+        make_cars()
+        from_date = datetime(2030, 5, 27, 10, 0)
+        for hours in (0, 4):
+            rental = Rental(cars_id=1, users_id=1, from_date=from_date + timedelta(hours=hours),
+                            to_date=from_date + timedelta(hours=hours + 2),
+                            available_from=from_date + timedelta(hours=hours + 3))
+            db.session.add(rental)
+        db.session.commit()
+
+        response = self.client.get('/api/v1/cars/1/next-slot/?duration=30&after=203005270700')
+        response_data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertDictEqual({'success': True, 'number_of_records': 2,
+                              'data': [{'from_date': 203005270700, 'latest_to_date': 203005270859},
+                                       {'from_date': 203005271701, 'latest_to_date': None}]}, response_data)
+
+        # The gap between rentals is shorter than the break
+        response = self.client.get('/api/v1/cars/1/next-slot/?duration=30&after=203005271000&number=1')
+        response_data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response_data['data'], [{'from_date': 203005271701, 'latest_to_date': None}])
+
+        # The window can be booked
+        response = self.client.post('/api/v1/rentals/', json={'car_id': 1, 'from_date': 203005271701,
+                                                              'to_date': 203005271731},
+                                    headers=self.get_api_headers())
+        self.assertEqual(response.status_code, 201)
+
+    # Test get_car_calendar
+    def test_get_car_calendar(self):
+        """Test api for get_car_calendar."""
+        make_cars()
+        from_date = datetime.now().replace(hour=10, minute=0, second=0, microsecond=0) + timedelta(days=2)
+        db.session.add(Rental(cars_id=1, users_id=1, from_date=from_date, to_date=from_date + timedelta(hours=2),
+                              available_from=from_date + timedelta(hours=3)))
+        db.session.commit()
+
+        response = self.client.get('/api/v1/cars/1/calendar/', headers={'Accept': 'application/json'})
+        response_data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response_data['success'])
+        calendar = response_data['data']
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.assertEqual(calendar['from_date'], int(today.strftime('%Y%m%d%H%M')))
+        self.assertEqual(calendar['slot_minutes'], 15)
+        self.assertEqual(calendar['number_of_slots'], 90 * 96)
+        self.assertEqual(calendar['occupied'], [
+            {'from_date': int(from_date.strftime('%Y%m%d%H%M')),
+             'to_date': int((from_date + timedelta(hours=3, minutes=15)).strftime('%Y%m%d%H%M'))}])
+        bitmap = base64.b64decode(calendar['bitmap'])
+        first = (2 * 24 + 10) * 4
+        self.assertEqual([number for number in range(len(bitmap) * 8) if bitmap[number // 8] >> number % 8 & 1],
+                         list(range(first, first + 13)))
+
+        # New rental is marked in the loaded calendar
+        self.client.post('/api/v1/rentals/', json={'car_id': 1,
+                                                   'from_date': int((from_date + timedelta(days=1)).strftime(
+                                                       '%Y%m%d%H%M')),
+                                                   'to_date': int((from_date + timedelta(days=1, hours=1)).strftime(
+                                                       '%Y%m%d%H%M'))},
+                         headers=self.get_api_headers())
+        response = self.client.get('/api/v1/cars/1/calendar/', headers={'Accept': 'application/json'})
+        self.assertEqual(len(response.get_json()['data']['occupied']), 2)
+
+        response = self.client.get('/api/v1/cars/10/calendar/', headers={'Accept': 'application/json'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_get_car_next_slots_invalid_data(self):
+        """Test api for get_car_next_slots, invalid data."""
+        make_cars()
+        invalid_data = [('/api/v1/cars/10/next-slot/?duration=30', 404),
+                        ('/api/v1/cars/1/next-slot/', 400),
+                        ('/api/v1/cars/1/next-slot/?duration=0', 400),
+                        ('/api/v1/cars/1/next-slot/?duration=30&number=11', 400),
+                        ('/api/v1/cars/1/next-slot/?duration=30&after=20300527', 400)]
+        api_headers = self.get_api_headers()
+        del api_headers["Authorization"]
+        for url, status_code in invalid_data:
+            response = self.client.get(url, headers=api_headers)
+            response_data = response.get_json()
+            self.assertEqual(response.status_code, status_code)
+            self.assertFalse(response_data['success'])
+
     # Test add_car
     def test_add_car(self):
         """Test api for add_car, correct data."""
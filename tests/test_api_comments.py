@@ -1,7 +1,10 @@
 """This module stores tests for API - comments module."""
 import unittest
-from datetime import datetime
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs, urlsplit
+from sqlalchemy import event
 from app import create_app, db
+from app.api.query_features import compile_filters
 from app.models import Role, Comment, NewsPost
 from tests.api_functions import token, create_user, check_missing_token_value, check_missing_token_wrong_value, \
     check_missing_token, request_with_features, check_content_type
@@ -278,6 +281,161 @@ class CommentsTestCase(unittest.TestCase):
         self.assertEqual(response.headers['Content-Type'], 'application/json')
         self.assertDictEqual(expected_result, response_data)
 
+    def walk_cursor_pages(self, url, key):
+        """Follow next_page urls from the first page of the cursor pagination.
+
+        :param url: Url of the first page
+        :type url: str
+        :param key: Name of the link to follow, next_page or previous_page
+        :type key: str
+        :return: Pages (response data)
+        :rtype: list
+        """
+        pages = []
+        while url:
+            response = self.client.get(url, headers=self.get_api_headers())
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.get_json())
+            url = pages[-1]['pagination'].get(key)
+        return pages
+
+    def test_show_comments_cursor(self):
+        """Test api for show_comments with the keyset (cursor) pagination."""
+        date = datetime(2030, 1, 1)
+        # Dates with duplicates - the primary key decides
+        for number in range(11):
+            db.session.add(Comment(post_id=1, author_id=1, text=f"text {number}", date=date + timedelta(days=number % 4),
+                                   parent_comment=0))
+        db.session.commit()
+        expected = [comment.id for comment in Comment.query.order_by(Comment.date.desc(), Comment.id)]
+
+        statements = []
+
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+        try:
+            pages = self.walk_cursor_pages('/api/v1/comments/?sort=-date&per_page=3&cursor=', 'next_page')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_statement)
+        self.assertEqual([comment['id'] for page in pages for comment in page['data']], expected)
+        self.assertEqual([len(page['data']) for page in pages], [3, 3, 3, 2])
+        self.assertNotIn('previous_page', pages[0]['pagination'])
+        self.assertNotIn('number_of_all_records', pages[0]['pagination'])
+        self.assertFalse(any('count(' in statement.lower() for statement in statements))
+
+        # Back from the last page
+        back = self.walk_cursor_pages(pages[-1]['pagination']['previous_page'], 'previous_page')
+        self.assertEqual([[comment['id'] for comment in page['data']] for page in back],
+                         [[comment['id'] for comment in page['data']] for page in pages[-2::-1]])
+        self.assertIn('next_page', back[-1]['pagination'])
+
+        # Filters and the number of records on demand
+        response = self.client.get('/api/v1/comments/?per_page=2&cursor=&count=true&id[gt]=3',
+                                   headers=self.get_api_headers())
+        pagination = response.get_json()['pagination']
+        self.assertEqual(pagination['number_of_all_records'], 8)
+        self.assertEqual([comment['id'] for comment in response.get_json()['data']], [4, 5])
+        self.assertEqual(parse_qs(urlsplit(pagination['next_page']).query)['id[gt]'], ['3'])
+
+    def test_show_comments_streamed(self):
+        """Test api for show_comments, the list without pages is streamed, per_page is limited."""
+        self.app.config['API_YIELD_PER'] = 3
+        for number in range(7):
+            db.session.add(Comment(post_id=1, author_id=1, text=f"text {number}", date=datetime(2030, 1, 1),
+                                   parent_comment=0))
+        db.session.commit()
+        for url, number_of_records in [('/api/v1/comments/?sort=-id', 7), ('/api/v1/comments/?id[gt]=100', 0)]:
+            response = self.client.get(url, headers=self.get_api_headers())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.headers['Content-Type'], 'application/json')
+            self.assertTrue(response.is_streamed)
+            response_data = response.get_json()
+            self.assertTrue(response_data['success'])
+            self.assertEqual(response_data['number_of_records'], number_of_records)
+            self.assertEqual([comment['id'] for comment in response_data['data']],
+                             list(range(7, 7 - number_of_records, -1)))
+
+        self.app.config['API_MAX_PER_PAGE'] = 2
+        response = self.client.get('/api/v1/comments/?per_page=50', headers=self.get_api_headers())
+        response_data = response.get_json()
+        self.assertEqual(response_data['number_of_records'], 2)
+        self.assertEqual(response_data['pagination']['number_of_all_pages'], 4)
+        response = self.client.get('/api/v1/comments/?per_page=50&cursor=', headers=self.get_api_headers())
+        self.assertEqual(response.get_json()['number_of_records'], 2)
+        # Cursor without per_page uses pages of the default size instead of streaming
+        response = self.client.get('/api/v1/comments/?cursor=', headers=self.get_api_headers())
+        response_data = response.get_json()
+        self.assertEqual(response_data['number_of_records'], 2)
+        self.assertIn('next_page', response_data['pagination'])
+
+    def test_show_comments_query_errors(self):
+        """Test api for show_comments, unknown columns, wrong values of filters and other params."""
+        make_comments()
+        for url, key in [('/api/v1/comments/?colour[like]=red', 'colour[like]'),
+                         ('/api/v1/comments/?to_json[gt]=1', 'to_json[gt]'),
+                         ('/api/v1/comments/?sort=-colour', 'sort'),
+                         ('/api/v1/comments/?date[gt]=2020-01-01', 'date'),
+                         ('/api/v1/comments/?id[lt]=one', 'id')]:
+            response = self.client.get(url, headers=self.get_api_headers())
+            self.assertEqual(response.status_code, 400)
+            self.assertFalse(response.get_json()['success'])
+            self.assertEqual(response.get_json()['error_value_key'], key)
+
+        # Params which are not columns and have no operator are not filters
+        response = self.client.get('/api/v1/comments/?colour=red&_=123&per_page=2', headers=self.get_api_headers())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['number_of_records'], 2)
+
+    def test_show_comments_page_size(self):
+        """Test api for show_comments, wrong page sizes are rejected and per_page is limited."""
+        make_comments()
+        self.app.config['API_MAX_PER_PAGE'] = 1
+        for url, key in [('/api/v1/comments/?per_page=0', 'per_page'),
+                         ('/api/v1/comments/?per_page=-1', 'per_page'),
+                         ('/api/v1/comments/?per_page=abc', 'per_page'),
+                         ('/api/v1/comments/?per_page=3&page=0', 'page'),
+                         ('/api/v1/comments/?page=abc', 'page')]:
+            response = self.client.get(url, headers=self.get_api_headers())
+            self.assertEqual(response.status_code, 400)
+            self.assertFalse(response.get_json()['success'])
+            self.assertEqual(response.get_json()['error_value_key'], key)
+
+        response = self.client.get('/api/v1/comments/?per_page=100', headers=self.get_api_headers())
+        self.assertEqual(response.get_json()['number_of_records'], 1)
+        response = self.client.get('/api/v1/comments/?per_page=100&cursor=', headers=self.get_api_headers())
+        self.assertEqual(response.get_json()['number_of_records'], 1)
+        # Without per_page all records are streamed
+        response = self.client.get('/api/v1/comments/?page=2', headers=self.get_api_headers())
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.get_json()['number_of_records'], Comment.query.count())
+
+    def test_show_comments_filters_cache(self):
+        """Test api for show_comments, the same filters are parsed once."""
+        make_comments()
+        url = '/api/v1/comments/?date[gt]=2020-06-01_00:00:00&post_id=2&params=text'
+        response = self.client.get(url, headers=self.get_api_headers())
+        self.assertEqual([comment['id'] for comment in response.get_json()['data']], [1])
+        hits = compile_filters.cache_info().hits
+        # Order of filters and not filtering params don't change the plan
+        response = self.client.get('/api/v1/comments/?post_id=2&date[gt]=2020-06-01_00:00:00&fields=id',
+                                   headers=self.get_api_headers())
+        self.assertEqual(response.get_json()['data'], [{'id': 1}])
+        self.assertEqual(compile_filters.cache_info().hits, hits + 1)
+
+    def test_show_comments_cursor_invalid_data(self):
+        """Test api for show_comments with wrong cursors."""
+        make_comments()
+        response = self.client.get('/api/v1/comments/?sort=-date&per_page=1&cursor=', headers=self.get_api_headers())
+        next_page = response.get_json()['pagination']['next_page']
+        cursor = parse_qs(urlsplit(next_page).query)['cursor'][0]
+        for url in ['/api/v1/comments/?per_page=1&cursor=abc', '/api/v1/comments/?per_page=1&cursor=e30',
+                    f'/api/v1/comments/?sort=id&per_page=1&cursor={cursor}']:
+            response = self.client.get(url, headers=self.get_api_headers())
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.get_json()['error_value_key'], 'cursor')
+
     # Test add_comment
     def test_add_comment(self):
         """Test api for add_comment."""
@@ -1,7 +1,9 @@
 """This module stores tests for API - news_posts module."""
+import sys
 import unittest
+from datetime import datetime
 from app import create_app, db
-from app.models import Role, NewsPost, Comment
+from app.models import Role, NewsPost, Comment, get_comments_tree
 from tests.api_functions import token, create_user, create_moderator, check_missing_token_value, \
     check_missing_token_wrong_value, check_missing_token, request_with_features, check_content_type, check_permissions
 
@@ -162,6 +164,37 @@ class NewsPostsTestCase(unittest.TestCase):
         self.assertEqual(response.headers['Content-Type'], 'application/json')
         self.assertDictEqual(expected_result, response_data)
 
+    def test_show_post_comments_tree(self):
+        """Test api for show_post, hierarchy of comments."""
+        make_posts(["2020-10-01", "2020-11-01"], [1, 2])
+        # parent_comment of comments 1-6, comment 6 has a parent which doesn't exist
+        parents = [0, 1, 0, 1, 2, 10]
+        for parent_comment in parents:
+            db.session.add(Comment(post_id=1, author_id=1, text="text", date=datetime(2020, 10, 2),
+                                   parent_comment=parent_comment))
+        db.session.add(Comment(post_id=2, author_id=1, text="text", date=datetime(2020, 10, 2), parent_comment=0))
+        db.session.commit()
+
+        response = self.client.get('/api/v1/posts/', headers={'Accept': 'application/json'})
+        response_data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        first, second = response_data['data']
+        self.assertEqual(first['comments_urls'], [
+            {'/api/v1/comments/1/': [{'/api/v1/comments/2/': ['/api/v1/comments/5/']}, '/api/v1/comments/4/']},
+            '/api/v1/comments/3/'])
+        self.assertEqual(first['comments_number'], 6)
+        self.assertEqual(second['comments_urls'], ['/api/v1/comments/7/'])
+
+    def test_comments_tree_deep_thread(self):
+        """Test comments tree deeper than the recursion limit."""
+        depth = sys.getrecursionlimit() + 10
+        with self.app.test_request_context():
+            tree = get_comments_tree([(number + 1, number) for number in range(depth)])
+        for number in range(1, depth):
+            (url, tree), = tree[0].items()
+            self.assertEqual(url, f'/api/v1/comments/{number}/')
+        self.assertEqual(tree, [f'/api/v1/comments/{depth}/'])
+
     # Test show_posts
     def test_show_posts(self):
         """Test api for show_posts."""
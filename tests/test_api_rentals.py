@@ -1,9 +1,10 @@
 """This module stores tests for API - rentals module."""
 import unittest
+import json
 from datetime import datetime, timedelta
 import random
 from app import create_app, db
-from app.models import Role, Rental, Car, User
+from app.models import Role, Rental, RentalSlot, Car, User
 from tests.api_functions import token, create_user, create_admin, create_moderator, check_missing_token_value, \
     check_missing_token_wrong_value, check_missing_token, request_with_features, check_content_type, check_permissions
 
@@ -225,6 +226,7 @@ class RentalsTestCase(unittest.TestCase):
         # Request, no rentals in db
         # Request
         response = self.client.get('/api/v1/rentals/', headers=self.get_api_headers_admin())
+        self.assertTrue(response.is_streamed)
         response_data = response.get_json()
         # Tests
         self.assertEqual(response.status_code, 200)
@@ -246,7 +248,8 @@ class RentalsTestCase(unittest.TestCase):
 
         # Expected results
         expected_result = {'success': True,
-                           'data': rentals
+                           'data': rentals,
+                           'number_of_records': len(rentals)
                            }
         # Tests
         self.assertEqual(response.status_code, 200)
@@ -263,13 +266,66 @@ class RentalsTestCase(unittest.TestCase):
         filtered_rentals = [item for item in rentals if item['id']['user'] < 2]
         filtered_rentals_sorted = sorted(filtered_rentals, key=lambda item: item['from_date'])
         expected_result = {'success': True,
-                           'data': filtered_rentals_sorted
+                           'data': filtered_rentals_sorted,
+                           'number_of_records': len(filtered_rentals_sorted)
                            }
         # Tests
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.headers['Content-Type'], 'application/json')
         self.assertDictEqual(expected_result, response_data)
 
+    def add_many_rentals(self, number):
+        """Add rentals of two cars which don't overlap.
+
+        :param number: Number of rentals
+        :type number: int
+        """
+        start = datetime(2030, 1, 1)
+        db.session.execute(Rental.__table__.insert(), [
+            {'cars_id': 1 + position % 2, 'users_id': 1 + position % 3, 'from_date': start + timedelta(hours=position),
+             'to_date': start + timedelta(hours=position, minutes=10),
+             'available_from': start + timedelta(hours=position, minutes=70)} for position in range(number)])
+        db.session.commit()
+
+    def test_show_rentals_pagination(self):
+        """Test api for show_rentals with pages and cursors."""
+        self.add_many_rentals(25)
+        with self.app.test_request_context():
+            expected = Rental.to_json_list(Rental.query.order_by(Rental.from_date).all())
+        response = self.client.get('/api/v1/rentals/?sort=from_date&per_page=10&page=3',
+                                   headers=self.get_api_headers_admin())
+        response_data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response_data['data'], expected[20:])
+        self.assertEqual(response_data['number_of_records'], 5)
+        self.assertEqual(response_data['pagination']['number_of_all_records'], 25)
+        self.assertIn('previous_page', response_data['pagination'])
+
+        url = '/api/v1/rentals/?sort=from_date&per_page=10&cursor=&fields=id,car_url'
+        data = []
+        while url:
+            response_data = self.client.get(url, headers=self.get_api_headers_admin()).get_json()
+            data += response_data['data']
+            url = response_data['pagination'].get('next_page')
+        self.assertEqual(data, [{'id': rental['id'], 'car_url': rental['car_url']} for rental in expected])
+
+    def test_show_rentals_ndjson(self):
+        """Test api for show_rentals streamed as newline delimited JSON."""
+        self.app.config['API_YIELD_PER'] = 4
+        self.add_many_rentals(10)
+        with self.app.test_request_context():
+            expected = Rental.to_json_list(Rental.query.filter(Rental.users_id == 1).order_by(Rental.from_date).all())
+        response = self.client.get('/api/v1/rentals/?format=ndjson&sort=from_date&users_id=1',
+                                   headers=self.get_api_headers_admin())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertTrue(response.is_streamed)
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line) for line in lines], expected)
+
+        response = self.client.get('/api/v1/rentals/?format=ndjson&users_id=100', headers=self.get_api_headers_admin())
+        self.assertEqual(response.get_data(as_text=True), '')
+
     # Test show_rental
     def test_show_rental(self):
         """Test api for show_rental."""
@@ -401,6 +457,22 @@ class RentalsTestCase(unittest.TestCase):
         self.assertEqual(response.headers['Content-Type'], 'application/json')
         self.assertDictEqual(expected_result, response_data)
 
+    def test_add_rental_slots(self):
+        """Test api for add_rental with the slot backend."""
+        self.app.config['RENTAL_OVERLAP_BACKEND'] = 'slots'
+        rental_data = {"car_id": 1, "from_date": int((datetime.now() + timedelta(days=1)).strftime('%Y%m%d%H%M')),
+                       "to_date": int((datetime.now() + timedelta(days=1, hours=2)).strftime('%Y%m%d%H%M'))}
+        response = self.client.post('/api/v1/rentals/', json=rental_data, headers=self.get_api_headers())
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(RentalSlot.query.filter_by(cars_id=1).count() > 0)
+
+        # Overlapping rental
+        response = self.client.post('/api/v1/rentals/', json=rental_data, headers=self.get_api_headers())
+        response_data = response.get_json()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response_data['error_value_key'], 'dates')
+        self.assertEqual(Rental.query.filter_by(cars_id=1).count(), 1)
+
     def test_add_rental_invalid_data(self):
         """Test api for add_rental, invalid data."""
         # Add rentals to db
@@ -452,6 +524,69 @@ class RentalsTestCase(unittest.TestCase):
                                      f"{(rental.available_from + timedelta(minutes=1)).strftime('%Y-%m-%d %H:%M')}"),
                     self.assertEqual(response_data['error_value_key'], "dates")
 
+    # Test add_rentals_batch
+    def test_add_rentals_batch(self):
+        """Test api for add_rentals_batch."""
+        make_rentals()
+        user_id = User.query.filter_by(email="test@test.com").first().id
+        day = (datetime.now() + timedelta(days=2)).replace(hour=10, minute=0, second=0, microsecond=0)
+
+        def date(hours):
+            return int((day + timedelta(hours=hours)).strftime('%Y%m%d%H%M'))
+
+        batch = [
+            {"car_id": 1, "from_date": date(5), "to_date": date(6)},
+            {"car_id": 1, "from_date": date(0), "to_date": date(2)},
+            # Conflict with the rental above (break after rental)
+            {"car_id": 1, "from_date": date(2.5), "to_date": date(4)},
+            # Conflict with the first rental, starts earlier so the first rental is rejected
+            {"car_id": 1, "from_date": date(4.5), "to_date": date(8)},
+            {"car_id": 10, "from_date": date(0), "to_date": date(2)},
+            {"car_id": 1, "from_date": date(10), "to_date": date(11)}
+        ]
+        response = self.client.post('/api/v1/rentals/batch/', json=batch, headers=self.get_api_headers())
+        response_data = response.get_json()
+        # Tests
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response_data['success'])
+        self.assertEqual(response_data['number_of_records'], 3)
+        self.assertEqual([item['index'] for item in response_data['data']], list(range(len(batch))))
+        self.assertEqual([item['success'] for item in response_data['data']], [False, True, False, True, False, True])
+        self.assertEqual(response_data['data'][1]['data']['user_url'], f'/api/v1/users/{user_id}/')
+        self.assertEqual(response_data['data'][2]['error_value_key'], 'dates')
+        self.assertEqual(response_data['data'][2]['error']['message'],
+                         f"Wrong dates, available before: "
+                         f"{(day + timedelta(minutes=-61)).strftime('%Y-%m-%d %H:%M')},available after:"
+                         f"{(day + timedelta(hours=3, minutes=1)).strftime('%Y-%m-%d %H:%M')}")
+        self.assertEqual(response_data['data'][0]['error_value_key'], 'dates')
+        self.assertEqual(response_data['data'][4]['error_value_key'], 'car_id')
+        self.assertEqual(len(Rental.query.filter(Rental.users_id == user_id, Rental.from_date >= day).all()), 3)
+
+        # Conflicts with db, admin has to choose user
+        batch = [{"car_id": 1, "from_date": date(1), "to_date": date(6), "user_id_rental": user_id},
+                 {"car_id": 1, "from_date": date(20), "to_date": date(21)}]
+        response = self.client.post('/api/v1/rentals/batch/', json=batch, headers=self.get_api_headers_admin())
+        response_data = response.get_json()
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response_data['success'])
+        self.assertEqual(response_data['number_of_records'], 0)
+        self.assertEqual(response_data['data'][0]['error_value_key'], 'dates')
+        self.assertEqual(response_data['data'][1]['error_value_key'], 'user_id_rental')
+
+    def test_add_rentals_batch_invalid_request(self):
+        """Test api for add_rentals_batch, invalid request."""
+        self.app.config['RENTALS_BATCH_MAX_SIZE'] = 2
+        rental = {"car_id": 1, "from_date": int((datetime.now() + timedelta(hours=2)).strftime('%Y%m%d%H%M')),
+                  "to_date": int((datetime.now() + timedelta(hours=3)).strftime('%Y%m%d%H%M'))}
+        for body, message in [({"rentals": [rental]}, "Wrong value, list of rentals required"),
+                              ([], "Wrong value, list of rentals required"),
+                              ([rental] * 3, "Too many rentals, maximum number is 2")]:
+            response = self.client.post('/api/v1/rentals/batch/', json=body, headers=self.get_api_headers())
+            response_data = response.get_json()
+            self.assertEqual(response.status_code, 400)
+            self.assertFalse(response_data['success'])
+            self.assertEqual(response_data['message'], message)
+
     # Test delete_rental
     def test_delete_rental(self):
         """Test api for delete_rental."""
@@ -1,7 +1,11 @@
 """This module stores tests for API - users module."""
 import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+import jwt
+from sqlalchemy import event
 from app import create_app, db
-from app.models import Role, User, NewsPost, Rental, Opinion, Comment
+from app.models import Role, User, NewsPost, Rental, Opinion, Comment, Car
 from tests.api_functions import token, create_user, create_admin, create_moderator, check_missing_token_value, \
     check_permissions, check_missing_token_wrong_value, check_missing_token, request_with_features
 
@@ -270,6 +274,205 @@ class UsersTestCase(unittest.TestCase):
         self.assertEqual(response.headers['Content-Type'], 'application/json')
         self.assertDictEqual(expected_result, response_data)
 
+    def test_get_all_users_related_objects(self):
+        """Test api for get_all_users, urls of related objects are loaded with a constant number of queries."""
+        car = Car(name="Car", price=100, year=2000, model="model", image="no_img.jpg")
+        db.session.add(car)
+        db.session.commit()
+        date = datetime(2030, 1, 1)
+        for user in User.query.all():
+            for number in range(2):
+                post = NewsPost(author_id=user.id, title=f"Title {user.id} {number}", date="2030-01-01", body="body",
+                                img_url="no_img.jpg")
+                db.session.add(post)
+                db.session.commit()
+                db.session.add_all([
+                    Comment(post_id=post.id, author_id=user.id, text="text", date=date),
+                    Opinion(author_id=user.id, text="text", image="no_img.jpg", date=date),
+                    Rental(cars_id=car.id, users_id=user.id, from_date=date + timedelta(days=user.id, hours=number),
+                           to_date=date + timedelta(days=user.id, hours=number),
+                           available_from=date + timedelta(days=user.id, hours=number + 1))])
+                db.session.commit()
+        # Expected results - related objects loaded separately for each user
+        expected_users = []
+        for user in User.query.order_by(User.id):
+            rentals = [f"/api/v1/rentals/car{rental.cars_id}/user{user.id}/from{rental.from_date:%Y%m%d%H%M}/"
+                       for rental in Rental.query.filter_by(users_id=user.id)]
+            expected_users.append({
+                'id': user.id, 'name': user.name, 'surname': user.surname, 'email': user.email,
+                'telephone': user.telephone, 'address': user.address, 'role_id': user.role_id,
+                'post_number': len(user.posts),
+                'posts': [f"/api/v1/posts/{post.id}/" for post in NewsPost.query.filter_by(author_id=user.id)],
+                'rentals_number': len(user.car_rented), 'rentals': rentals,
+                'comments_number': len(user.comments),
+                'comments': [f"/api/v1/comments/{comment.id}/" for comment in
+                             Comment.query.filter_by(author_id=user.id)],
+                'opinions_number': len(user.opinions),
+                'opinions': [f"/api/v1/opinions/{opinion.id}/" for opinion in
+                             Opinion.query.filter_by(author_id=user.id)]})
+        statements = []
+
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+        try:
+            response = self.client.get('/api/v1/users/', headers=self.get_api_headers_admin())
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_statement)
+        response_data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response_data['data'], expected_users)
+        self.assertEqual(response_data['data'][0]['post_number'], 2)
+        # Token check, users and four queries of related objects
+        self.assertLessEqual(len(statements), 8)
+
+    def test_get_all_users_number_filters(self):
+        """Test api for get_all_users, filters and sorting by numbers of related objects run with pagination."""
+        date = datetime(2030, 1, 1)
+        users = User.query.order_by(User.id).all()
+        # User with index i has i opinions
+        for number, user in enumerate(users):
+            db.session.add_all([Opinion(author_id=user.id, text="text", image="no_img.jpg", date=date)
+                                for _ in range(number)])
+        db.session.commit()
+        response = self.client.get('/api/v1/users/?opinions_number[gt]=0&sort=-opinions_number&per_page=1&page=1',
+                                   headers=self.get_api_headers_admin())
+        response_data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([user['id'] for user in response_data['data']], [users[-1].id])
+        self.assertEqual(response_data['data'][0]['opinions_number'], len(users) - 1)
+        self.assertEqual(response_data['pagination']['number_of_all_records'], len(users) - 1)
+
+        response = self.client.get('/api/v1/users/?opinions_number[lte]=1&post_number=0&sort=id',
+                                   headers=self.get_api_headers_admin())
+        self.assertEqual([user['id'] for user in response.get_json()['data']], [user.id for user in users[:2]])
+
+    def test_get_all_users_fields(self):
+        """Test api for get_all_users, related objects are queried only for requested fields."""
+        date = datetime(2030, 1, 1)
+        db.session.add_all([Opinion(author_id=1, text="text", image="no_img.jpg", date=date) for _ in range(2)])
+        db.session.commit()
+        statements = []
+
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+        try:
+            response = self.client.get('/api/v1/users/?fields=id,email,opinions_number&sort=id',
+                                       headers=self.get_api_headers_admin())
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_statement)
+        response_data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response_data['data'][0], {'id': 1, 'email': User.query.get(1).email, 'opinions_number': 2})
+        self.assertTrue(all(set(user) == {'id', 'email', 'opinions_number'} for user in response_data['data']))
+        for table in ('comments', 'rentals', 'news_posts'):
+            self.assertFalse(any(f'FROM {table}' in statement for statement in statements))
+
+    def test_get_all_users_cursor(self):
+        """Test api for get_all_users, cursor pagination sorted by a column with NULL values."""
+        for number in range(5):
+            db.session.add(User(name=f"name {number}", surname="surname", telephone=12345, password="password",
+                                email=f"user{number}@test.com", address=f"address {number % 2}" if number % 3 else None))
+        db.session.commit()
+        # NULL is lower than any value, ties are ordered by id
+        for sorting, order in (('address', User.address.asc().nullsfirst()),
+                               ('-address', User.address.desc().nullslast())):
+            expected = [user.id for user in User.query.order_by(order, User.id)]
+            url = f'/api/v1/users/?sort={sorting}&per_page=2&cursor='
+            ids = []
+            while url:
+                response_data = self.client.get(url, headers=self.get_api_headers_admin()).get_json()
+                ids += [user['id'] for user in response_data['data']]
+                url = response_data['pagination'].get('next_page')
+            self.assertEqual(ids, expected)
+
+    def test_auth_context(self):
+        """Test that the token is decoded and the user with the role is loaded once per request."""
+        statements = []
+
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+        try:
+            with mock.patch('app.api.decorators.jwt.decode', wraps=jwt.decode) as decode:
+                response = self.client.get('/api/v1/users/1/?fields=id,email', headers=self.get_api_headers_admin())
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_statement)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(decode.call_count, 1)
+        # Permissions are read from the token, only the shown user is queried
+        self.assertEqual(len([statement for statement in statements if 'FROM users' in statement]), 1)
+        self.assertFalse(any('FROM roles' in statement for statement in statements))
+
+        # The context isn't shared by requests
+        response = self.client.get('/api/v1/users/', headers=self.get_api_headers())
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get('/api/v1/users/', headers={'Accept': 'application/json'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_token_claims_and_revocation(self):
+        """Test that permissions are signed in the token and tokens are revoked after the change of the role."""
+        claims = jwt.decode(self.token_admin, self.app.config['SECRET_KEY'], algorithms='HS256')
+        self.assertEqual(claims['permissions'], Role.query.filter_by(name='Administrator').first().permissions)
+        # The admin got the role after registration, tokens from before have version 0
+        self.assertEqual(claims['ver'], 1)
+
+        user = User.query.filter_by(email=self.user['email']).first()
+        api_headers = self.get_api_headers()
+        response = self.client.get('/api/v1/auth/about_me/', headers=api_headers)
+        self.assertEqual(response.status_code, 200)
+
+        # Tokens without claims of permissions are checked with the database
+        old_token = jwt.encode({'user_id': user.id, 'exp': datetime.utcnow() + timedelta(minutes=10)},
+                               self.app.config['SECRET_KEY'], algorithm='HS256')
+        response = self.client.get('/api/v1/users/', headers={'Authorization': f'Bearer {old_token}'})
+        self.assertEqual(response.status_code, 403)
+
+        # The same role doesn't revoke tokens
+        response = self.client.put('/api/v1/auth/admin/', headers=self.get_api_headers_admin(),
+                                   json={'user_to_edit_id': user.id, 'role_id': user.role_id})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get('/api/v1/auth/about_me/', headers=api_headers)
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.put('/api/v1/auth/admin/', headers=self.get_api_headers_admin(),
+                                   json={'user_to_edit_id': user.id, 'role_id': 3})
+        self.assertEqual(response.status_code, 200)
+        for revoked_token in (self.token, old_token):
+            response = self.client.get('/api/v1/auth/about_me/', headers={'Authorization': f'Bearer {revoked_token}'})
+            self.assertEqual(response.status_code, 401)
+            self.assertIn('Revoked token', response.get_json()['message'])
+
+        # The new token has permissions of the new role
+        new_token = token(self.client, self.user)
+        self.assertEqual(jwt.decode(new_token, self.app.config['SECRET_KEY'], algorithms='HS256')['ver'], 1)
+        response = self.client.get('/api/v1/users/', headers={'Authorization': f'Bearer {new_token}'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_token_of_deleted_user(self):
+        """Test that tokens are revoked when the user is deleted or the role is changed outside the API."""
+        admin = User.query.filter_by(email=self.user_admin['email']).first()
+        db.session.delete(admin)
+        db.session.commit()
+        response = self.client.get('/api/v1/users/', headers=self.get_api_headers_admin())
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('Revoked token', response.get_json()['message'])
+
+        moderator = User.query.filter_by(email=self.user_moderator['email']).first()
+        api_headers = {'Authorization': f'Bearer {self.token_moderator}'}
+        moderator.role = Role.query.filter_by(name='Administrator').first()
+        db.session.rollback()
+        response = self.client.get('/api/v1/auth/about_me/', headers=api_headers)
+        self.assertEqual(response.status_code, 200)
+        moderator.role = Role.query.filter_by(name='Administrator').first()
+        db.session.commit()
+        response = self.client.get('/api/v1/auth/about_me/', headers=api_headers)
+        self.assertEqual(response.status_code, 401)
+
     # Test permissions
     def test_insufficient_permissions(self):
         """Test permissions."""
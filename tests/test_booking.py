@@ -0,0 +1,428 @@
+"""This module stores tests for booking package."""
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from datetime import datetime, timedelta
+from sqlalchemy import exists
+from sqlalchemy.exc import IntegrityError
+from app import create_app, db
+from app.booking import OVERLAP_BACKENDS, available_dates, find_conflict, get_rental_calendar, get_rental_index, next_free_windows, \
+    reserve_rentals
+from app.booking.calendar import CarCalendar
+from app.booking.index import CarIntervals
+from app.booking import slots
+from app.booking.slots import slot_range, rebuild_slots
+from app.booking.sql import overlap_condition, is_free
+from app.booking.windows import sweep_free_windows
+from app.models import Role, Rental, RentalSlot, Car, User
+
+START = datetime(2030, 1, 1, 10, 0)
+
+
+class CarIntervalsTestCase(unittest.TestCase):
+    """Test sorted intervals of one car."""
+
+    def test_find_conflict(self):
+        """Check overlap of closed intervals."""
+        intervals = CarIntervals([(START + timedelta(hours=10), START + timedelta(hours=12)),
+                                  (START, START + timedelta(hours=2))])
+        self.assertEqual(intervals.starts, [START, START + timedelta(hours=10)])
+        self.assertIsNone(intervals.find_conflict(START + timedelta(hours=3), START + timedelta(hours=9)))
+        self.assertIsNone(intervals.find_conflict(START - timedelta(hours=3), START - timedelta(minutes=1)))
+        self.assertIsNone(intervals.find_conflict(START + timedelta(hours=13), START + timedelta(hours=14)))
+        self.assertEqual(intervals.find_conflict(START + timedelta(hours=2), START + timedelta(hours=3)),
+                         (START, START + timedelta(hours=2)))
+        self.assertEqual(intervals.find_conflict(START + timedelta(hours=3), START + timedelta(hours=10)),
+                         (START + timedelta(hours=10), START + timedelta(hours=12)))
+        # The new interval contains both rentals - the earliest one is returned
+        self.assertEqual(intervals.find_conflict(START - timedelta(hours=1), START + timedelta(hours=20)),
+                         (START, START + timedelta(hours=2)))
+
+    def test_overlapping_intervals(self):
+        """Check intervals which overlap each other (e.g. fake data)."""
+        intervals = CarIntervals([(START, START + timedelta(days=10)),
+                                  (START + timedelta(days=1), START + timedelta(days=2))])
+        self.assertEqual(intervals.find_conflict(START + timedelta(days=5), START + timedelta(days=6)),
+                         (START, START + timedelta(days=10)))
+        self.assertIsNone(intervals.find_conflict(START + timedelta(days=11), START + timedelta(days=12)))
+
+    def test_add_and_remove(self):
+        """Check adding and removing intervals."""
+        intervals = CarIntervals([])
+        self.assertIsNone(intervals.find_conflict(START, START + timedelta(hours=1)))
+        intervals.add(START + timedelta(hours=5), START + timedelta(hours=6))
+        intervals.add(START, START + timedelta(hours=1))
+        self.assertEqual(intervals.reach, [START + timedelta(hours=1), START + timedelta(hours=6)])
+        self.assertEqual(intervals.find_conflict(START + timedelta(minutes=30), START + timedelta(hours=2)),
+                         (START, START + timedelta(hours=1)))
+        intervals.remove(START, START + timedelta(hours=1))
+        self.assertEqual(len(intervals), 1)
+        self.assertIsNone(intervals.find_conflict(START + timedelta(minutes=30), START + timedelta(hours=2)))
+
+
+class FreeWindowsTestCase(unittest.TestCase):
+    """Test the sweep searching free windows."""
+
+    def test_sweep_free_windows(self):
+        """Check windows between rentals including the break."""
+        rental_break = timedelta(hours=1)
+        intervals = [(START + timedelta(hours=2), START + timedelta(hours=4)),
+                     (START + timedelta(hours=3), START + timedelta(hours=5)),
+                     (START + timedelta(hours=8), START + timedelta(hours=9))]
+        windows = sweep_free_windows(intervals, START, timedelta(minutes=30), 5, rental_break)
+        self.assertEqual(windows, [(START, START + timedelta(minutes=59)),
+                                   (START + timedelta(hours=5, minutes=1), START + timedelta(hours=6, minutes=59)),
+                                   (START + timedelta(hours=9, minutes=1), None)])
+        # Too long rental fits only after the last one
+        windows = sweep_free_windows(intervals, START, timedelta(hours=2), 5, rental_break)
+        self.assertEqual(windows, [(START + timedelta(hours=9, minutes=1), None)])
+        # Limit of windows, the beginning inside rental
+        windows = sweep_free_windows(intervals, START + timedelta(hours=3), timedelta(minutes=30), 1, rental_break)
+        self.assertEqual(windows, [(START + timedelta(hours=5, minutes=1), START + timedelta(hours=6, minutes=59))])
+        self.assertEqual(sweep_free_windows([], START, timedelta(hours=2), 1, rental_break), [(START, None)])
+
+
+class CarCalendarTestCase(unittest.TestCase):
+    """Test occupancy bitmap of one car."""
+
+    def test_mark_and_is_free(self):
+        """Check slots touched by rentals."""
+        calendar = CarCalendar(START, timedelta(minutes=15), 96)
+        calendar.mark(START + timedelta(hours=1, minutes=10), START + timedelta(hours=2))
+        self.assertEqual([number for number in range(96) if calendar.is_occupied(number)], [4, 5, 6, 7, 8])
+        self.assertTrue(calendar.is_free(START, START + timedelta(minutes=59)))
+        self.assertFalse(calendar.is_free(START, START + timedelta(hours=1)))
+        self.assertTrue(calendar.is_free(START + timedelta(hours=2, minutes=15), START + timedelta(hours=5)))
+        # Outside the calendar the car may be not free
+        self.assertFalse(calendar.is_free(START - timedelta(hours=1), START))
+        self.assertFalse(calendar.is_free(START + timedelta(hours=20), START + timedelta(hours=24)))
+        # Rental partly before the calendar
+        calendar.mark(START - timedelta(days=1), START + timedelta(minutes=5))
+        self.assertEqual(calendar.periods(), [(START, START + timedelta(minutes=15)),
+                                              (START + timedelta(hours=1), START + timedelta(hours=2, minutes=15))])
+        # Overlapping and adjacent rentals are merged, rentals after the calendar are skipped
+        calendar.mark(START + timedelta(hours=2, minutes=20), START + timedelta(hours=3))
+        calendar.mark(START + timedelta(hours=1, minutes=30), START + timedelta(hours=1, minutes=40))
+        calendar.mark(START + timedelta(days=2), START + timedelta(days=3))
+        self.assertEqual(calendar.periods(), [(START, START + timedelta(minutes=15)),
+                                              (START + timedelta(hours=1), START + timedelta(hours=3, minutes=15))])
+
+
+class OverlapBackendMixin:
+    """Tests shared by backends of overlap checks, ``backend`` is set by test cases."""
+    backend = None
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['RENTAL_OVERLAP_BACKEND'] = self.backend
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        user = User(name='name', surname='surname', telephone=12345, password='password', email='test@test.com')
+        car = Car(name="Car 1", price=123, year=2000, model="model", image="no_img.jpg")
+        db.session.add_all([user, car])
+        db.session.commit()
+        self.user_id = user.id
+        self.car_id = car.id
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_rental(self, from_date, hours=1):
+        """Add rental to db.
+
+        :param from_date: Beginning of the rental
+        :type from_date: datetime
+        :param hours: Length of the rental
+        :type hours: int
+        :return: Rental
+        :rtype: Rental
+        """
+        rental = Rental(cars_id=self.car_id, users_id=self.user_id, from_date=from_date,
+                        to_date=from_date + timedelta(hours=hours),
+                        available_from=from_date + timedelta(hours=hours + 1))
+        db.session.add(rental)
+        db.session.commit()
+        return rental
+
+    def test_lazy_build(self):
+        """Check if index is loaded from db on the first check."""
+        self.add_rental(START)
+        self.assertEqual(find_conflict(self.car_id, START + timedelta(hours=1), START + timedelta(hours=3)),
+                         (START, START + timedelta(hours=2)))
+        self.assertIsNone(find_conflict(self.car_id, START - timedelta(hours=5), START - timedelta(hours=2)))
+
+    def test_update_on_insert_and_delete(self):
+        """Check if index follows committed rentals."""
+        self.assertIsNone(find_conflict(self.car_id, START, START + timedelta(hours=1)))
+        rental = self.add_rental(START)
+        self.assertIsNotNone(find_conflict(self.car_id, START, START + timedelta(hours=1)))
+        db.session.delete(rental)
+        db.session.commit()
+        self.assertIsNone(find_conflict(self.car_id, START, START + timedelta(hours=1)))
+
+    def test_rollback(self):
+        """Check if rolled back rentals are not added to index."""
+        self.assertIsNone(find_conflict(self.car_id, START, START + timedelta(hours=1)))
+        db.session.add(Rental(cars_id=self.car_id, users_id=self.user_id, from_date=START,
+                              to_date=START + timedelta(hours=1), available_from=START + timedelta(hours=2)))
+        db.session.flush()
+        db.session.rollback()
+        self.assertIsNone(find_conflict(self.car_id, START, START + timedelta(hours=1)))
+
+    def test_calendar(self):
+        """Check if the calendar follows committed rentals and prefilters overlap checks."""
+        self.app.config['RENTAL_CALENDAR_PREFILTER'] = True
+        start = datetime.now().replace(second=0, microsecond=0) + timedelta(days=1)
+        self.assertIsNone(find_conflict(self.car_id, start, start + timedelta(hours=1)))
+        rental = self.add_rental(start)
+        (period_from, period_to), = get_rental_calendar().get(self.car_id).periods()
+        self.assertTrue(start - timedelta(minutes=15) < period_from <= start)
+        self.assertTrue(start + timedelta(hours=2) < period_to <= start + timedelta(hours=2, minutes=15))
+        self.assertEqual(find_conflict(self.car_id, start, start + timedelta(hours=1)),
+                         (start, start + timedelta(hours=2)))
+        self.assertIsNone(find_conflict(self.car_id, start + timedelta(hours=4), start + timedelta(hours=5)))
+        db.session.delete(rental)
+        db.session.commit()
+        self.assertEqual(get_rental_calendar().get(self.car_id).periods(), [])
+
+
+class RentalIndexTestCase(OverlapBackendMixin, unittest.TestCase):
+    """Test rental index of application."""
+    backend = 'index'
+
+    def test_invalidate(self):
+        """Check if changes made outside the session are visible after invalidation."""
+        self.assertIsNone(find_conflict(self.car_id, START, START + timedelta(hours=1)))
+        db.session.execute(Rental.__table__.insert().values(cars_id=self.car_id, users_id=self.user_id,
+                                                            from_date=START, to_date=START + timedelta(hours=1),
+                                                            available_from=START + timedelta(hours=2)))
+        db.session.commit()
+        get_rental_index().invalidate(self.car_id)
+        self.assertIsNotNone(find_conflict(self.car_id, START, START + timedelta(hours=1)))
+
+    def test_calendar_ttl(self):
+        """Check if rentals saved by other processes are seen after the TTL and at once by load."""
+        start = datetime.now().replace(second=0, microsecond=0) + timedelta(days=1)
+        calendar = get_rental_calendar()
+        self.assertEqual(calendar.get(self.car_id).periods(), [])
+        db.session.execute(Rental.__table__.insert().values(cars_id=self.car_id, users_id=self.user_id,
+                                                            from_date=start, to_date=start + timedelta(hours=1),
+                                                            available_from=start + timedelta(hours=2)))
+        db.session.commit()
+        self.assertEqual(calendar.get(self.car_id).periods(), [])
+        self.assertEqual(len(calendar.load(self.car_id).periods()), 1)
+        with mock.patch('app.booking.calendar.time.monotonic', return_value=time.monotonic() + calendar.ttl + 1):
+            self.assertEqual(len(calendar.get(self.car_id).periods()), 1)
+
+
+class SqlOverlapTestCase(OverlapBackendMixin, unittest.TestCase):
+    """Test overlap checks answered by the database."""
+    backend = 'sql'
+
+    def test_invalidate(self):
+        """Check if changes made outside the session are visible without invalidation."""
+        db.session.execute(Rental.__table__.insert().values(cars_id=self.car_id, users_id=self.user_id,
+                                                            from_date=START, to_date=START + timedelta(hours=1),
+                                                            available_from=START + timedelta(hours=2)))
+        db.session.commit()
+        self.assertIsNotNone(find_conflict(self.car_id, START, START + timedelta(hours=1)))
+
+    def test_is_free(self):
+        """Check EXISTS query."""
+        self.add_rental(START)
+        self.assertTrue(is_free(self.car_id, START - timedelta(hours=2), START - timedelta(minutes=1)))
+        self.assertFalse(is_free(self.car_id, START - timedelta(hours=2), START))
+        self.assertFalse(is_free(self.car_id, START + timedelta(hours=2), START + timedelta(hours=3)))
+        self.assertTrue(is_free(self.car_id + 1, START, START + timedelta(hours=3)))
+
+    def test_earliest_conflict(self):
+        """Check if the earliest conflicting rental is returned."""
+        self.add_rental(START + timedelta(hours=10))
+        self.add_rental(START)
+        self.assertEqual(find_conflict(self.car_id, START - timedelta(hours=1), START + timedelta(hours=20)),
+                         (START, START + timedelta(hours=2)))
+
+    def test_index_is_used(self):
+        """Check with EXPLAIN QUERY PLAN if overlap query uses composite index."""
+        for day in range(20):
+            self.add_rental(START + timedelta(days=day))
+        query = db.session.query(exists().where(overlap_condition(self.car_id, START, START + timedelta(hours=3))))
+        compiled = query.statement.compile(dialect=db.engine.dialect)
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+        plan = db.session.connection().exec_driver_sql(' '.join(('EXPLAIN QUERY PLAN', str(compiled))),
+                                                       params).fetchall()
+        details = ' '.join(row[-1] for row in plan)
+        self.assertIn('SEARCH rentals USING', details)
+        self.assertIn('INDEX ix_rentals_cars_id_available_from_from_date (cars_id=? AND available_from>?)', details)
+
+
+class SlotsTestCase(OverlapBackendMixin, unittest.TestCase):
+    """Test overlap checks with the slot table."""
+    backend = 'slots'
+
+    def new_rental(self, from_date, hours=1):
+        """Create rental which is not added to db.
+
+        :param from_date: Beginning of the rental
+        :type from_date: datetime
+        :param hours: Length of the rental
+        :type hours: int
+        :return: Rental
+        :rtype: Rental
+        """
+        return Rental(cars_id=self.car_id, users_id=self.user_id, from_date=from_date,
+                      to_date=from_date + timedelta(hours=hours), available_from=from_date + timedelta(hours=hours + 1))
+
+    def test_slot_range(self):
+        """Check buckets of closed intervals."""
+        self.assertEqual(len(slot_range(START, START + timedelta(hours=2), 15)), 9)
+        self.assertEqual(len(slot_range(START + timedelta(minutes=14), START + timedelta(minutes=15), 15)), 2)
+        self.assertEqual(len(slot_range(START, START + timedelta(minutes=59), 1)), 60)
+
+    def test_slots_follow_rentals(self):
+        """Check if slots are written with rental and deleted with it."""
+        rental = self.add_rental(START)
+        self.assertEqual(RentalSlot.query.filter_by(cars_id=self.car_id).count(), 9)
+        db.session.delete(rental)
+        db.session.commit()
+        self.assertEqual(RentalSlot.query.count(), 0)
+
+    def test_slot_unique(self):
+        """Check if db rejects the second rental of the same bucket."""
+        self.add_rental(START)
+        with self.assertRaises(IntegrityError):
+            db.session.execute(RentalSlot.__table__.insert().values(cars_id=self.car_id, users_id=self.user_id,
+                                                                    from_date=START, bucket=slot_range(
+                                                                        START, START, 15).start))
+        db.session.rollback()
+
+    def test_race(self):
+        """Check if the later of two rentals which both passed the check is rejected on commit."""
+        first = self.new_rental(START)
+        second = self.new_rental(START + timedelta(minutes=30))
+        self.assertIsNone(find_conflict(self.car_id, first.from_date, first.to_date))
+        self.assertIsNone(find_conflict(self.car_id, second.from_date, second.to_date))
+        self.assertIsNone(reserve_rentals([first]))
+        self.assertEqual(reserve_rentals([second]), (START, START + timedelta(hours=2)))
+        self.assertEqual(Rental.query.count(), 1)
+
+    def test_conflict_on_commit(self):
+        """Check if the rental rejected by the slot table on commit is reported as a conflict."""
+        self.add_rental(START)
+        calls = []
+
+        def miss_first_check(car_id, start, end):
+            calls.append(car_id)
+            return None if len(calls) == 1 else slots.find_conflict(car_id, start, end)
+
+        with mock.patch.dict(OVERLAP_BACKENDS, {'slots': miss_first_check}):
+            self.assertEqual(reserve_rentals([self.new_rental(START + timedelta(hours=2, minutes=5))]),
+                             (START, START + timedelta(hours=2)))
+        # Rentals of one batch sharing a bucket
+        self.assertEqual(reserve_rentals([self.new_rental(START + timedelta(days=1, hours=2, minutes=5)),
+                                          self.new_rental(START + timedelta(days=1))]),
+                         (START + timedelta(days=1), START + timedelta(days=1, hours=2)))
+        self.assertEqual(Rental.query.count(), 1)
+
+    def test_book_suggested_windows(self):
+        """Check if windows and dates offered instead of a conflict are rounded to buckets and can be booked."""
+        self.add_rental(START + timedelta(minutes=5))
+        before, after = next_free_windows(self.car_id, START - timedelta(hours=3), timedelta(minutes=30), 2)
+        self.assertEqual(before, (START - timedelta(hours=3), START - timedelta(hours=1, minutes=1)))
+        self.assertEqual(after, (START + timedelta(hours=2, minutes=15), None))
+        self.assertEqual(available_dates((START + timedelta(minutes=5), START + timedelta(hours=2, minutes=5))),
+                         (before[1], after[0]))
+        self.assertIsNone(reserve_rentals([Rental(cars_id=self.car_id, users_id=self.user_id, from_date=before[0],
+                                                  to_date=before[1], available_from=before[1] + timedelta(hours=1))]))
+        self.assertIsNone(reserve_rentals([self.new_rental(after[0])]))
+        self.assertEqual(Rental.query.count(), 3)
+
+    def test_rebuild_slots(self):
+        """Check if slots of rentals saved with another backend are rebuilt."""
+        self.app.config['RENTAL_OVERLAP_BACKEND'] = 'sql'
+        self.add_rental(START)
+        self.app.config['RENTAL_OVERLAP_BACKEND'] = self.backend
+        self.assertIsNone(find_conflict(self.car_id, START, START + timedelta(hours=1)))
+        self.assertEqual(rebuild_slots(), 1)
+        self.assertIsNotNone(find_conflict(self.car_id, START, START + timedelta(hours=1)))
+
+
+class ReservationStressTestCase(unittest.TestCase):
+    """Test parallel reservations on a database file shared by threads."""
+    threads = 8
+    bookings = 250
+    cars = 3
+
+    def setUp(self):
+        self.db_dir = tempfile.mkdtemp()
+        self.app = create_app('testing')
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(self.db_dir, 'stress.sqlite')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        user = User(name='name', surname='surname', telephone=12345, password='password', email='test@test.com')
+        cars = [Car(name=f"Car {number}", price=123, year=2000, model="model", image="no_img.jpg")
+                for number in range(self.cars)]
+        db.session.add_all([user, *cars])
+        db.session.commit()
+        self.user_id = user.id
+        self.car_ids = [car.id for car in cars]
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.db_dir)
+
+    def book(self, seed, results, errors):
+        """Make overlapping reservations in a separate thread.
+
+        :param seed: Seed of random dates
+        :type seed: int
+        :param results: List of saved rentals for all threads
+        :type results: list
+        :param errors: List of exceptions raised in threads
+        :type errors: list
+        """
+        generator = random.Random(seed)
+        with self.app.app_context():
+            try:
+                for number in range(self.bookings):
+                    from_date = START + timedelta(hours=generator.randrange(200), minutes=seed)
+                    rental = Rental(cars_id=generator.choice(self.car_ids), users_id=self.user_id,
+                                    from_date=from_date, to_date=from_date + timedelta(hours=2),
+                                    available_from=from_date + timedelta(hours=3))
+                    if reserve_rentals([rental]) is None:
+                        results.append(number)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                db.session.remove()
+
+    def test_parallel_reservations(self):
+        """Check if parallel reservations don't overlap."""
+        results, errors = [], []
+        workers = [threading.Thread(target=self.book, args=(seed, results, errors)) for seed in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(Rental.query.count(), len(results))
+        self.assertGreater(len(results), 0)
+        first, second = db.aliased(Rental), db.aliased(Rental)
+        overlaps = db.session.query(first, second).filter(
+            first.cars_id == second.cars_id, first.from_date < second.from_date,
+            second.from_date <= first.available_from).count()
+        self.assertEqual(overlaps, 0)
@@ -5,7 +5,8 @@ import random
 from datetime import datetime, timedelta
 from werkzeug.datastructures import FileStorage
 from app import create_app, db
-from app.models import Role, Car, Rental, User, NewsPost
+from sqlalchemy import event
+from app.models import Role, Car, Rental, User, NewsPost, Comment
 from tests.api_functions import create_user, create_moderator, check_login_required_must_login, \
     check_admin_or_moderator_required
 
@@ -445,6 +446,75 @@ class FlaskClientMainTestCase(unittest.TestCase):
             self.assertIn("This field is required.", response_data)
             self.assertNotIn("Thank you for comment.", response_data)
 
+    def add_comments_to_db(self, post_id, parents):
+        """Method for adding comments of the post to db.
+
+        :param post_id: Post id
+        :type post_id: int
+        :param parents: Parent of each comment, comment ids start from 1
+        :type parents: list
+        """
+        users = User.query.all()
+        for number, parent in enumerate(parents, 1):
+            db.session.add(Comment(post_id=post_id, author_id=users[number % len(users)].id, text=f"comment {number}",
+                                   date=datetime(2030, 1, 1) + timedelta(minutes=number), parent_comment=parent))
+        db.session.commit()
+
+    def test_show_post_comments_queries(self):
+        """Test route for show_post, comments and authors are loaded with one query."""
+        self.add_posts_to_db()
+        post = NewsPost.query.first()
+        self.add_comments_to_db(post.id, [0, 1, 1, 2, 4, 0, 6, 0])
+        statements = []
+
+        def count_statement(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+        response = self.client.get(f'/news/{post.id}')
+        event.remove(db.engine, 'before_cursor_execute', count_statement)
+        response_data = response.get_data(as_text=True)
+        self.assertEqual(response.status_code, 200)
+        for number in range(1, 9):
+            self.assertIn(f"comment {number}", response_data)
+        comment_statements = [statement for statement in statements if 'FROM comments' in statement]
+        self.assertEqual(len(comment_statements), 1)
+        self.assertLessEqual(len(statements), 4)
+        self.assertNotIn("more repl", response_data)
+
+    def test_show_post_comments_limits(self):
+        """Test route for show_post, limited depth and number of replies."""
+        self.add_posts_to_db()
+        post = NewsPost.query.first()
+        # 1 -> 2 -> 3 -> 4, 1 -> 5, 1 -> 6, 7
+        self.add_comments_to_db(post.id, [0, 1, 2, 3, 1, 1, 0])
+        self.app.config['COMMENTS_TREE_MAX_DEPTH'] = 2
+        self.app.config['COMMENTS_TREE_MAX_CHILDREN'] = 2
+        response = self.client.get(f'/news/{post.id}')
+        response_data = response.get_data(as_text=True)
+        self.assertEqual(response.status_code, 200)
+        for number in (1, 2, 5, 7):
+            self.assertIn(f"comment {number}\n", response_data)
+        for number in (3, 4, 6):
+            self.assertNotIn(f"comment {number}\n", response_data)
+        self.assertIn("Show 1 more reply", response_data)
+        self.assertIn(f"/news/{post.id}?thread=1", response_data)
+        self.assertIn(f"/news/{post.id}?thread=2", response_data)
+
+        # Thread of the comment - the hidden replies are loaded on demand
+        response = self.client.get(f'/news/{post.id}?thread=2')
+        response_data = response.get_data(as_text=True)
+        self.assertEqual(response.status_code, 200)
+        for number in (2, 3):
+            self.assertIn(f"comment {number}\n", response_data)
+        for number in (1, 5, 7):
+            self.assertNotIn(f"comment {number}\n", response_data)
+        self.assertIn(f"/news/{post.id}?thread=3", response_data)
+
+        # Unknown thread - the whole post
+        response = self.client.get(f'/news/{post.id}?thread=100')
+        self.assertIn("comment 7\n", response.get_data(as_text=True))
+
     # Check pages @login_required decorator
     def test_login_required_decorator(self):
         """Test all routes with login_required decorator."""
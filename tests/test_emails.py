@@ -0,0 +1,81 @@
+"""This module stores tests for validation of emails."""
+import threading
+import unittest
+from unittest import mock
+from app import create_app, db
+from app.emails import EmailVerifier, StubResolver, check_email, get_email_verifier
+from app.exceptions import ValidationError
+from app.models import Role
+
+
+class EmailsTestCase(unittest.TestCase):
+    """Test syntax checks and the background check of deliverability."""
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.resolver = StubResolver({'example.com': ['mx.example.com']})
+        self.app.config['EMAIL_CHECK_DELIVERABILITY'] = True
+        self.app.config['EMAIL_DNS_RESOLVER'] = self.resolver
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        get_email_verifier().shutdown()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_check_email_syntax(self):
+        """Test that only the syntax is checked in the request."""
+        with mock.patch('email_validator.dns.resolver.get_default_resolver') as default_resolver:
+            check_email('user@example.com')
+            check_email('user@unknown.test')
+            for email in ('ee.test.com', 'user@', '@example.com', 'user@exa mple.com'):
+                with self.assertRaises(ValidationError) as error:
+                    check_email(email)
+                self.assertEqual(error.exception.args, ('Email is incorrect.', 'email'))
+        default_resolver.assert_not_called()
+
+    def test_registration_does_not_wait_for_dns(self):
+        """Test that registration doesn't wait for the check of deliverability."""
+        started, release = threading.Event(), threading.Event()
+        resolve = self.resolver.resolve
+
+        def slow_resolve(domain, record):
+            started.set()
+            release.wait()
+            return resolve(domain, record)
+
+        with mock.patch.object(self.resolver, 'resolve', side_effect=slow_resolve):
+            response = self.client.post('/api/v1/auth/register/', json={
+                'name': 'name', 'surname': 'surname', 'password': '123456', 'email': 'user@example.com',
+                'telephone': 1234})
+            self.assertEqual(response.status_code, 201)
+            self.assertTrue(started.wait(5))
+            self.assertIsNone(get_email_verifier().deliverable('example.com'))
+            release.set()
+        get_email_verifier().schedule('example.com').result(5)
+        self.assertTrue(get_email_verifier().deliverable('example.com'))
+
+    def test_verifier_cache(self):
+        """Test that results are cached per domain for the TTL."""
+        verifier = EmailVerifier(ttl=60, timeout=1, resolver=self.resolver)
+        self.assertTrue(verifier.schedule('example.com').result(5))
+        with self.assertLogs(self.app.logger, 'WARNING'):
+            logged_verifier = EmailVerifier(ttl=60, timeout=1, resolver=self.resolver, logger=self.app.logger)
+            self.assertFalse(logged_verifier.schedule('unknown.test').result(5))
+        logged_verifier.shutdown()
+        self.assertIsNone(verifier.schedule('example.com'))
+        self.assertEqual(self.resolver.queries.count(('example.com', 'MX')), 1)
+        self.assertTrue(verifier.deliverable('example.com'))
+        self.assertIsNone(verifier.deliverable('other.test'))
+
+        with mock.patch('app.emails.time.monotonic', return_value=10 ** 9):
+            self.assertIsNone(verifier.deliverable('example.com'))
+            verifier.schedule('example.com').result(5)
+        self.assertEqual(self.resolver.queries.count(('example.com', 'MX')), 2)
+        verifier.shutdown()
+
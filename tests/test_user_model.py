@@ -1,7 +1,12 @@
 """This module stores tests for User model."""
+import gc
+import threading
 import unittest
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import generate_password_hash
 from app import create_app, db
 from app.models import User, AnonymousUser, Role, Permission
+from app.passwords import PasswordHasher, get_password_hasher
 
 
 class UserModelTestCase(unittest.TestCase):
@@ -42,6 +47,78 @@ class UserModelTestCase(unittest.TestCase):
         test_user2 = User(name="", surname="", email="john2@email.com", telephone="123", password='check_password')
         self.assertTrue(test_user1.password_hash != test_user2.password_hash)
 
+    def test_password_hash_method(self):
+        """Check if all hashes are computed with the configured method."""
+        method = self.app.config['PASSWORD_HASH_METHOD']
+        test_user = User(password='check_password')
+        self.assertTrue(test_user.password_hash.startswith(method + '$'))
+        salt = test_user.password_hash.split('$')[1]
+        self.assertEqual(len(salt), self.app.config['PASSWORD_SALT_LENGTH'])
+
+    def test_password_rehash(self):
+        """Check if an outdated hash is computed again after the correct password."""
+        old_hash = generate_password_hash('check_password', method='pbkdf2:sha256', salt_length=8)
+        test_user = User(email='john@mail.com', password_hash=old_hash)
+        self.assertFalse(test_user.verify_password('wrong_password'))
+        self.assertEqual(test_user.password_hash, old_hash)
+        self.assertTrue(test_user.verify_password('check_password'))
+        self.assertNotEqual(test_user.password_hash, old_hash)
+        self.assertFalse(get_password_hasher().needs_rehash(test_user.password_hash))
+        new_hash = test_user.password_hash
+        self.assertTrue(test_user.verify_password('check_password'))
+        self.assertEqual(test_user.password_hash, new_hash)
+
+    def test_password_rehash_saved(self):
+        """Check if the session is modified only when the hash is computed again."""
+        old_hash = generate_password_hash('check_password', method='pbkdf2:sha256', salt_length=8)
+        test_user = User(name='name', surname='surname', telephone=12345, email='john@mail.com',
+                         password_hash=old_hash)
+        db.session.add(test_user)
+        db.session.commit()
+        self.assertTrue(test_user.verify_password('check_password'))
+        self.assertTrue(db.session.is_modified(test_user))
+        db.session.commit()
+        self.assertNotEqual(User.query.get(test_user.id).password_hash, old_hash)
+        self.assertTrue(test_user.verify_password('check_password'))
+        self.assertFalse(db.session.is_modified(test_user))
+
+    def test_password_hasher_queue(self):
+        """Check if the hasher rejects passwords when the queue is full."""
+        hasher = PasswordHasher('pbkdf2:sha256:1000', 16, workers=1, queue=0, timeout=0.01)
+        started, release = threading.Event(), threading.Event()
+
+        def block():
+            started.set()
+            release.wait()
+
+        thread = threading.Thread(target=hasher._run, args=(block,))
+        thread.start()
+        try:
+            started.wait()
+            with self.assertRaises(ServiceUnavailable):
+                hasher.hash('check_password')
+        finally:
+            release.set()
+            thread.join()
+        self.assertTrue(hasher.verify(hasher.hash('check_password'), 'check_password'))
+        hasher.shutdown()
+
+    def test_password_hasher_shutdown(self):
+        """Check if threads of the pool are stopped with the application."""
+        app = create_app('testing')
+        with app.app_context():
+            hasher = get_password_hasher()
+            hasher.hash('check_password')
+        executor = hasher._executor
+        threads = list(executor._threads)
+        self.assertTrue(threads)
+        del app
+        gc.collect()
+        self.assertTrue(executor._shutdown)
+        for thread in threads:
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+
     def test_user_role(self):
         """Check permissions of User (default role)."""
         u = User(email='john@mail.com', password='pass')